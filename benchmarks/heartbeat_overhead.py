@@ -0,0 +1,50 @@
+"""
+Benchmark the per task run overhead of HeartbeatMixin.heartbeat for a no-op task.
+
+Runs a task that does nothing through heartbeat in its isolated mode (a billiard
+process per run that runs the task in a thread) and in its in-process mode (the
+task runs in the calling thread and a HeartbeatTimer thread sends heartbeats).
+Heartbeats are not written to a DB so only the cost of running the task is measured.
+
+Usage: python benchmarks/heartbeat_overhead.py [runs]
+"""
+import logging
+import sys
+import time
+
+from propel.settings import logger
+from propel.utils.general import HeartbeatMixin
+
+
+class NoDbHeartbeat(HeartbeatMixin):
+    def _update_heartbeat(self, heartbeat, heartbeat_model_kwargs):
+        return heartbeat
+
+
+def no_op_task(task_run_params):
+    pass
+
+
+def measure(runs, isolate):
+    heartbeat_mixin = NoDbHeartbeat()
+    start = time.time()
+    for task_run_id in range(runs):
+        heartbeat_mixin.heartbeat(
+            thread_function=no_op_task,
+            thread_args=[{'task_run_id': task_run_id}],
+            heartbeat_model_kwargs={'task_run_id': task_run_id},
+            isolate=isolate
+        )
+    return (time.time() - start) / runs
+
+
+def main(runs):
+    logger.setLevel(logging.ERROR)
+    isolated_seconds = measure(runs, isolate=True)
+    in_process_seconds = measure(runs, isolate=False)
+    print('Isolated:   {:.3f} ms per task run'.format(isolated_seconds * 1000))
+    print('In-process: {:.3f} ms per task run'.format(in_process_seconds * 1000))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,111 @@
+"""
+Benchmark the scheduler's lookup of the latest run of every task.
+
+Fills a SQLite database with task_runs rows spread over a number of tasks and
+times, per scheduler tick:
+
+- the original GROUP BY over task_runs, without and with the (task_id, run_ds) index
+- Scheduler._query_last_task_runs, the index-backed reconcile query
+- Scheduler._get_last_task_runs between reconciles, served from memory
+
+Usage: python benchmarks/scheduler_last_runs.py [rows] [tasks] [db_path]
+
+rows defaults to 10M, which takes a few minutes to generate. An existing
+db_path is reused so the rows are only generated once.
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func
+
+from propel import settings
+from propel.models import Base, Tasks, TaskRuns
+from propel.scheduler import Scheduler
+from propel.settings import logger
+from propel.utils.general import chunked
+from propel.utils.state import State
+
+INSERT_CHUNK_SIZE = 100000
+
+
+def task_run_rows(rows, tasks):
+    start_ds = datetime(2018, 1, 1)
+    for i in range(rows):
+        yield {
+            'task_id': i % tasks + 1,
+            'state': State.SUCCESS,
+            'run_ds': start_ds + timedelta(minutes=i // tasks),
+        }
+
+
+def create_database(engine, rows, tasks):
+    Base.metadata.create_all(engine, tables=[Tasks.__table__, TaskRuns.__table__])
+    connection = engine.connect()
+    if connection.execute(func.count(TaskRuns.id).select()).scalar() == rows:
+        return
+    connection.execute(TaskRuns.__table__.delete())
+    connection.execute(Tasks.__table__.delete())
+    connection.execute(Tasks.__table__.insert(), [
+        {
+            'id': task_id,
+            'task_name': 'task{}'.format(task_id),
+            'task_type': 'NewsDownload',
+            'task_args': 'https://example.com/rss',
+            'run_frequency_seconds': 60,
+        }
+        for task_id in range(1, tasks + 1)
+    ])
+    start = time.time()
+    for chunk in chunked(task_run_rows(rows, tasks), INSERT_CHUNK_SIZE):
+        connection.execute(TaskRuns.__table__.insert(), chunk)
+    print('Inserted {} task_runs for {} tasks in {:.1f}s'.format(rows, tasks, time.time() - start))
+
+
+def timed(description, function, rounds=3):
+    elapsed = list()
+    for _ in range(rounds):
+        start = time.time()
+        function()
+        elapsed.append(time.time() - start)
+    print('{:<50} {:>10.4f}s'.format(description, min(elapsed)))
+
+
+def main(rows, tasks, db_path):
+    logger.setLevel(logging.ERROR)
+    engine = create_engine('sqlite:///{}'.format(db_path))
+    create_database(engine, rows, tasks)
+    index, = [
+        index
+        for index in TaskRuns.__table__.indexes
+        if index.name == 'uq_task_runs_task_id_run_ds'
+    ]
+    settings.Session.configure(bind=engine)
+
+    def group_by():
+        session = settings.Session()
+        list(session.query(TaskRuns.task_id, func.max(TaskRuns.run_ds)).group_by(TaskRuns.task_id))
+        settings.Session.remove()
+
+    index.drop(engine)
+    timed('GROUP BY task_id without index', group_by)
+    index.create(engine)
+    timed('GROUP BY task_id with index', group_by)
+    timed('Scheduler._query_last_task_runs', Scheduler._query_last_task_runs)
+    scheduler = Scheduler()
+    scheduler._get_last_task_runs()
+    timed('Scheduler._get_last_task_runs between reconciles', scheduler._get_last_task_runs)
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10000000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 2000,
+        sys.argv[3] if len(sys.argv) > 3 else os.path.join(
+            tempfile.gettempdir(),
+            'propel_scheduler_benchmark.db'
+        )
+    )
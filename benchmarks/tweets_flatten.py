@@ -0,0 +1,108 @@
+"""
+Benchmark flattening of a user_timeline page into Tweets rows.
+
+Builds a synthetic 200 tweet page (the max count returned by statuses/user_timeline)
+with a mix of plain tweets, replies, quoted tweets and retweets carrying media, and
+reports the number of tweets per second Tweets.load_into_db can flatten. The DB insert
+is replaced with a no-op session so only the extraction is measured.
+
+Usage: python benchmarks/tweets_flatten.py [rounds]
+"""
+import logging
+import os
+import sys
+import time
+
+from propel.models import Tweets
+from propel.settings import logger
+
+PAGE_SIZE = 200
+
+
+class NullSession(object):
+    def bulk_save_objects(self, objects):
+        pass
+
+    def bulk_insert_mappings(self, mapper, mappings):
+        pass
+
+
+def _media(media_type):
+    media = {
+        'type': media_type,
+        'media_url': 'http://pbs.twimg.com/media/{}.jpg'.format(media_type),
+    }
+    if media_type == 'video':
+        media['video_info'] = {
+            'variants': [
+                {'content_type': 'application/x-mpegURL', 'url': 'https://video.twimg.com/pl.m3u8'},
+                {'content_type': 'video/mp4', 'url': 'https://video.twimg.com/vid/1.mp4'},
+                {'content_type': 'video/mp4', 'url': 'https://video.twimg.com/vid/2.mp4'},
+            ]
+        }
+    return media
+
+
+def _status(tweet_id, screen_name, media_type=None):
+    status = {
+        'id': tweet_id,
+        'created_at': 'Sat Jul 28 22:06:12 +0000 2018',
+        'full_text': 'Tweet number {} with a link https://t.co/abc'.format(tweet_id),
+        'entities': {
+            'urls': [
+                {'expanded_url': 'https://example.com/{}'.format(tweet_id)},
+                {'expanded_url': 'https://example.org/{}'.format(tweet_id)},
+            ]
+        },
+        'favorite_count': tweet_id % 97,
+        'retweet_count': tweet_id % 13,
+        'user': {'id': 1000 + len(screen_name), 'screen_name': screen_name},
+        'in_reply_to_status_id': None,
+        'in_reply_to_user_id': None,
+        'in_reply_to_screen_name': None,
+    }
+    if media_type:
+        status['extended_entities'] = {'media': [_media(media_type), _media('photo')]}
+    return status
+
+
+def timeline_page():
+    tweets = list()
+    for i in range(PAGE_SIZE):
+        tweet_id = 1000000 + i
+        kind = i % 4
+        tweet = _status(tweet_id, 'propel', media_type=('photo', 'video', None, None)[kind])
+        if kind == 1:
+            tweet['in_reply_to_status_id'] = tweet_id - 1
+            tweet['in_reply_to_user_id'] = 42
+            tweet['in_reply_to_screen_name'] = 'someone'
+        elif kind == 2:
+            tweet['quoted_status'] = _status(tweet_id + 5000, 'quoted', media_type='video')
+        elif kind == 3:
+            tweet['retweeted_status'] = _status(tweet_id + 9000, 'retweeted', media_type='photo')
+        tweets.append(tweet)
+    return tweets
+
+
+def main(rounds):
+    logger.setLevel(logging.ERROR)
+    page = timeline_page()
+    session = NullSession()
+    # Failed extractions print a traceback. Hiding it so terminal IO is not measured
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        for _ in range(rounds):
+            Tweets.load_into_db(page, session=session)
+        elapsed = time.time() - start
+    finally:
+        sys.stderr = stderr
+    tweets = rounds * PAGE_SIZE
+    print('Flattened {} tweets in {:.3f}s: {:.0f} tweets/second'.format(
+        tweets, elapsed, tweets / elapsed
+    ))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
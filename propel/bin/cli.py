@@ -1,6 +1,9 @@
 import subprocess
+from datetime import datetime
 from propel.executors import Executor
-from propel.scheduler import Scheduler
+from propel.models import Tasks, Tweets
+from propel.scheduler import BackfillPlanner, Scheduler
+from propel.utils.db import create_session
 from propel.settings import logger
 from propel.www.app import create_app
 
@@ -31,6 +34,11 @@ def cli_factory(cli_args):
     elif subparser_name == 'executor':
         if cli_args.get('stop'):
             logger.info('Stopping Executor Worker')
+        elif Executor.runs_in_scheduler:
+            logger.info(
+                '{} runs task runs in the scheduler. No workers to start'
+                .format(Executor.__name__)
+            )
         else:
             logger.info("Starting Executor Worker")
             executor = Executor()
@@ -48,5 +56,30 @@ def cli_factory(cli_args):
                 .format(rabbitmq_process.pid)
             )
             rabbitmq_process.communicate()
+    elif subparser_name == 'ingest':
+        file_paths = cli_args.get('files')
+        logger.info('Ingesting tweets from {}'.format(file_paths))
+        _, failed_chunks = Tweets.bulk_load_files(
+            file_paths,
+            chunk_size=cli_args.get('chunk_size'),
+            processes=cli_args.get('processes')
+        )
+        if failed_chunks:
+            logger.error('{} chunks failed to load. See log for errors'.format(failed_chunks))
+    elif subparser_name == 'backfill':
+        start_ds = datetime.strptime(cli_args.get('start_ds'), '%Y-%m-%dT%H:%M:%S')
+        end_ds = datetime.strptime(cli_args.get('end_ds'), '%Y-%m-%dT%H:%M:%S')
+        task_ids = cli_args.get('task_ids')
+        with create_session() as session:
+            tasks = session.query(Tasks).filter(Tasks.id.in_(task_ids)).all()
+        missing_task_ids = set(task_ids) - set(task.id for task in tasks)
+        if missing_task_ids:
+            raise ValueError('Tasks {} not found'.format(sorted(missing_task_ids)))
+        logger.info('Backfilling tasks {} from {} to {}'.format(task_ids, start_ds, end_ds))
+        backfill_planner = BackfillPlanner(
+            max_active_runs_per_task=cli_args.get('max_active_runs')
+        )
+        queued_runs = backfill_planner.backfill(tasks, start_ds, end_ds, Executor())
+        logger.info('Backfill queued {} runs'.format(queued_runs))
     else:
         raise NotImplementedError()
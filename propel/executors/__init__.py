@@ -11,6 +11,9 @@ def configure_executor():
     if executor_name == 'Celery':
         from propel.executors.celery_executor import CeleryExecutor
         Executor = CeleryExecutor
+    elif executor_name == 'Local':
+        from propel.executors.local_executor import LocalExecutor
+        Executor = LocalExecutor
     else:
         raise NotImplementedError('Executor type {} not defined'.format(executor_name))
     return Executor
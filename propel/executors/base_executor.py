@@ -1,30 +1,58 @@
+import threading
+from datetime import datetime, timedelta
 from propel import configuration
 from propel.models import TaskRuns
 from propel.settings import logger
 from propel.utils.db import commit_db_object, provide_session
+from propel.utils.events import get_task_run_events
 from propel.utils.general import HeartbeatMixin
+from propel.utils.retries import RetryPolicy
 from propel.utils.state import State
 
 
 class BaseExecutor(HeartbeatMixin):
+    # Executors whose workers are started by the process queueing task runs
+    # have no separate workers to start
+    runs_in_scheduler = False
 
     def _get_task_class_factory(self, task_run_params):
         task_type = task_run_params['task_type']
         if task_type == 'TwitterExtract':
             from propel.tasks.twitter_extract import TwitterExtract
             task_class = TwitterExtract
+        elif task_type == 'TwitterBatchExtract':
+            from propel.tasks.twitter_batch_extract import TwitterBatchExtract
+            task_class = TwitterBatchExtract
         elif task_type == 'NewsDownload':
             from propel.tasks.news_download import NewsDownload
             task_class = NewsDownload
+        elif task_type == 'NewsBatchDownload':
+            from propel.tasks.news_batch_download import NewsBatchDownload
+            task_class = NewsBatchDownload
         else:
             raise NotImplementedError('Task type {} not defined'.format(task_type))
         return task_class
 
     @provide_session
     def execute(self, task_run_params, session=None):
+        """
+        Run a task run. Skipped if the try in task_run_params already started
+
+        :return: State the task run finished with. None if it was skipped
+        :rtype: str
+        """
         logger.info('Running TaskRun {}'.format(task_run_params))
         task_run_id = task_run_params['task_run_id']
+        # First tries are queued without a try_number
+        try_number = task_run_params.get('try_number', 1)
+        if not self._start_task_run(task_run_id, try_number, session=session):
+            logger.warning(
+                'Try {} of TaskRun {} already started or is no longer queued. Skipping it'
+                .format(try_number, task_run_id)
+            )
+            return None
         task_run = session.query(TaskRuns).filter(TaskRuns.id == task_run_id).first()
+        retry_policy = RetryPolicy.for_task_run(task_run, task_run_params['task_type'])
         log_file = (
                 configuration.get('log', 'tasks_log_location')
                 + str(task_run_id)
@@ -32,24 +60,110 @@ class BaseExecutor(HeartbeatMixin):
         )
         task_class = self._get_task_class_factory(task_run_params)
         try:
-            task_run.state = State.RUNNING
-            commit_db_object(task_run)
+            # Runs of DAG tasks have the task's id in the DAG. Other runs are named after their task
+            task = task_class(
+                task_id=task_run_params.get('task_id', task_run_params.get('task_name'))
+            )
             self.heartbeat(
-                thread_function=task_class().execute,
+                thread_function=task.execute,
                 thread_args=[task_run_params],
                 log_file=log_file,
-                heartbeat_model_kwargs={'task_run_id': task_run_id}
+                heartbeat_model_kwargs={'task_run_id': task_run_id},
+                isolate=configuration.get('core', 'isolate_task_runs').lower() == 'true'
             )
-        # Update task status to Error for any exception including KeyboardInterrupt and SystemExit
+        # Retry or update task status to Error for any exception including
+        # KeyboardInterrupt and SystemExit
         except BaseException:
-            task_run.state = State.FAILED
-            commit_db_object(task_run)
+            if retry_policy.should_retry(try_number):
+                state = State.UP_FOR_RETRY
+                self._retry(
+                    task_run,
+                    task_run_params,
+                    try_number,
+                    retry_policy.get_delay_seconds(try_number)
+                )
+            else:
+                state = State.FAILED
+                task_run.state = state
+                commit_db_object(task_run)
+                get_task_run_events().publish(task_run_id, state)
         else:
-            task_run.state = State.SUCCESS
+            state = State.SUCCESS
+            task_run.state = state
             commit_db_object(task_run)
+            get_task_run_events().publish(task_run_id, state)
+        return state
+
+    @staticmethod
+    def _start_task_run(task_run_id, try_number, session):
+        """
+        Set a task run to running if it still waits for try try_number. A try
+        can be queued twice, e.g. by a delayed retry and by the zombie reaper
+        once the retry is overdue, and only one of them may run it
+
+        :return: True if the task run was set to running
+        :rtype: bool
+        """
+        started_task_runs = (
+            session
+            .query(TaskRuns)
+            .filter(TaskRuns.id == task_run_id)
+            .filter(TaskRuns.state.in_([State.QUEUED, State.UP_FOR_RETRY]))
+            .filter(TaskRuns.try_number == try_number)
+            .update({TaskRuns.state: State.RUNNING}, synchronize_session=False)
+        )
+        session.commit()
+        return started_task_runs == 1
+
+    def _retry(self, task_run, task_run_params, try_number, delay_seconds):
+        """
+        Queue the next try of a failed task run after delay_seconds. The worker
+        slot is freed right away as the executor holds the run until then
+        """
+        task_run.state = State.UP_FOR_RETRY
+        task_run.try_number = try_number + 1
+        task_run.next_try_at = datetime.utcnow() + timedelta(seconds=delay_seconds)
+        commit_db_object(task_run)
+        logger.warning(
+            'TaskRun {} failed. Try {} starts in {:.0f} seconds'
+            .format(task_run_params['task_run_id'], try_number + 1, delay_seconds)
+        )
+        self.execute_async_later(dict(task_run_params, try_number=try_number + 1), delay_seconds)
 
     def execute_async(self, task_run_params):
-        return NotImplementedError()
+        raise NotImplementedError()
+
+    def execute_async_later(self, task_run_params, delay_seconds):
+        """
+        Queue a task run after delay_seconds without blocking. Executors whose
+        queue supports delayed messages should override this
+        """
+        timer = threading.Timer(delay_seconds, self.execute_async, args=[task_run_params])
+        timer.daemon = True
+        timer.start()
+
+    def execute_async_batch(self, task_runs_params):
+        """
+        Queue many task runs. Executors that can hand a batch to their queue in
+        one call should override this
+        """
+        for task_run_params in task_runs_params:
+            self.execute_async(task_run_params)
+
+    def get_task_run_events(self):
+        """
+        Get the channel on which the scheduler waits for task runs of this
+        executor to finish
+
+        :rtype: propel.utils.events.TaskRunEvents
+        """
+        return get_task_run_events()
 
     def start(self, concurrency):
-        return NotImplementedError()
+        raise NotImplementedError()
+
+    def end(self):
+        """
+        Stop anything the executor started in the calling process
+        """
+        pass
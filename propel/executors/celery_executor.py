@@ -1,17 +1,26 @@
 import subprocess
-from celery import Celery
+from celery import Celery, group
+from celery.signals import worker_init
 from propel import configuration
 from propel.executors.base_executor import BaseExecutor
 from propel.settings import logger
+from propel.utils.general import HeartbeatTimer
 
 
 celery_broker = configuration.get('celery', 'broker')
 celery_app = Celery(__name__, broker=celery_broker)
 
 
+@worker_init.connect
+def collect_heartbeats(**kwargs):
+    # Pool processes are forked after this, so the worker sends the heartbeats of all of them
+    HeartbeatTimer.get_instance().collect_from_child_processes()
+
+
 @celery_app.task
 def execute_celery_task(task_run_params):
-    BaseExecutor().execute(task_run_params)
+    # Retries of failed runs are queued through the executor the run came from
+    CeleryExecutor().execute(task_run_params)
 
 
 class CeleryExecutor(BaseExecutor):
@@ -21,6 +30,22 @@ class CeleryExecutor(BaseExecutor):
         execute_celery_task.apply_async(args=[task_run_params, ])
         logger.debug('TaskRun {} should run soon'.format(task_run_params))
 
+    def execute_async_later(self, task_run_params, delay_seconds):
+        # Broker holds the message until it is due so no worker waits for it
+        logger.info(
+            'Adding TaskRun {} to celery queue in {:.0f} seconds'
+            .format(task_run_params, delay_seconds)
+        )
+        execute_celery_task.apply_async(args=[task_run_params, ], countdown=delay_seconds)
+
+    def execute_async_batch(self, task_runs_params):
+        # A group publishes all the messages over one pooled producer connection
+        logger.info('Adding {} TaskRuns to celery queue'.format(len(task_runs_params)))
+        group(
+            execute_celery_task.s(task_run_params)
+            for task_run_params in task_runs_params
+        ).apply_async()
+
     def start(self, concurrency):
         start_worker_cmd = [
             "celery",
@@ -0,0 +1,167 @@
+import billiard
+import heapq
+import threading
+import time
+from itertools import count
+from six.moves import queue
+
+from propel import configuration, settings
+from propel.executors.base_executor import BaseExecutor
+from propel.settings import logger
+from propel.utils.events import TaskRunEvents
+from propel.utils.general import HeartbeatTimer
+from propel.utils.state import State
+
+
+class QueueTaskRunEvents(TaskRunEvents):
+    """
+    Task run events passed from the LocalExecutor's worker processes to the
+    scheduler over an in-memory queue
+    """
+
+    def __init__(self):
+        self._queue = billiard.Queue()
+
+    def publish(self, task_run_id, state):
+        self._queue.put((task_run_id, state))
+
+    def wait(self, timeout_seconds):
+        try:
+            events = [self._queue.get(timeout=timeout_seconds)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                return events
+
+
+def _run_task_runs(executor, task_queue, task_run_events):
+    """
+    Run task runs from task_queue until a None is received
+    """
+    # Connections of the parent's pool can not be shared with a forked process
+    settings.Engine.dispose()
+    while True:
+        task_run_params = task_queue.get()
+        if task_run_params is None:
+            return
+        try:
+            state = executor.execute(task_run_params)
+        except Exception as e:
+            logger.exception(e)
+            state = State.FAILED
+        if state is not None:
+            task_run_events.publish(task_run_params['task_run_id'], state)
+
+
+class LocalExecutor(BaseExecutor):
+    """
+    Runs task runs in a fixed number of worker processes started by the
+    process that queues them, usually the scheduler. Task runs wait in an
+    in-memory queue and workers report finished task runs back over another
+    one, so no broker or worker fleet is needed.
+    """
+    runs_in_scheduler = True
+
+    def __init__(self, parallelism=None):
+        if parallelism is None:
+            parallelism = int(configuration.get('local_executor', 'parallelism'))
+        self.parallelism = parallelism
+        self._task_queue = None
+        # (due time, task run params) of task runs queued later. Workers put their
+        # retries here and a thread of this process moves them to the task queue once due
+        self._delayed_task_queue = None
+        self._delayed_task_thread = None
+        self._task_run_events = QueueTaskRunEvents()
+        self._workers = list()
+
+    def execute_async(self, task_run_params):
+        # Workers are forked with the queues so they can queue task runs too
+        if self._task_queue is None:
+            self.start(self.parallelism)
+        logger.info('Adding TaskRun {} to local queue'.format(task_run_params))
+        self._task_queue.put(task_run_params)
+
+    def execute_async_later(self, task_run_params, delay_seconds):
+        if self._delayed_task_queue is None:
+            self.start(self.parallelism)
+        self._delayed_task_queue.put((time.time() + delay_seconds, task_run_params))
+
+    def _queue_delayed_task_runs(self):
+        """
+        Move task runs of the delayed task queue to the task queue once they are
+        due. Stops when a None is received
+        """
+        delayed_task_runs = list()
+        sequence = count()
+        while True:
+            timeout = max(delayed_task_runs[0][0] - time.time(), 0) if delayed_task_runs else None
+            try:
+                delayed_task_run = self._delayed_task_queue.get(timeout=timeout)
+            except queue.Empty:
+                delayed_task_run = False
+            if delayed_task_run is None:
+                if delayed_task_runs:
+                    logger.warning(
+                        'Dropping {} delayed TaskRuns. They are queued again once overdue'
+                        .format(len(delayed_task_runs))
+                    )
+                return
+            if delayed_task_run:
+                due_at, task_run_params = delayed_task_run
+                # Sequence keeps the heap from comparing params of runs due at the same time
+                heapq.heappush(delayed_task_runs, (due_at, next(sequence), task_run_params))
+            while delayed_task_runs and delayed_task_runs[0][0] <= time.time():
+                _, _, task_run_params = heapq.heappop(delayed_task_runs)
+                logger.info('Adding delayed TaskRun {} to local queue'.format(task_run_params))
+                self._task_queue.put(task_run_params)
+
+    def get_task_run_events(self):
+        return self._task_run_events
+
+    def start(self, concurrency):
+        """
+        Start concurrency worker processes. Returns right away as task runs
+        are queued by the calling process
+        """
+        self._task_queue = billiard.Queue()
+        self._delayed_task_queue = billiard.Queue()
+        self._delayed_task_thread = threading.Thread(target=self._queue_delayed_task_runs)
+        self._delayed_task_thread.daemon = True
+        self._delayed_task_thread.start()
+        # Heartbeats of the task runs of all workers are sent from this process
+        HeartbeatTimer.get_instance().collect_from_child_processes()
+        for _ in range(concurrency):
+            worker = billiard.Process(
+                target=_run_task_runs,
+                args=(self, self._task_queue, self._task_run_events)
+            )
+            worker.start()
+            self._workers.append(worker)
+        logger.info(
+            'Started {} with {} workers. PIDs: {}'
+            .format(
+                self.__class__.__name__,
+                concurrency,
+                [process.pid for process in self._workers]
+            )
+        )
+
+    def end(self):
+        """
+        Stop the workers once the task runs already queued are done
+        """
+        if not self._workers:
+            return
+        self._delayed_task_queue.put(None)
+        self._delayed_task_thread.join()
+        for _ in self._workers:
+            self._task_queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = list()
+        self._task_queue = None
+        self._delayed_task_queue = None
+        logger.info('Stopped {}'.format(self.__class__.__name__))
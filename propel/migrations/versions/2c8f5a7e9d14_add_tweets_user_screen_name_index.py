@@ -0,0 +1,28 @@
+"""Add index on tweets user_screen_name and tweet_id
+
+Revision ID: 2c8f5a7e9d14
+Revises: e3a1c9b47f02
+Create Date: 2026-10-18 14:31:08.264107
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '2c8f5a7e9d14'
+down_revision = 'e3a1c9b47f02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_tweets_user_screen_name_tweet_id',
+        'tweets',
+        ['user_screen_name', 'tweet_id'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_tweets_user_screen_name_tweet_id', table_name='tweets')
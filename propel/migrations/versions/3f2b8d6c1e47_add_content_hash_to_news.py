@@ -0,0 +1,24 @@
+"""Add content_hash to News
+
+Revision ID: 3f2b8d6c1e47
+Revises: 61085a34cb78
+Create Date: 2026-10-18 10:12:41.302117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2b8d6c1e47'
+down_revision = '61085a34cb78'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('news', sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    op.drop_column('news', 'content_hash')
@@ -0,0 +1,27 @@
+"""Add task_runs try_number
+
+Revision ID: 3f9a7c2e5b16
+Revises: 6b2e8d4f1a95
+Create Date: 2026-10-18 19:48:05.271364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a7c2e5b16'
+down_revision = '6b2e8d4f1a95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'task_runs',
+        sa.Column('try_number', sa.Integer(), nullable=False, server_default='1')
+    )
+
+
+def downgrade():
+    op.drop_column('task_runs', 'try_number')
@@ -0,0 +1,28 @@
+"""Add index on task_runs state and task_id
+
+Revision ID: 4a9c7e1d3b58
+Revises: 8e4d2b6a1f37
+Create Date: 2026-10-18 15:52:19.406127
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4a9c7e1d3b58'
+down_revision = '8e4d2b6a1f37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_task_runs_state_task_id',
+        'task_runs',
+        ['state', 'task_id'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_task_runs_state_task_id', table_name='task_runs')
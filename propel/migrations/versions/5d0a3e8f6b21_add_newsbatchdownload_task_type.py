@@ -0,0 +1,36 @@
+"""Add NewsBatchDownload task type
+
+Revision ID: 5d0a3e8f6b21
+Revises: 9c4e71d2a0b5
+Create Date: 2026-10-18 12:20:05.871346
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d0a3e8f6b21'
+down_revision = '9c4e71d2a0b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.alter_column(
+        'tasks',
+        'task_type',
+        existing_type=sa.Enum('TwitterExtract', 'NewsDownload'),
+        type_=sa.Enum('TwitterExtract', 'NewsDownload', 'NewsBatchDownload'),
+        existing_nullable=False
+    )
+
+
+def downgrade():
+    op.alter_column(
+        'tasks',
+        'task_type',
+        existing_type=sa.Enum('TwitterExtract', 'NewsDownload', 'NewsBatchDownload'),
+        type_=sa.Enum('TwitterExtract', 'NewsDownload'),
+        existing_nullable=False
+    )
@@ -0,0 +1,28 @@
+"""Add index on heartbeats task_run_id and last_heartbeat_time
+
+Revision ID: 6b2e8d4f1a95
+Revises: 9d3f6b1a8c47
+Create Date: 2026-10-18 19:11:52.930217
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '6b2e8d4f1a95'
+down_revision = '9d3f6b1a8c47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_heartbeats_task_run_id_last_heartbeat_time',
+        'heartbeats',
+        ['task_run_id', 'last_heartbeat_time'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_heartbeats_task_run_id_last_heartbeat_time', table_name='heartbeats')
@@ -0,0 +1,32 @@
+"""Add task_runs dag_id and index on task_runs task_id and run_ds
+
+Revision ID: 8e4d2b6a1f37
+Revises: 2c8f5a7e9d14
+Create Date: 2026-10-18 15:04:46.731852
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4d2b6a1f37'
+down_revision = '2c8f5a7e9d14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Declared on the model without a migration. Runs of standalone tasks have no DAG
+    op.add_column('task_runs', sa.Column('dag_id', sa.String(length=255), nullable=True))
+    op.create_index(
+        'ix_task_runs_task_id_run_ds',
+        'task_runs',
+        ['task_id', 'run_ds'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_task_runs_task_id_run_ds', table_name='task_runs')
+    op.drop_column('task_runs', 'dag_id')
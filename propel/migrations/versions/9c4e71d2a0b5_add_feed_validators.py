@@ -0,0 +1,32 @@
+"""Add feed_validators
+
+Revision ID: 9c4e71d2a0b5
+Revises: 3f2b8d6c1e47
+Create Date: 2026-10-18 11:03:27.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4e71d2a0b5'
+down_revision = '3f2b8d6c1e47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'feed_validators',
+        sa.Column('feed_id', sa.String(length=64), nullable=False),
+        sa.Column('rss_url', sa.String(length=1000), nullable=False),
+        sa.Column('etag', sa.String(length=1000), nullable=True),
+        sa.Column('modified', sa.String(length=255), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('feed_id')
+    )
+
+
+def downgrade():
+    op.drop_table('feed_validators')
@@ -0,0 +1,74 @@
+"""Add dag_runs and task_run_dependencies and link task_runs to DAG runs
+
+Revision ID: 9d3f6b1a8c47
+Revises: f1b7d4c2e963
+Create Date: 2026-10-18 18:02:13.604518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3f6b1a8c47'
+down_revision = 'f1b7d4c2e963'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'dag_runs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('dag_id', sa.String(length=255), nullable=False),
+        sa.Column('run_ds', sa.DateTime(), nullable=False),
+        sa.Column('state', sa.String(length=255), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('uq_dag_runs_dag_id_run_ds', 'dag_runs', ['dag_id', 'run_ds'], unique=True)
+    op.create_index('ix_dag_runs_state', 'dag_runs', ['state'], unique=False)
+    op.add_column('task_runs', sa.Column('dag_run_id', sa.Integer(), nullable=True))
+    op.add_column('task_runs', sa.Column('dag_task_id', sa.String(length=255), nullable=True))
+    op.create_foreign_key(
+        'fk_task_runs_dag_run_id',
+        'task_runs',
+        'dag_runs',
+        ['dag_run_id'],
+        ['id']
+    )
+    op.create_index(
+        'uq_task_runs_dag_run_id_dag_task_id',
+        'task_runs',
+        ['dag_run_id', 'dag_task_id'],
+        unique=True
+    )
+    # Runs of DAG tasks are not runs of a row in tasks
+    op.alter_column('task_runs', 'task_id', existing_type=sa.Integer(), nullable=True)
+    op.create_table(
+        'task_run_dependencies',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('task_run_id', sa.Integer(), nullable=False),
+        sa.Column('upstream_task_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['task_run_id'], ['task_runs.id'], ),
+        sa.ForeignKeyConstraint(['upstream_task_id'], ['task_runs.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_task_run_dependencies_task_run_id',
+        'task_run_dependencies',
+        ['task_run_id'],
+        unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_task_run_dependencies_task_run_id', table_name='task_run_dependencies')
+    op.drop_table('task_run_dependencies')
+    # Runs of DAG tasks have to be removed before downgrading
+    op.alter_column('task_runs', 'task_id', existing_type=sa.Integer(), nullable=False)
+    op.drop_constraint('fk_task_runs_dag_run_id', 'task_runs', type_='foreignkey')
+    op.drop_index('uq_task_runs_dag_run_id_dag_task_id', table_name='task_runs')
+    op.drop_column('task_runs', 'dag_task_id')
+    op.drop_column('task_runs', 'dag_run_id')
+    op.drop_index('ix_dag_runs_state', table_name='dag_runs')
+    op.drop_table('dag_runs')
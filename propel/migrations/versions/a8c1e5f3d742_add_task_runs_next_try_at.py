@@ -0,0 +1,24 @@
+"""Add task_runs next_try_at
+
+Revision ID: a8c1e5f3d742
+Revises: 3f9a7c2e5b16
+Create Date: 2026-10-18 20:24:37.108952
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8c1e5f3d742'
+down_revision = '3f9a7c2e5b16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('task_runs', sa.Column('next_try_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('task_runs', 'next_try_at')
@@ -0,0 +1,33 @@
+"""Add timeline_cursors
+
+Revision ID: b7e19c5f2d83
+Revises: 5d0a3e8f6b21
+Create Date: 2026-10-18 13:41:52.093716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e19c5f2d83'
+down_revision = '5d0a3e8f6b21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'timeline_cursors',
+        sa.Column('screen_name', sa.String(length=100), nullable=False),
+        sa.Column('since_id', mysql.BIGINT(unsigned=True), nullable=True),
+        sa.Column('max_id', mysql.BIGINT(unsigned=True), nullable=True),
+        sa.Column('newest_id', mysql.BIGINT(unsigned=True), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('screen_name')
+    )
+
+
+def downgrade():
+    op.drop_table('timeline_cursors')
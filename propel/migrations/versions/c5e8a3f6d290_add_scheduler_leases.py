@@ -0,0 +1,48 @@
+"""Add scheduler_leases and make task_runs task_id and run_ds unique
+
+Revision ID: c5e8a3f6d290
+Revises: 4a9c7e1d3b58
+Create Date: 2026-10-18 16:38:27.115903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e8a3f6d290'
+down_revision = '4a9c7e1d3b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'scheduler_leases',
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.Column('holder', sa.String(length=255), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('name')
+    )
+    # Duplicate runs of a task for the same run_ds have to be removed before upgrading.
+    # Unique index is created before the old one is dropped as MySQL needs an index
+    # on task_id for its foreign key at all times
+    op.create_index(
+        'uq_task_runs_task_id_run_ds',
+        'task_runs',
+        ['task_id', 'run_ds'],
+        unique=True
+    )
+    op.drop_index('ix_task_runs_task_id_run_ds', table_name='task_runs')
+
+
+def downgrade():
+    op.create_index(
+        'ix_task_runs_task_id_run_ds',
+        'task_runs',
+        ['task_id', 'run_ds'],
+        unique=False
+    )
+    op.drop_index('uq_task_runs_task_id_run_ds', table_name='task_runs')
+    op.drop_table('scheduler_leases')
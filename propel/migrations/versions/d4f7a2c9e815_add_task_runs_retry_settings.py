@@ -0,0 +1,30 @@
+"""Add task_runs retry settings
+
+Revision ID: d4f7a2c9e815
+Revises: a8c1e5f3d742
+Create Date: 2026-10-18 21:12:43.518207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4f7a2c9e815'
+down_revision = 'a8c1e5f3d742'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('task_runs', sa.Column('max_tries', sa.Integer(), nullable=True))
+    op.add_column('task_runs', sa.Column('retry_delay_seconds', sa.Float(), nullable=True))
+    op.add_column('task_runs', sa.Column('max_retry_delay_seconds', sa.Float(), nullable=True))
+    op.add_column('task_runs', sa.Column('retry_jitter', sa.Float(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('task_runs', 'retry_jitter')
+    op.drop_column('task_runs', 'max_retry_delay_seconds')
+    op.drop_column('task_runs', 'retry_delay_seconds')
+    op.drop_column('task_runs', 'max_tries')
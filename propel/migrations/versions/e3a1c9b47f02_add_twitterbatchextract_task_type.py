@@ -0,0 +1,52 @@
+"""Add TwitterBatchExtract task type and widen task_args
+
+Revision ID: e3a1c9b47f02
+Revises: b7e19c5f2d83
+Create Date: 2026-10-18 14:02:37.519283
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a1c9b47f02'
+down_revision = 'b7e19c5f2d83'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.alter_column(
+        'tasks',
+        'task_type',
+        existing_type=sa.Enum('TwitterExtract', 'NewsDownload', 'NewsBatchDownload'),
+        type_=sa.Enum('TwitterExtract', 'TwitterBatchExtract', 'NewsDownload', 'NewsBatchDownload'),
+        existing_nullable=False
+    )
+    op.alter_column(
+        'tasks',
+        'task_args',
+        existing_type=sa.String(1000),
+        type_=sa.Text(),
+        existing_nullable=False
+    )
+
+
+def downgrade():
+    op.alter_column(
+        'tasks',
+        'task_args',
+        existing_type=sa.Text(),
+        type_=sa.String(1000),
+        existing_nullable=False
+    )
+    op.alter_column(
+        'tasks',
+        'task_type',
+        existing_type=sa.Enum(
+            'TwitterExtract', 'TwitterBatchExtract', 'NewsDownload', 'NewsBatchDownload'
+        ),
+        type_=sa.Enum('TwitterExtract', 'NewsDownload', 'NewsBatchDownload'),
+        existing_nullable=False
+    )
@@ -0,0 +1,37 @@
+"""Add serialized_dags
+
+Revision ID: f1b7d4c2e963
+Revises: c5e8a3f6d290
+Create Date: 2026-10-18 17:26:41.580734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1b7d4c2e963'
+down_revision = 'c5e8a3f6d290'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'serialized_dags',
+        sa.Column('dag_id', sa.String(length=255), nullable=False),
+        sa.Column('dag_location', sa.String(length=1000), nullable=True),
+        sa.Column(
+            'serialized_dag',
+            sa.Text().with_variant(mysql.MEDIUMTEXT(), 'mysql'),
+            nullable=False
+        ),
+        sa.Column('dag_hash', sa.String(length=64), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('dag_id')
+    )
+
+
+def downgrade():
+    op.drop_table('serialized_dags')
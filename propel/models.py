@@ -1,26 +1,36 @@
+import billiard
 import hashlib
+import imp
 import importlib
 import inspect
 import json
 import os
-from datetime import datetime
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
 import networkx as nx
 from sqlalchemy import (Table, Column, String, Integer, BigInteger, JSON,
-                        DateTime, Enum, Boolean, ForeignKey)
-from sqlalchemy.dialects.mysql import BIGINT
+                        DateTime, Enum, Boolean, Float, ForeignKey, Index, Text)
+from sqlalchemy.dialects.mysql import BIGINT, MEDIUMTEXT
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import backref, relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, or_
 from time import mktime, struct_time
 
 from propel import configuration
 from propel.exceptions import PropelException
 from propel.settings import logger
-from propel.utils.db import provide_session
-from propel.utils.general import extract_from_json, add_path
+from propel.utils.db import Upsert, provide_session
+from propel.utils.general import JsonPathPlan, add_path, chunked
+from propel.utils.state import State
 
 Base = declarative_base()
 
+DagFileStat = namedtuple('DagFileStat', ['mtime', 'size', 'sha256'])
+
 
 class Connections(Base):
     __tablename__ = 'connections'
@@ -39,45 +49,335 @@ class Connections(Base):
             .format(self.id, self.name)
         )
 
+
+task_group_members = Table(
+    'task_group_members',
+    Base.metadata,
+    Column('task_group_id', Integer, ForeignKey('task_groups.id')),
+    Column('task_id', Integer, ForeignKey('tasks.id'))
+)
+
+
+class TaskGroups(Base):
+    __tablename__ = 'task_groups'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(255), nullable=False)
+    is_enabled = Column(Boolean)
+    tasks = relationship('Tasks', secondary=task_group_members, backref='task_groups')
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return (
+            "<TaskGroup(id={0}, name={1})>"
+            .format(self.id, self.name)
+        )
+
+
+class Tasks(Base):
+    __tablename__ = 'tasks'
+    id = Column(Integer, primary_key=True)
+    task_name = Column(String(1000), nullable=False)
+    task_type = Column(
+        Enum('TwitterExtract', 'TwitterBatchExtract', 'NewsDownload', 'NewsBatchDownload'),
+        nullable=False
+    )
+    # Batch tasks take a JSON list of a few thousand arguments
+    task_args = Column(Text, nullable=False)
+    run_frequency_seconds = Column(Integer, nullable=False)
+    schedule_latest = Column(Boolean)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return (
+            "<Task(id={0}, task_name={1}, task_type={2})>"
+            .format(self.id, self.task_name, self.task_type)
+        )
+
+    def as_dict(self):
+        return {
+            column.name: getattr(self, column.name)
+            for column in self.__table__.columns
+        }
+
+
+def _parse_dag_file(dag_bag, file_path, source, connection):
+    """
+    Runs in a child process. Imports a DAG file and sends its serialized DAGs,
+    the import error if any and the seconds the parse took to the parent.
+    """
+    start_time = time.time()
+    try:
+        with add_path(dag_bag.dags_location):
+            dags = dag_bag._import_dags(file_path, source)
+        result = ([dag.serialize() for dag in dags], None)
+    except Exception as e:
+        result = ([], '{}: {}'.format(type(e).__name__, e))
+    connection.send(result + (time.time() - start_time, ))
+    connection.close()
+
+
 class DagBag(object):
     """
-    A collection of dags that are parsed from the dags_location
+    A collection of dags that are parsed from the dags_location. Files are
+    tracked in a manifest of (mtime, size, sha256) so parse_dags only reparses
+    files that changed since the previous call.
+
+    Changed files are imported in child processes, parse_processes at a time,
+    and each is killed if it takes longer than parse_timeout_seconds. Children
+    send back serialized DAGs so the calling process never imports DAG code and
+    a crashing or hanging DAG file can not take it down. A parse_processes of 0
+    imports files in the calling process.
     """
-    def __init__(self):
-        self.dags_location = configuration.get('core', 'dags_location')
-        self.dags = list()
+    # Package DAG files are imported under so a file named like another
+    # module, e.g. json.py, can not replace it in sys.modules
+    module_prefix = 'propel_dags'
 
-    def parse_dags(self):
+    def __init__(self, dags_location=None, parse_processes=None, parse_timeout_seconds=None):
+        self.dags_location = dags_location or configuration.get('core', 'dags_location')
+        if parse_processes is None:
+            parse_processes = int(configuration.get('core', 'dag_parse_processes'))
+        self.parse_processes = parse_processes
+        if parse_timeout_seconds is None:
+            parse_timeout_seconds = int(configuration.get('core', 'dag_file_parse_timeout_seconds'))
+        self.parse_timeout_seconds = parse_timeout_seconds
+        # DAG file path to DagFileStat of the file when it was last parsed without error
+        self.manifest = dict()
+        # DAG file path to the DAGs defined in it
+        self.file_dags = dict()
+        # DAG file path to the seconds taken by its last parse
+        self.file_parse_seconds = dict()
+        # DAG file path to the error of its last parse
+        self.file_errors = dict()
+        # Names of the modules this DagBag put in sys.modules
+        self._module_names = set()
+
+    @property
+    def dags(self):
+        return [dag for dags in self.file_dags.values() for dag in dags]
+
+    def _get_relative_module_name(self, file_path):
+        relative_file_path = os.path.relpath(file_path, self.dags_location)
+        return os.path.splitext(relative_file_path)[0].replace(os.sep, '.')
+
+    def _get_module_name(self, file_path):
+        return '{}.{}'.format(self.module_prefix, self._get_relative_module_name(file_path))
+
+    def _pop_module(self, module_name):
+        if module_name in self._module_names:
+            self._module_names.discard(module_name)
+            sys.modules.pop(module_name, None)
+
+    def _remove_file(self, file_path):
+        logger.info('Removing DAGs of {}'.format(file_path))
+        self.manifest.pop(file_path, None)
+        self.file_dags.pop(file_path, None)
+        self.file_parse_seconds.pop(file_path, None)
+        self.file_errors.pop(file_path, None)
+        self._pop_module(self._get_module_name(file_path))
+
+    def _import_dags(self, file_path, source):
+        """
+        Execute the source of a DAG file as a fresh module and return the DAGs
+        it defines. The source already read is compiled rather than importing
+        the file again, so a stale .pyc is never picked up.
+        """
+        module_name = self._get_module_name(file_path)
+        module = imp.new_module(module_name)
+        module.__file__ = file_path
+        # Imports resolve against the DAG folder, which is on sys.path, and not
+        # against module_prefix, which is not a real package
+        module.__package__ = ''
+        package_name = self._get_relative_module_name(file_path).rpartition('.')[0]
+        if package_name:
+            try:
+                importlib.import_module(package_name)
+                module.__package__ = package_name
+            except ImportError:
+                # Folders of DAG files need not be python packages
+                pass
+        # Replacing an already imported module so removed definitions do not linger
+        sys.modules[module_name] = module
+        self._module_names.add(module_name)
+        try:
+            exec(compile(source, file_path, 'exec'), module.__dict__)
+        except Exception:
+            self._pop_module(module_name)
+            raise
+        dags = list()
+        for _, item in inspect.getmembers(module):
+            if isinstance(item, DAG):
+                item.dag_location = file_path
+                dags.append(item)
+        return dags
+
+    def _read_changed_file(self, file_path, file_stat):
+        """
+        Get the source of a DAG file and its DagFileStat if it changed since it was
+        last parsed. Returns None for unchanged files. The DagFileStat is only put
+        in the manifest once the file is parsed without error, so a file that
+        failed to parse is parsed again.
+        """
+        known_file_stat = self.manifest.get(file_path)
+        if (
+            known_file_stat is not None
+            and known_file_stat.mtime == file_stat.st_mtime
+            and known_file_stat.size == file_stat.st_size
+        ):
+            return None
+        with open(file_path) as f:
+            source = f.read()
+        new_file_stat = DagFileStat(
+            file_stat.st_mtime,
+            file_stat.st_size,
+            hashlib.sha256(source).hexdigest()
+        )
+        if known_file_stat is not None and known_file_stat.sha256 == new_file_stat.sha256:
+            # Touched but not modified
+            self.manifest[file_path] = new_file_stat
+            return None
+        return source, new_file_stat
+
+    def _parse_files_in_process(self, sources):
+        results = dict()
         with add_path(self.dags_location):
-            for dirpath, _, filenames in os.walk(self.dags_location, followlinks=True):
-                for filename in filenames:
-                    relative_file_path = os.path.join(
-                        os.path.relpath(dirpath, self.dags_location),
-                        filename
-                    )
-                    full_file_path = os.path.join(dirpath, filename)
-                    # Expect DAG files to be python files with 'DAG' word in the file
-                    if not filename.endswith('.py'):
-                        continue
-                    with open(full_file_path) as f:
-                        if 'DAG' not in f.read():
-                            continue
+            for file_path, source in sources.items():
+                start_time = time.time()
+                try:
+                    results[file_path] = (self._import_dags(file_path, source), None)
+                except Exception as e:
+                    results[file_path] = ([], '{}: {}'.format(type(e).__name__, e))
+                results[file_path] += (time.time() - start_time, )
+        return results
+
+    def _parse_files_in_processes(self, sources):
+        results = dict()
+        pending_files = deque(sorted(sources))
+        # File path to (process, receiving end of its pipe, start time)
+        running_files = dict()
+        while pending_files or running_files:
+            while pending_files and len(running_files) < self.parse_processes:
+                file_path = pending_files.popleft()
+                receiver, sender = billiard.Pipe(duplex=False)
+                process = billiard.Process(
+                    target=_parse_dag_file,
+                    args=(self, file_path, sources[file_path], sender)
+                )
+                process.daemon = True
+                process.start()
+                sender.close()
+                running_files[file_path] = (process, receiver, time.time())
+            for file_path, (process, receiver, start_time) in list(running_files.items()):
+                elapsed_seconds = time.time() - start_time
+                # Checking the pipe again after the process exits as it may have
+                # sent its result just before exiting
+                if receiver.poll() or (not process.is_alive() and receiver.poll()):
                     try:
-                        module_name = relative_file_path.replace('/', '.').replace('.py', '')
-                        imported_module = importlib.import_module(module_name)
-                        for _, item in inspect.getmembers(imported_module):
-                            if isinstance(item, DAG):
-                                self.dags.append(item)
-                                item.dag_location = full_file_path
-                    except Exception as e:
-                        logger.warn("Could not import module {}".format(relative_file_path))
-                        logger.warn(e)
+                        serialized_dags, error, elapsed_seconds = receiver.recv()
+                    except EOFError:
+                        process.join()
+                        serialized_dags = []
+                        error = 'Parsing process exited with code {}'.format(process.exitcode)
+                    dags = [DAG.deserialize(serialized_dag) for serialized_dag in serialized_dags]
+                    results[file_path] = (dags, error, elapsed_seconds)
+                elif not process.is_alive():
+                    results[file_path] = (
+                        [],
+                        'Parsing process exited with code {}'.format(process.exitcode),
+                        elapsed_seconds
+                    )
+                elif elapsed_seconds > self.parse_timeout_seconds:
+                    process.terminate()
+                    results[file_path] = (
+                        [],
+                        'Timed out after {} seconds'.format(self.parse_timeout_seconds),
+                        elapsed_seconds
+                    )
+                else:
+                    continue
+                process.join()
+                receiver.close()
+                del running_files[file_path]
+            if running_files:
+                time.sleep(0.01)
+        return results
+
+    def parse_dags(self):
+        """
+        Parse new and changed DAG files and drop DAGs of deleted files. Files
+        that fail to parse keep the DAGs of their last good parse and are parsed
+        again on the next call
+
+        :return: Paths of the files that were parsed
+        :rtype: list
+        """
+        changed_sources = dict()
+        changed_file_stats = dict()
+        seen_files = set()
+        for dirpath, _, filenames in os.walk(self.dags_location, followlinks=True):
+            for filename in filenames:
+                if not filename.endswith('.py'):
+                    continue
+                file_path = os.path.join(dirpath, filename)
+                try:
+                    file_stat = os.stat(file_path)
+                except OSError:
+                    # Deleted while walking
+                    continue
+                seen_files.add(file_path)
+                changed_file = self._read_changed_file(file_path, file_stat)
+                if changed_file is not None:
+                    changed_sources[file_path], changed_file_stats[file_path] = changed_file
+        # Files that never parsed without error are not in the manifest
+        for file_path in (set(self.manifest) | set(self.file_errors)) - seen_files:
+            self._remove_file(file_path)
+
+        # Expect DAG files to be python files with 'DAG' word in the file
+        dag_sources = {
+            file_path: source
+            for file_path, source in changed_sources.items()
+            if 'DAG' in source
+        }
+        results = {file_path: ([], None, 0) for file_path in changed_sources}
+        if self.parse_processes:
+            results.update(self._parse_files_in_processes(dag_sources))
+        else:
+            results.update(self._parse_files_in_process(dag_sources))
+        for file_path, (dags, error, parse_seconds) in results.items():
+            self.file_parse_seconds[file_path] = parse_seconds
+            if error:
+                logger.warn("Could not import module {}".format(file_path))
+                logger.warn(error)
+                # DAGs of the last good parse are kept until the file parses again
+                self.file_errors[file_path] = error
+                continue
+            self.file_dags[file_path] = dags
+            self.manifest[file_path] = changed_file_stats[file_path]
+            self.file_errors.pop(file_path, None)
+            logger.info(
+                'Parsed {} DAGs from {} in {:.3f} seconds'
+                .format(len(dags), file_path, parse_seconds)
+            )
+        return sorted(changed_sources)
+
+    def sync_to_db(self):
+        """
+        Write the serialized form of the DAGs to serialized_dags. Stored DAGs of
+        files that failed to parse are not deleted
+
+        :return: Number of DAGs written
+        :rtype: int
+        """
+        return SerializedDags.write_dags(self.dags, failed_locations=list(self.file_errors))
 
 
 class DAG(object):
     """
     DAG Object to which tasks are added
     """
+    serialized_date_format = '%Y-%m-%dT%H:%M:%S'
+
     def __init__(
             self,
             dag_id,
@@ -92,6 +392,13 @@ class DAG(object):
         self.start_date = start_date
         self.interval = interval
         self.dag = nx.DiGraph()
+        # task_id to task. Graph lookups and orders below are cached until the
+        # DAG changes through add_task, add_upstream or add_downstream
+        self._tasks_by_id = dict()
+        self._task_ids = None
+        self._topological_order = None
+        self._upstream_tasks = dict()
+        self._downstream_tasks = dict()
         self._dag_location = None
 
     def __repr__(self):
@@ -100,6 +407,82 @@ class DAG(object):
             .format(self.dag_id, self.description)
         )
 
+    def serialize(self):
+        """
+        Get the DAG's metadata and graph as a dict of JSON types. Tasks are
+        described by their id, class name and params.
+
+        :rtype: dict
+        """
+        start_date = self.start_date
+        if isinstance(start_date, datetime):
+            start_date = start_date.strftime(self.serialized_date_format)
+        interval = self.interval
+        if isinstance(interval, timedelta):
+            interval = int(interval.total_seconds())
+        return {
+            'dag_id': self.dag_id,
+            'description': self.description,
+            'is_scheduled': self.is_scheduled,
+            'start_date': start_date,
+            'interval': interval,
+            'dag_location': self.dag_location,
+            'tasks': sorted(
+                [
+                    {
+                        'task_id': task.task_id,
+                        'task_type': (
+                            task.task_type
+                            if isinstance(task, SerializedTask)
+                            else type(task).__name__
+                        ),
+                        'params': task.params,
+                    }
+                    for task in self.get_tasks()
+                ],
+                key=lambda task: task['task_id']
+            ),
+            'edges': sorted(
+                [upstream_task.task_id, task.task_id]
+                for upstream_task, task in self.dag.edges
+            ),
+        }
+
+    @classmethod
+    def deserialize(cls, serialized_dag):
+        """
+        Build a DAG from the output of serialize. Tasks are SerializedTask
+        placeholders so no DAG code is imported. A timedelta interval comes
+        back as seconds.
+
+        :param serialized_dag: Serialized DAG
+        :type serialized_dag: dict
+        :rtype: DAG
+        """
+        start_date = serialized_dag['start_date']
+        if start_date is not None:
+            start_date = datetime.strptime(start_date, cls.serialized_date_format)
+        dag = cls(
+            dag_id=serialized_dag['dag_id'],
+            description=serialized_dag['description'],
+            is_scheduled=serialized_dag['is_scheduled'],
+            start_date=start_date,
+            interval=serialized_dag['interval'],
+        )
+        dag.dag_location = serialized_dag['dag_location']
+        tasks = {
+            task['task_id']: SerializedTask(
+                task_id=task['task_id'],
+                task_type=task['task_type'],
+                params=task['params'],
+                dag=dag
+            )
+            for task in serialized_dag['tasks']
+        }
+        for upstream_task_id, task_id in serialized_dag['edges']:
+            dag.add_upstream(tasks[task_id], tasks[upstream_task_id])
+        return dag
+
     @property
     def dag_location(self):
         return self._dag_location
@@ -108,17 +491,39 @@ class DAG(object):
     def dag_location(self, dag_location):
         self._dag_location = dag_location
 
+    def _invalidate_caches(self):
+        self._task_ids = None
+        self._topological_order = None
+        self._upstream_tasks.clear()
+        self._downstream_tasks.clear()
+
+    def _register_task(self, task):
+        known_task = self._tasks_by_id.get(task.task_id)
+        if known_task is not None and known_task is not task:
+            raise PropelException(
+                "Task id {} already exists in DAG {}".format(task.task_id, self.dag_id)
+            )
+        self._tasks_by_id[task.task_id] = task
+
     def add_task(self, task):
         if not isinstance(task, BaseTask):
             raise PropelException("{} is not a Task. Only tasks can added to a DAG".format(task))
+        self._register_task(task)
         self.dag.add_node(task)
         task.dag = self
+        self._invalidate_caches()
 
     def add_upstream(self, task, upstream_task):
+        self._register_task(task)
+        self._register_task(upstream_task)
         self.dag.add_edge(upstream_task, task)
+        self._invalidate_caches()
 
     def add_downstream(self, task, downstream_task):
+        self._register_task(task)
+        self._register_task(downstream_task)
         self.dag.add_edge(task, downstream_task)
+        self._invalidate_caches()
 
     def is_valid(self):
         return nx.is_directed_acyclic_graph(self.dag)
@@ -126,33 +531,221 @@ class DAG(object):
     def get_tasks(self):
         return self.dag.nodes
 
+    def get_task(self, task_id):
+        return self._tasks_by_id.get(task_id)
+
     def get_task_ids(self):
-        task_ids = list()
-        for task in self.get_tasks():
-            task_ids.append(task.task_id)
-        return task_ids
+        """
+        :return: Ids of the DAG's tasks. The list is shared between calls and
+            must not be modified
+        :rtype: list
+        """
+        if self._task_ids is None:
+            self._task_ids = [task.task_id for task in self.get_tasks()]
+        return self._task_ids
+
+    def get_topological_order(self):
+        """
+        :return: Tasks ordered so every task comes after its upstream tasks
+        :rtype: list
+        """
+        if self._topological_order is None:
+            self._topological_order = list(nx.topological_sort(self.dag))
+        return self._topological_order
+
+    def get_direct_upstream_tasks(self, task_id):
+        task = self._tasks_by_id.get(task_id)
+        if task is None:
+            return None
+        return list(self.dag.predecessors(task))
+
+    def get_direct_downstream_tasks(self, task_id):
+        task = self._tasks_by_id.get(task_id)
+        if task is None:
+            return None
+        return list(self.dag.successors(task))
 
     def is_task_id_in_dag(self, task_id):
-        for task in self.get_tasks():
-            if task.task_id == task_id:
-                return True, task
-        return False, None
+        task = self._tasks_by_id.get(task_id)
+        return task is not None, task
 
     def get_upstream_tasks(self, task_id):
-        is_task_id_in_dag, task = self.is_task_id_in_dag(task_id)
-        if is_task_id_in_dag:
-            return nx.ancestors(self.dag, task)
-        return None
+        task = self._tasks_by_id.get(task_id)
+        if task is None:
+            return None
+        if task_id not in self._upstream_tasks:
+            self._upstream_tasks[task_id] = frozenset(nx.ancestors(self.dag, task))
+        return self._upstream_tasks[task_id]
 
     def get_downstream_tasks(self, task_id):
-        is_task_id_in_dag, task = self.is_task_id_in_dag(task_id)
-        if is_task_id_in_dag:
-            return nx.descendants(self.dag, task)
-        return None
+        task = self._tasks_by_id.get(task_id)
+        if task is None:
+            return None
+        if task_id not in self._downstream_tasks:
+            self._downstream_tasks[task_id] = frozenset(nx.descendants(self.dag, task))
+        return self._downstream_tasks[task_id]
+
+
+class SerializedDags(Base):
+    """
+    Serialized form of a DAG (see DAG.serialize) written by DagBag after
+    parsing. Processes that only need the structure of DAGs read it from here
+    instead of importing DAG files.
+    """
+    __tablename__ = 'serialized_dags'
+    dag_id = Column(String(255), primary_key=True)
+    dag_location = Column(String(1000))
+    serialized_dag = Column(Text().with_variant(MEDIUMTEXT(), 'mysql'), nullable=False)
+    # sha256 of serialized_dag. Readers compare it to skip unchanged DAGs
+    dag_hash = Column(String(64), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return (
+            "<SerializedDag(dag_id={0}, dag_location={1}, dag_hash={2})>"
+            .format(self.dag_id, self.dag_location, self.dag_hash)
+        )
+
+    @property
+    def dag(self):
+        """
+        DAG deserialized on first access
+        """
+        if getattr(self, '_dag', None) is None:
+            self._dag = DAG.deserialize(json.loads(self.serialized_dag))
+        return self._dag
+
+    @classmethod
+    @provide_session
+    def get_dag_hashes(cls, session=None):
+        """
+        Get the hash of every stored DAG without loading the serialized DAGs
+
+        :rtype: dict
+        """
+        return dict(session.query(cls.dag_id, cls.dag_hash))
+
+    @classmethod
+    @provide_session
+    def write_dags(cls, dags, failed_locations=None, session=None):
+        """
+        Store the serialized form of dags and delete DAGs that are no longer
+        defined. DAGs whose hash did not change are not written.
+
+        :param dags: Every DAG currently defined
+        :type dags: list
+        :param failed_locations: Paths of DAG files that failed to parse. Their
+            stored DAGs are kept until the files parse again
+        :type failed_locations: list
+        :return: Number of DAGs written
+        :rtype: int
+        """
+        serialized_dags = dict()
+        for dag in dags:
+            serialized_dag = json.dumps(dag.serialize(), sort_keys=True, default=str)
+            serialized_dags[dag.dag_id] = {
+                'dag_id': dag.dag_id,
+                'dag_location': dag.dag_location,
+                'serialized_dag': serialized_dag,
+                'dag_hash': hashlib.sha256(serialized_dag).hexdigest(),
+                'updated_at': datetime.utcnow(),
+            }
+        stored_dag_hashes = cls.get_dag_hashes(session=session)
+        changed_dags = [
+            dag_row
+            for dag_id, dag_row in serialized_dags.items()
+            if stored_dag_hashes.get(dag_id) != dag_row['dag_hash']
+        ]
+        if changed_dags:
+            session.execute(
+                Upsert(cls.__table__, ['dag_location', 'serialized_dag', 'dag_hash', 'updated_at']),
+                changed_dags
+            )
+        removed_dag_ids = set(stored_dag_hashes) - set(serialized_dags)
+        for locations_chunk in chunked(sorted(failed_locations or []), 1000):
+            if not removed_dag_ids:
+                break
+            removed_dag_ids -= set(
+                dag_id
+                for dag_id, in (
+                    session
+                    .query(cls.dag_id)
+                    .filter(cls.dag_location.in_(locations_chunk))
+                )
+            )
+        for dag_ids_chunk in chunked(sorted(removed_dag_ids), 1000):
+            (
+                session
+                .query(cls)
+                .filter(cls.dag_id.in_(dag_ids_chunk))
+                .delete(synchronize_session=False)
+            )
+        logger.info(
+            'Wrote {} changed DAGs and removed {} DAGs'
+            .format(len(changed_dags), len(removed_dag_ids))
+        )
+        return len(changed_dags)
+
+
+class SerializedDagBag(object):
+    """
+    DAGs read from serialized_dags. refresh only loads DAGs whose hash changed
+    and DAGs are only deserialized when first asked for.
+    """
+    def __init__(self):
+        # dag_id to the SerializedDags row of the DAG
+        self._serialized_dags = dict()
+
+    @property
+    def dag_ids(self):
+        return sorted(self._serialized_dags)
+
+    @provide_session
+    def refresh(self, session=None):
+        """
+        Pick up DAGs added, changed or removed since the last refresh
+
+        :return: Ids of the DAGs added or changed
+        :rtype: list
+        """
+        dag_hashes = SerializedDags.get_dag_hashes(session=session)
+        for dag_id in set(self._serialized_dags) - set(dag_hashes):
+            del self._serialized_dags[dag_id]
+        changed_dag_ids = sorted(
+            dag_id
+            for dag_id, dag_hash in dag_hashes.items()
+            if dag_id not in self._serialized_dags
+            or self._serialized_dags[dag_id].dag_hash != dag_hash
+        )
+        for dag_ids_chunk in chunked(changed_dag_ids, 1000):
+            serialized_dags = (
+                session
+                .query(SerializedDags)
+                .filter(SerializedDags.dag_id.in_(dag_ids_chunk))
+            )
+            for serialized_dag in serialized_dags:
+                session.expunge(serialized_dag)
+                self._serialized_dags[serialized_dag.dag_id] = serialized_dag
+        return changed_dag_ids
+
+    def get_dag(self, dag_id):
+        """
+        :return: DAG with dag_id or None if it is not stored
+        :rtype: DAG
+        """
+        serialized_dag = self._serialized_dags.get(dag_id)
+        if serialized_dag is None:
+            return None
+        return serialized_dag.dag
 
 
 class DagRuns(Base):
     __tablename__ = 'dag_runs'
+    __table_args__ = (
+        # One run of a DAG per interval. Also serves the lookup of the latest run of each DAG
+        Index('uq_dag_runs_dag_id_run_ds', 'dag_id', 'run_ds', unique=True),
+        Index('ix_dag_runs_state', 'state'),
+    )
     id = Column(Integer, primary_key=True)
     dag_id = Column(String(255), nullable=False)
     run_ds = Column(DateTime, nullable=False)
@@ -167,11 +760,33 @@ class DagRuns(Base):
 
 class TaskRuns(Base):
     __tablename__ = 'task_runs'
+    __table_args__ = (
+        # Serves the scheduler's lookup of the latest run of each task and keeps
+        # schedulers from creating the same run twice
+        Index('uq_task_runs_task_id_run_ds', 'task_id', 'run_ds', unique=True),
+        # Serves the count of active runs of tasks that are catching up
+        Index('ix_task_runs_state_task_id', 'state', 'task_id'),
+        # One run of each task of a DAG run
+        Index('uq_task_runs_dag_run_id_dag_task_id', 'dag_run_id', 'dag_task_id', unique=True),
+    )
     id = Column(Integer, primary_key=True)
-    dag_id = Column(String(255), nullable=False)
-    task_id = Column(String(255), nullable=False)
+    # Runs of tasks scheduled on their own have no DAG
+    dag_id = Column(String(255))
+    dag_run_id = Column(Integer, ForeignKey('dag_runs.id'))
+    # task_id of the task within its DAG. Runs of DAG tasks have no task_id
+    dag_task_id = Column(String(255))
+    task_id = Column(Integer, ForeignKey('tasks.id'))
     state = Column(String(255), nullable=False)
     run_ds = Column(DateTime, nullable=False)
+    # Incremented each time the run is queued again
+    try_number = Column(Integer, nullable=False, default=1)
+    # When a run that is up for retry is queued again
+    next_try_at = Column(DateTime)
+    # Retry policy of the run's task type when the run was created. See RetryPolicy
+    max_tries = Column(Integer)
+    retry_delay_seconds = Column(Float)
+    max_retry_delay_seconds = Column(Float)
+    retry_jitter = Column(Float)
     start_time = Column(DateTime)
     end_time = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -179,13 +794,16 @@ class TaskRuns(Base):
 
     def __repr__(self):
         return (
-            "<TaskRun(id={0}, dag_id={1}, task_id={1}, run_ds={2}, state={3})>"
-            .format(self.id, self.dag_id, self.task_id, self.run_ds, self.state)
+            "<TaskRun(id={0}, dag_id={1}, task_id={2}, run_ds={3}, state={4})>"
+            .format(self.id, self.dag_id, self.task_id or self.dag_task_id, self.run_ds, self.state)
         )
 
 
 class TaskRunDependencies(Base):
     __tablename__ = 'task_run_dependencies'
+    __table_args__ = (
+        Index('ix_task_run_dependencies_task_run_id', 'task_run_id'),
+    )
     id = Column(Integer, primary_key=True)
     task_run_id = Column(Integer, ForeignKey('task_runs.id'), nullable=False)
     upstream_task_id = Column(Integer, ForeignKey('task_runs.id'), nullable=False)
@@ -201,6 +819,14 @@ class TaskRunDependencies(Base):
 
 class Heartbeats(Base):
     __tablename__ = 'heartbeats'
+    __table_args__ = (
+        # Serves the lookup of task runs whose heartbeats stopped
+        Index(
+            'ix_heartbeats_task_run_id_last_heartbeat_time',
+            'task_run_id',
+            'last_heartbeat_time'
+        ),
+    )
     id = Column(Integer, primary_key=True)
     task_run_id = Column(Integer, ForeignKey('task_runs.id'), nullable=True)
     task_type = Column(String(255), nullable=False)
@@ -214,9 +840,146 @@ class Heartbeats(Base):
             .format(self.id, self.task_run_id, self.task_type, self.last_heartbeat_time)
         )
 
+    @classmethod
+    @provide_session
+    def touch(cls, heartbeat_ids, session=None):
+        """
+        Set the last heartbeat time of many heartbeats to now with one UPDATE
+        per 1000 heartbeats
+
+        :param heartbeat_ids: Heartbeat ids
+        :type heartbeat_ids: list
+        """
+        last_heartbeat_time = datetime.utcnow()
+        for heartbeat_ids_chunk in chunked(sorted(heartbeat_ids), 1000):
+            (
+                session
+                .query(cls)
+                .filter(cls.id.in_(heartbeat_ids_chunk))
+                .update({cls.last_heartbeat_time: last_heartbeat_time}, synchronize_session=False)
+            )
+
+    @classmethod
+    @provide_session
+    def get_stale_task_run_ids(cls, stale_seconds, session=None):
+        """
+        Get running task runs that sent no heartbeat for stale_seconds. Their
+        worker most likely died without setting their state. Runs that changed
+        state within stale_seconds are skipped so a run that was tried again and
+        has yet to send its first heartbeat is not stale. A run without any
+        heartbeat is stale once it did not change state for stale_seconds, as
+        its worker died before sending the first one.
+
+        :param stale_seconds: Seconds without a heartbeat after which a task run is stale
+        :type stale_seconds: int
+        :rtype: list
+        """
+        stale_before = datetime.utcnow() - timedelta(seconds=stale_seconds)
+        return [
+            task_run_id
+            for task_run_id, in (
+                session
+                .query(TaskRuns.id)
+                .outerjoin(cls, cls.task_run_id == TaskRuns.id)
+                .filter(TaskRuns.state == State.RUNNING)
+                .filter(TaskRuns.updated_at < stale_before)
+                .group_by(TaskRuns.id)
+                .having(or_(
+                    func.max(cls.last_heartbeat_time) < stale_before,
+                    func.max(cls.last_heartbeat_time).is_(None)
+                ))
+            )
+        ]
+
+
+class SchedulerLeases(Base):
+    """
+    Lease that elects the scheduler allowed to create task runs. The holder
+    renews the lease every tick and in the same transaction as the runs it
+    inserts. Standby schedulers take over once the lease expires.
+    """
+    __tablename__ = 'scheduler_leases'
+    name = Column(String(255), primary_key=True)
+    holder = Column(String(255), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @classmethod
+    @provide_session
+    def acquire(cls, holder, lease_seconds, name='scheduler', session=None):
+        """
+        Take or renew the lease if it is free, expired or already held by holder
+
+        :param holder: Unique id of the scheduler process
+        :type holder: str
+        :param lease_seconds: Seconds the lease is held without being renewed
+        :type lease_seconds: int
+        :return: True if holder holds the lease
+        :rtype: bool
+        """
+        now = datetime.utcnow()
+        lease = {'holder': holder, 'expires_at': now + timedelta(seconds=lease_seconds)}
+        # Single conditional UPDATE so two schedulers can not both take an expired lease
+        updated_leases = (
+            session
+            .query(cls)
+            .filter(cls.name == name)
+            .filter((cls.holder == holder) | (cls.expires_at < now))
+            .update(lease, synchronize_session=False)
+        )
+        if not updated_leases:
+            try:
+                session.execute(cls.__table__.insert(), dict(lease, name=name))
+            except IntegrityError:
+                # Lease exists and is held by another scheduler
+                session.rollback()
+                return False
+        session.commit()
+        return True
+
+    @classmethod
+    def renew(cls, holder, lease_seconds, session, name='scheduler'):
+        """
+        Extend the lease within the caller's transaction. Returns False if
+        holder no longer holds the lease, in which case the caller must roll
+        back its transaction
+        """
+        now = datetime.utcnow()
+        updated_leases = (
+            session
+            .query(cls)
+            .filter(cls.name == name)
+            .filter(cls.holder == holder)
+            .filter(cls.expires_at >= now)
+            .update(
+                {'expires_at': now + timedelta(seconds=lease_seconds)},
+                synchronize_session=False
+            )
+        )
+        return updated_leases == 1
+
+    @classmethod
+    @provide_session
+    def release(cls, holder, name='scheduler', session=None):
+        """
+        Expire the lease so a standby scheduler takes over without waiting
+        """
+        (
+            session
+            .query(cls)
+            .filter(cls.name == name)
+            .filter(cls.holder == holder)
+            .update({'expires_at': datetime.utcnow()}, synchronize_session=False)
+        )
+        session.commit()
+
 
 class Tweets(Base):
     __tablename__ = 'tweets'
+    __table_args__ = (
+        # Serves the latest tweet id lookups of extracts without a table scan
+        Index('ix_tweets_user_screen_name_tweet_id', 'user_screen_name', 'tweet_id'),
+    )
     tweet_id = Column(BIGINT(unsigned=True), primary_key=True)
     tweet_type = Column(String(255))
     # Derived from parent level attributes of JSON returned by statuses/user_timeline
@@ -275,6 +1038,48 @@ class Tweets(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Fields of a status node in the JSON returned by statuses/user_timeline. The tweet
+    # itself as well as its quoted_status and retweeted_status nodes are status nodes.
+    # created_at and full_text are converted into the created_at and text columns
+    status_json_paths = {
+        'tweet_id': 'id',
+        'created_at': 'created_at',
+        'text': 'text',
+        'full_text': 'full_text',
+        'media_urls': 'extended_entities.media.[*].media_url',
+        'media_types': 'extended_entities.media.[*].type',
+        'media_video_urls': (
+            'extended_entities'
+            '.media'
+            '.[*]'
+            '.video_info'
+            '.variants'
+            '.[*]'
+            '.{content_type == "video/mp4"}'
+            '.[0]'
+            '.url'
+        ),
+        'expanded_urls': 'entities.urls.[*].expanded_url',
+        'favorite_count': 'favorite_count',
+        'retweet_count': 'retweet_count',
+        'user_id': 'user.id',
+        'user_screen_name': 'user.screen_name',
+    }
+    # Column prefix and status node of the tweet, quoted tweet and retweet
+    status_nodes = [
+        ('', None),
+        ('quoted_', 'quoted_status'),
+        ('retweet_', 'retweeted_status'),
+    ]
+    # Fields that are only populated for the tweet itself
+    tweet_json_paths = {
+        'in_reply_to_tweet_id': 'in_reply_to_status_id',
+        'in_reply_to_user_id': 'in_reply_to_user_id',
+        'in_reply_to_screen_name': 'in_reply_to_screen_name',
+    }
+    tweet_date_format = '%a %b %d %H:%M:%S +0000 %Y'
+    _json_path_plan = None
+
     def __repr__(self):
         return (
             "<Tweet(id={0}, text={1}, user_screen_name={2})>"
@@ -282,339 +1087,240 @@ class Tweets(Base):
         )
 
     @classmethod
-    @provide_session
-    def latest_tweet_id_for_user(cls, screen_name, session=None):
+    def get_json_path_plan(cls):
         """
-        Get the latest tweet id stored in the database for a given user_id
-
-        :param screen_name: user_id
-        :type screen_name: String
+        Return the JsonPathPlan that extracts every column from a tweet json in a
+        single traversal. Plan is compiled on first use.
         """
-        return (
-            session
-            .query(func.max(cls.tweet_id))
-            .filter(cls.user_screen_name == screen_name)
-            .scalar()
-        )
+        if cls._json_path_plan is None:
+            operations_map = dict(cls.tweet_json_paths)
+            for prefix, status_node in cls.status_nodes:
+                for name, operations in cls.status_json_paths.items():
+                    if status_node:
+                        operations = '{}.{}'.format(status_node, operations)
+                    operations_map[prefix + name] = operations
+            cls._json_path_plan = JsonPathPlan(operations_map)
+        return cls._json_path_plan
 
     @classmethod
-    @provide_session
-    def load_into_db(cls, tweets_json, session=None):
-        tweets = list()
-        date_format = '%a %b %d %H:%M:%S +0000 %Y'
-        for tweet_json in tweets_json:
-            tweet_dict = dict()
-            tweet_dict['tweet_id'] = tweet_json['id']
-            tweet_dict['tweet_created_at'] = datetime.strptime(
-                tweet_json.get('created_at'),
-                date_format
-            )
-            # Based on the tweet_mode param passed to user_timeline data is
-            # returned in text of full_text attribute
-            tweet_dict['text'] = tweet_json.get('text') or tweet_json.get('full_text')
-            tweet_dict['media_urls'] = extract_from_json(
-                tweet_json,
-                (
-                    'extended_entities'
-                    '.media'
-                    '.[*]'
-                    '.media_url'
-                )
-            )
-            tweet_dict['media_types'] = extract_from_json(
-                tweet_json,
-                (
-                    'extended_entities'
-                    '.media'
-                    '.[*]'
-                    '.type'
-                )
-            )
-            tweet_dict['media_video_urls'] = extract_from_json(
-                tweet_json,
-                (
-                    'extended_entities'
-                    '.media'
-                    '.[*]'
-                    '.video_info'
-                    '.variants'
-                    '.[*]'
-                    '.{content_type == "video/mp4"}'
-                    '.[0]'
-                    '.url'
-                )
-            )
-            tweet_dict['expanded_urls'] = extract_from_json(
-                tweet_json,
-                (
-                    'entities'
-                    '.urls'
-                    '.[*]'
-                    '.expanded_url'
-                )
-            )
-            tweet_dict['favorite_count'] = tweet_json.get('favorite_count')
-            tweet_dict['retweet_count'] = tweet_json.get('retweet_count')
-            tweet_dict['user_id'] = extract_from_json(
-                tweet_json,
-                (
-                    'user'
-                    '.id'
-                )
-            )
-            tweet_dict['user_screen_name'] = extract_from_json(
-                tweet_json,
-                (
-                    'user'
-                    '.screen_name'
-                )
-            )
-            tweet_dict['in_reply_to_tweet_id'] = tweet_json.get('in_reply_to_status_id')
-            tweet_dict['in_reply_to_user_id'] = tweet_json.get('in_reply_to_user_id')
-            tweet_dict['in_reply_to_screen_name'] = tweet_json.get('in_reply_to_screen_name')
-            tweet_dict['quoted_tweet_id'] = extract_from_json(
-                tweet_json,
-                (
-                    'quoted_status'
-                    '.id'
-                )
-            )
+    def flatten(cls, tweet_json):
+        """
+        Return a dict of Tweets columns and their values for a tweet json returned
+        by statuses/user_timeline
 
-            quoted_created_at = extract_from_json(
-                tweet_json,
-                (
-                    'quoted_status'
-                    '.created_at'
-                )
-            )
-            if quoted_created_at:
-                tweet_dict['quoted_created_at'] = datetime.strptime(
-                    quoted_created_at,
-                    date_format
-                )
-            else:
-                tweet_dict['quoted_created_at'] = None
+        :param tweet_json: Tweet json
+        :type tweet_json: dict
+        """
+        tweet_dict = cls.get_json_path_plan().extract(tweet_json)
+        for prefix, _ in cls.status_nodes:
             # Based on the tweet_mode param passed to user_timeline data is
             # returned in text of full_text attribute
-            tweet_dict['quoted_text'] = (
-                extract_from_json(
-                    tweet_json,
-                    (
-                        'quoted_status'
-                        '.text'
-                    )
-                ) or
-                extract_from_json(
-                    tweet_json,
-                    (
-                        'quoted_status'
-                        '.full_text'
-                    )
-                )
-            )
-            tweet_dict['quoted_media_urls'] = extract_from_json(
-                tweet_json,
-                (
-                    'quoted_status'
-                    '.extended_entities'
-                    '.media'
-                    '.[*]'
-                    '.media_url'
-                )
-            )
-            tweet_dict['quoted_media_types'] = extract_from_json(
-                tweet_json,
-                (
-                    'quoted_status'
-                    '.extended_entities'
-                    '.media'
-                    '.[*]'
-                    '.type'
-                )
-            )
-            tweet_dict['quoted_media_video_urls'] = extract_from_json(
-                tweet_json,
-                (
-                    'quoted_status'
-                    '.extended_entities'
-                    '.media'
-                    '.[*]'
-                    '.video_info'
-                    '.variants'
-                    '.[*]'
-                    '.{content_type == "video/mp4"}'
-                    '.[0]'
-                    '.url'
-                )
-            )
-            tweet_dict['quoted_expanded_urls'] = extract_from_json(
-                tweet_json,
-                (
-                    'quoted_status'
-                    '.entities'
-                    '.urls'
-                    '.[*]'
-                    '.expanded_url'
-                )
-            )
-            tweet_dict['quoted_favorite_count'] = extract_from_json(
-                tweet_json,
-                (
-                    'quoted_status'
-                    '.favorite_count'
-                )
-            )
-            tweet_dict['quoted_retweet_count'] = extract_from_json(
-                tweet_json,
-                (
-                    'quoted_status'
-                    '.retweet_count'
-                )
-            )
-            tweet_dict['quoted_user_id'] = extract_from_json(
-                tweet_json,
-                (
-                    'quoted_status'
-                    '.user'
-                    '.id'
-                )
-            )
-            tweet_dict['quoted_user_screen_name'] = extract_from_json(
-                tweet_json,
-                (
-                    'quoted_status'
-                    '.user'
-                    '.screen_name'
-                )
-            )
-            tweet_dict['retweet_tweet_id'] = extract_from_json(
-                tweet_json,
-                (
-                    'retweeted_status'
-                    '.id'
-                )
-            )
-
-            retweet_created_at = extract_from_json(
-                tweet_json,
-                (
-                    'retweeted_status'
-                    '.created_at'
-                )
-            )
-            if retweet_created_at:
-                tweet_dict['retweet_created_at'] = datetime.strptime(
-                    retweet_created_at,
-                    date_format
+            full_text = tweet_dict.pop(prefix + 'full_text')
+            tweet_dict[prefix + 'text'] = tweet_dict[prefix + 'text'] or full_text
+            created_at = tweet_dict.pop(prefix + 'created_at')
+            created_at_column = (prefix or 'tweet_') + 'created_at'
+            if created_at:
+                tweet_dict[created_at_column] = datetime.strptime(
+                    created_at,
+                    cls.tweet_date_format
                 )
             else:
-                tweet_dict['retweet_created_at'] = None
-            # Based on the tweet_mode param passed to user_timeline data is
-            # returned in text of full_text attribute
-            tweet_dict['retweet_text'] = (
-                    extract_from_json(
-                        tweet_json,
-                        (
-                            'retweeted_status'
-                            '.text'
-                        )
-                    ) or
-                    extract_from_json(
-                        tweet_json,
-                        (
-                            'retweeted_status'
-                            '.full_text'
-                        )
+                tweet_dict[created_at_column] = None
+        tweet_dict['raw_tweet'] = tweet_json
+        # Logic to derive type of tweet
+        if tweet_dict['in_reply_to_tweet_id']:
+            tweet_dict['tweet_type'] = 'Reply Tweet'
+        elif tweet_dict['quoted_tweet_id']:
+            tweet_dict['tweet_type'] = 'Quoted Tweet'
+        elif tweet_dict['retweet_tweet_id']:
+            tweet_dict['tweet_type'] = 'Retweet'
+        else:
+            tweet_dict['tweet_type'] = 'Tweet'
+        return tweet_dict
+
+    # Latest tweet id of users looked up or loaded by this process. None for
+    # users with no tweets stored
+    _latest_tweet_ids = dict()
+    _latest_tweet_ids_lock = threading.Lock()
+
+    @classmethod
+    def cache_latest_tweet_ids(cls, tweet_dicts):
+        """
+        Move the cached latest tweet id of users forward to the given tweets. Call
+        once the tweets are committed so a rolled back load is never cached.
+        Only users already in the cache are updated as the cache can not know
+        about tweets stored before the user was looked up.
+
+        :param tweet_dicts: Flattened tweets (see flatten)
+        :type tweet_dicts: list
+        """
+        with cls._latest_tweet_ids_lock:
+            for tweet_dict in tweet_dicts:
+                # Screen names are case insensitive
+                screen_name = tweet_dict['user_screen_name'].lower()
+                if screen_name in cls._latest_tweet_ids:
+                    cls._latest_tweet_ids[screen_name] = max(
+                        tweet_dict['tweet_id'],
+                        cls._latest_tweet_ids[screen_name]
                     )
+
+    @classmethod
+    def clear_latest_tweet_ids_cache(cls):
+        with cls._latest_tweet_ids_lock:
+            cls._latest_tweet_ids.clear()
+
+    @classmethod
+    @provide_session
+    def latest_tweet_ids_for_users(cls, screen_names, use_cache=False, session=None):
+        """
+        Get the latest tweet id stored in the database for each of the given users
+        with one grouped query per 1000 users
+
+        :param screen_names: User screen names
+        :type screen_names: list
+        :param use_cache: Answer from ids cached by earlier lookups and loads of this
+            process. Tweets stored by other processes since are not seen.
+        :type use_cache: bool
+        :return: Latest tweet id by screen name. None for users with no tweets stored
+        :rtype: dict
+        """
+        latest_tweet_ids = dict()
+        if use_cache:
+            with cls._latest_tweet_ids_lock:
+                for screen_name in screen_names:
+                    if screen_name.lower() in cls._latest_tweet_ids:
+                        latest_tweet_ids[screen_name] = cls._latest_tweet_ids[screen_name.lower()]
+        # A list keeps the order of screen_names so lookups are deterministic
+        missing_screen_names = [
+            screen_name
+            for screen_name in screen_names
+            if screen_name not in latest_tweet_ids
+        ]
+        for screen_names_chunk in chunked(missing_screen_names, 1000):
+            rows = (
+                session
+                .query(cls.user_screen_name, func.max(cls.tweet_id))
+                .filter(cls.user_screen_name.in_(screen_names_chunk))
+                .group_by(cls.user_screen_name)
             )
-            tweet_dict['retweet_media_urls'] = extract_from_json(
-                tweet_json,
-                (
-                    'retweeted_status'
-                    '.extended_entities'
-                    '.media'
-                    '.[*]'
-                    '.media_url'
-                )
-            )
-            tweet_dict['retweet_media_types'] = extract_from_json(
-                tweet_json,
-                (
-                    'retweeted_status'
-                    '.extended_entities'
-                    '.media'
-                    '.[*]'
-                    '.type'
-                )
-            )
-            tweet_dict['retweet_media_video_urls'] = extract_from_json(
-                tweet_json,
-                (
-                    'retweeted_status'
-                    '.extended_entities'
-                    '.media'
-                    '.[*]'
-                    '.video_info'
-                    '.variants'
-                    '.[*]'
-                    '.{content_type == "video/mp4"}'
-                    '.[0]'
-                    '.url'
-                )
-            )
-            tweet_dict['retweet_expanded_urls'] = extract_from_json(
-                tweet_json,
-                (
-                    'retweeted_status'
-                    '.entities'
-                    '.urls'
-                    '.[*]'
-                    '.expanded_url'
-                )
-            )
-            tweet_dict['retweet_favorite_count'] = extract_from_json(
-                tweet_json,
-                (
-                    'retweeted_status'
-                    '.favorite_count'
-                )
-            )
-            tweet_dict['retweet_retweet_count'] = extract_from_json(
-                tweet_json,
-                (
-                    'retweeted_status'
-                    '.retweet_count'
-                )
-            )
-            tweet_dict['retweet_user_id'] = extract_from_json(
-                tweet_json,
-                (
-                    'retweeted_status'
-                    '.user'
-                    '.id'
-                )
-            )
-            tweet_dict['retweet_user_screen_name'] = extract_from_json(
-                tweet_json,
-                (
-                    'retweeted_status'
-                    '.user'
-                    '.screen_name'
+            found_tweet_ids = dict()
+            for found_screen_name, tweet_id in rows:
+                found_screen_name = found_screen_name.lower()
+                found_tweet_ids[found_screen_name] = max(
+                    tweet_id,
+                    found_tweet_ids.get(found_screen_name, tweet_id)
                 )
-            )
-            tweet_dict['raw_tweet'] = tweet_json
-            # Logic to derive type of tweet
-            if tweet_dict['in_reply_to_tweet_id']:
-                tweet_dict['tweet_type'] = 'Reply Tweet'
-            elif tweet_dict['quoted_tweet_id']:
-                tweet_dict['tweet_type'] = 'Quoted Tweet'
-            elif tweet_dict['retweet_tweet_id']:
-                tweet_dict['tweet_type'] = 'Retweet'
-            else:
-                tweet_dict['tweet_type'] = 'Tweet'
-            # Collecting tweet object to bulk update at the end
-            tweets.append(cls(**tweet_dict))
-        session.bulk_save_objects(tweets)
+            for screen_name in screen_names_chunk:
+                latest_tweet_ids[screen_name] = found_tweet_ids.get(screen_name.lower())
+        if missing_screen_names:
+            with cls._latest_tweet_ids_lock:
+                for screen_name in missing_screen_names:
+                    cls._latest_tweet_ids[screen_name.lower()] = latest_tweet_ids[screen_name]
+        return latest_tweet_ids
+
+    @classmethod
+    @provide_session
+    def latest_tweet_id_for_user(cls, screen_name, use_cache=False, session=None):
+        """
+        Get the latest tweet id stored in the database for a given user
+
+        :param screen_name: User screen name
+        :type screen_name: String
+        :param use_cache: See latest_tweet_ids_for_users
+        :type use_cache: bool
+        """
+        return cls.latest_tweet_ids_for_users(
+            [screen_name],
+            use_cache=use_cache,
+            session=session
+        )[screen_name]
+
+    @classmethod
+    @provide_session
+    def load_into_db(cls, tweets_json, session=None):
+        """
+        Insert tweets. Returns the flattened tweets to pass to cache_latest_tweet_ids
+        once they are committed
+        """
+        # Inserting flattened tweets as mappings to skip building ORM objects
+        tweets = [cls.flatten(tweet_json) for tweet_json in tweets_json]
+        session.bulk_insert_mappings(cls, tweets)
+        return tweets
+
+    @classmethod
+    @provide_session
+    def upsert_into_db(cls, tweet_dicts, session=None):
+        """
+        Insert flattened tweets (see flatten) with a single executemany. Tweets
+        that are already stored are updated so files can be ingested again.
+        Pass the tweets to cache_latest_tweet_ids once they are committed.
+
+        :param tweet_dicts: Flattened tweets
+        :type tweet_dicts: list
+        """
+        if not tweet_dicts:
+            return
+        update_columns = [
+            column.name
+            for column in cls.__table__.columns
+            if not column.primary_key and column.name != 'created_at'
+        ]
+        session.execute(Upsert(cls.__table__, update_columns), tweet_dicts)
+
+    @classmethod
+    def bulk_load_files(cls, file_paths, chunk_size=1000, processes=None):
+        """
+        Load files of newline delimited tweet json into the DB. Chunks of chunk_size
+        lines are flattened in a pool of processes and each chunk is upserted and
+        committed on its own, so a failure only loses that chunk. At most two chunks
+        per process are in flight to keep memory bounded.
+
+        :param file_paths: Paths of newline delimited tweet json files
+        :type file_paths: list
+        :param chunk_size: Number of tweets flattened and committed together
+        :type chunk_size: int
+        :param processes: Number of flattening processes. Defaults to number of cpus
+        :type processes: int
+        :return: Number of tweets loaded and number of chunks that failed
+        :rtype: tuple
+        """
+        processes = processes or billiard.cpu_count()
+        max_pending_chunks = 2 * processes
+        pending_chunks = deque()
+        loaded_tweets = 0
+        failed_chunks = 0
+
+        def load_chunk(flattened_chunk):
+            try:
+                tweet_dicts = flattened_chunk.get()
+                # Committed on return
+                cls.upsert_into_db(tweet_dicts)
+                cls.cache_latest_tweet_ids(tweet_dicts)
+            except Exception as e:
+                logger.exception(e)
+                return 0, 1
+            return len(tweet_dicts), 0
+
+        # Using billiard instead of multiprocessing so this can also run inside a Celery task
+        pool = billiard.Pool(processes=processes)
+        try:
+            for chunk in chunked(_read_lines(file_paths), chunk_size):
+                pending_chunks.append(pool.apply_async(_flatten_tweet_lines, (chunk, )))
+                if len(pending_chunks) >= max_pending_chunks:
+                    loaded, failed = load_chunk(pending_chunks.popleft())
+                    loaded_tweets += loaded
+                    failed_chunks += failed
+            while pending_chunks:
+                loaded, failed = load_chunk(pending_chunks.popleft())
+                loaded_tweets += loaded
+                failed_chunks += failed
+        finally:
+            pool.close()
+            pool.join()
+        logger.info(
+            'Loaded {} tweets. {} chunks failed'.format(loaded_tweets, failed_chunks)
+        )
+        return loaded_tweets, failed_chunks
 
     def get_full_text(self):
         """
@@ -633,6 +1339,46 @@ class Tweets(Base):
         return 'https://twitter.com/i/web/status/{}'.format(self.tweet_id)
 
 
+class TimelineCursors(Base):
+    """
+    Progress of the last TwitterExtract of a user's timeline. The timeline is walked
+    from the newest tweet back to since_id. max_id is the position of an unfinished
+    walk and is cleared when the walk completes, at which point since_id is moved to
+    the newest tweet committed.
+    """
+    __tablename__ = 'timeline_cursors'
+    screen_name = Column(String(100), primary_key=True)
+    # Tweets up to since_id are stored
+    since_id = Column(BIGINT(unsigned=True))
+    # Tweets after max_id are stored. Null when no walk is in progress
+    max_id = Column(BIGINT(unsigned=True))
+    # Newest tweet stored by the walk in progress
+    newest_id = Column(BIGINT(unsigned=True))
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return (
+            "<TimelineCursor(screen_name={0}, since_id={1}, max_id={2})>"
+            .format(self.screen_name, self.since_id, self.max_id)
+        )
+
+
+def _read_lines(file_paths):
+    for file_path in file_paths:
+        with open(file_path) as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+
+def _flatten_tweet_lines(lines):
+    """
+    Flatten lines of tweet json. Runs in the Tweets.bulk_load_files process pool
+    so it has to be a module level function
+    """
+    return [Tweets.flatten(json.loads(line)) for line in lines]
+
+
 class News(Base):
     __tablename__ = 'news'
     news_id = Column(String(64), primary_key=True)
@@ -642,6 +1388,8 @@ class News(Base):
     url = Column(String(1000))
     published_at = Column(DateTime)
     raw_news = Column(JSON)
+    # sha256 of raw_news. Used to skip entries that have not changed since they were stored
+    content_hash = Column(String(64))
 
     def __repr__(self):
         return (
@@ -650,14 +1398,21 @@ class News(Base):
         )
 
     @classmethod
-    @provide_session
-    def load_into_db(cls, news_feed_dict, session=None):
+    def flatten(cls, news_feed_dict):
+        """
+        Return a dict of News columns and their values for every entry of a parsed
+        RSS feed
+
+        :param news_feed_dict: Feed returned by feedparser.parse
+        :type news_feed_dict: dict
+        """
         try:
             source = news_feed_dict['feed']['link']
         except KeyError as ke:
             logger.exception(ke)
             raise PropelException('Unable to parse News feed Dict')
         news_entries = news_feed_dict.get('entries')
+        news_dicts = list()
         for news_entry in news_entries:
             news_dict = dict()
             news_dict['news_id'] = hashlib.sha256(news_entry.get('link')).hexdigest()
@@ -671,9 +1426,66 @@ class News(Base):
                 )
             else:
                 news_dict['published_at'] = datetime.utcnow()
-            news_dict['raw_news'] = json.dumps(news_entry, default=cls._python_object_converter)
-            # Merging newly created News
-            session.merge(cls(**news_dict))
+            news_dict['raw_news'] = json.dumps(
+                news_entry,
+                default=cls._python_object_converter,
+                sort_keys=True
+            )
+            news_dict['content_hash'] = hashlib.sha256(news_dict['raw_news']).hexdigest()
+            news_dicts.append(news_dict)
+        return news_dicts
+
+    @classmethod
+    @provide_session
+    def upsert_into_db(cls, news_dicts, session=None):
+        """
+        Upsert flattened news (see flatten) with a single statement. News that are
+        already stored with the same content are skipped.
+
+        :param news_dicts: Flattened news
+        :type news_dicts: list
+        :return: Number of news inserted or updated
+        :rtype: int
+        """
+        # Feeds can repeat an entry. Last one wins
+        news_dicts = {news_dict['news_id']: news_dict for news_dict in news_dicts}
+        if not news_dicts:
+            return 0
+        stored_content_hashes = dict(
+            session
+            .query(cls.news_id, cls.content_hash)
+            .filter(cls.news_id.in_(news_dicts.keys()))
+        )
+        changed_news_dicts = [
+            news_dict
+            for news_id, news_dict in news_dicts.items()
+            if stored_content_hashes.get(news_id) != news_dict['content_hash']
+        ]
+        logger.info(
+            '{} of {} news entries are new or changed'
+            .format(len(changed_news_dicts), len(news_dicts))
+        )
+        if changed_news_dicts:
+            update_columns = [
+                column.name
+                for column in cls.__table__.columns
+                if not column.primary_key
+            ]
+            session.execute(Upsert(cls.__table__, update_columns), changed_news_dicts)
+        return len(changed_news_dicts)
+
+    @classmethod
+    @provide_session
+    def load_into_db(cls, news_feed_dict, session=None):
+        """
+        Upsert the entries of a parsed RSS feed. See upsert_into_db
+
+        :param news_feed_dict: Feed returned by feedparser.parse
+        :type news_feed_dict: dict
+        :return: Number of news inserted or updated
+        :rtype: int
+        """
+        return cls.upsert_into_db(cls.flatten(news_feed_dict), session=session)
 
     @staticmethod
     def _python_object_converter(o):
@@ -685,6 +1497,89 @@ class News(Base):
             return o.__str__()
 
 
+class FeedValidators(Base):
+    """
+    HTTP validators (ETag and Last-Modified) of the last downloaded copy of an RSS feed.
+    Sent back with the next request so an unchanged feed is answered with 304 Not Modified
+    """
+    __tablename__ = 'feed_validators'
+    # sha256 of rss_url
+    feed_id = Column(String(64), primary_key=True)
+    rss_url = Column(String(1000), nullable=False)
+    etag = Column(String(1000))
+    modified = Column(String(255))
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return (
+            "<FeedValidators(rss_url={0}, etag={1}, modified={2})>"
+            .format(self.rss_url, self.etag, self.modified)
+        )
+
+    @staticmethod
+    def _feed_id(rss_url):
+        return hashlib.sha256(rss_url).hexdigest()
+
+    @classmethod
+    def get_validators(cls, rss_url):
+        """
+        Return the etag and modified validators stored for rss_url. Both are None
+        when the feed was never downloaded
+
+        :param rss_url: RSS feed url
+        :type rss_url: str
+        """
+        return cls.get_validators_by_url([rss_url]).get(rss_url, (None, None))
+
+    @classmethod
+    @provide_session
+    def get_validators_by_url(cls, rss_urls, session=None):
+        """
+        Return a dict of rss url and its (etag, modified) validators for the feeds
+        in rss_urls that were downloaded before
+
+        :param rss_urls: RSS feed urls
+        :type rss_urls: list
+        """
+        feed_ids = [cls._feed_id(rss_url) for rss_url in rss_urls]
+        if not feed_ids:
+            return dict()
+        return {
+            feed_validators.rss_url: (feed_validators.etag, feed_validators.modified)
+            for feed_validators in session.query(cls).filter(cls.feed_id.in_(feed_ids))
+        }
+
+    @classmethod
+    def set_validators(cls, rss_url, etag, modified):
+        cls.set_validators_by_url({rss_url: (etag, modified)})
+
+    @classmethod
+    @provide_session
+    def set_validators_by_url(cls, validators_by_url, session=None):
+        """
+        Store the validators of many feeds with a single statement
+
+        :param validators_by_url: Dict of rss url and its (etag, modified) validators
+        :type validators_by_url: dict
+        """
+        if not validators_by_url:
+            return
+        feed_validators = [
+            {
+                'feed_id': cls._feed_id(rss_url),
+                'rss_url': rss_url,
+                'etag': etag,
+                'modified': modified,
+                'updated_at': datetime.utcnow()
+            }
+            for rss_url, (etag, modified) in validators_by_url.items()
+        ]
+        session.execute(
+            Upsert(cls.__table__, ['rss_url', 'etag', 'modified', 'updated_at']),
+            feed_validators
+        )
+
+
 class Article(object):
 
     def __init__(
@@ -731,3 +1626,14 @@ class BaseTask(object):
         :type task: dict
         """
         raise NotImplementedError()
+
+
+class SerializedTask(BaseTask):
+    """
+    Placeholder for a task of a DAG built from its serialized form. It carries
+    the task's id, type and params but none of its code
+    """
+
+    def __init__(self, task_id, task_type, params=None, dag=None):
+        self.task_type = task_type
+        super(SerializedTask, self).__init__(task_id, params=params, dag=dag)
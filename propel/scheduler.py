@@ -1,15 +1,923 @@
+import heapq
+import os
+import socket
 import time
+import uuid
+from collections import Counter, defaultdict
 from datetime import datetime, timedelta
-from sqlalchemy import func
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
 from propel import configuration
-from propel.models import Tasks, TaskRuns
+from propel.models import (DagBag, DagRuns, Heartbeats, SchedulerLeases, SerializedDagBag, Tasks,
+                           TaskRuns, TaskRunDependencies)
 from propel.settings import logger
 from propel.executors import Executor
 from propel.utils.db import provide_session
-from propel.utils.general import Memoize, HeartbeatMixin
+from propel.utils.general import Memoize, HeartbeatMixin, chunked
+from propel.utils.retries import RetryPolicy
 from propel.utils.state import State
 
 
+def _get_task_run_params(task, run_ds):
+    task_run_params = task.as_dict()
+    task_run_params['run_ds'] = run_ds
+    task_run_params['interval_start_ds'] = (
+            run_ds
+            - timedelta(seconds=task.run_frequency_seconds)
+    )
+    task_run_params['interval_end_ds'] = run_ds
+    return task_run_params
+
+
+class BackfillPlanner(object):
+    """
+    Plans every missed or requested interval of a task at once instead of one
+    interval per scheduler tick. Runs are queued while the task has fewer than
+    max_active_runs_per_task queued or running runs, so catching up is paced by
+    the executor workers rather than by the tick rate.
+    """
+    # Seconds before a task that has no free run slots is checked again
+    retry_seconds = 30
+
+    def __init__(self, max_active_runs_per_task=None):
+        if max_active_runs_per_task is None:
+            max_active_runs_per_task = int(configuration.get('core', 'max_active_runs_per_task'))
+        self.max_active_runs_per_task = max_active_runs_per_task
+
+    @staticmethod
+    @provide_session
+    def get_active_run_counts(task_ids, session=None):
+        """
+        Get the number of queued, running and retrying runs of each of the given tasks
+
+        :param task_ids: Task ids
+        :type task_ids: list
+        :rtype: dict
+        """
+        active_run_counts = dict()
+        for task_ids_chunk in chunked(task_ids, 1000):
+            active_run_counts.update(
+                session
+                .query(TaskRuns.task_id, func.count(TaskRuns.id))
+                .filter(TaskRuns.state.in_([State.QUEUED, State.RUNNING, State.UP_FOR_RETRY]))
+                .filter(TaskRuns.task_id.in_(task_ids_chunk))
+                .group_by(TaskRuns.task_id)
+            )
+        return active_run_counts
+
+    @staticmethod
+    def get_run_ds_range(task, start_ds, end_ds, limit=None):
+        """
+        Get run_ds of a task from start_ds to end_ds, both inclusive, one
+        run_frequency_seconds apart
+
+        :param limit: Maximum number of run_ds returned
+        :type limit: int
+        """
+        run_ds_range = list()
+        run_ds = start_ds
+        while run_ds <= end_ds and (limit is None or len(run_ds_range) < limit):
+            run_ds_range.append(run_ds)
+            run_ds += timedelta(seconds=task.run_frequency_seconds)
+        return run_ds_range
+
+    def get_available_run_slots(self, active_run_count):
+        return max(self.max_active_runs_per_task - active_run_count, 0)
+
+    def get_missed_run_ds(self, task, task_last_run_ds, current_datetime, active_run_count):
+        """
+        Get the run_ds of the intervals a task missed since its last run that
+        fit in its free run slots
+        """
+        return self.get_run_ds_range(
+            task,
+            task_last_run_ds + timedelta(seconds=task.run_frequency_seconds),
+            current_datetime,
+            limit=self.get_available_run_slots(active_run_count)
+        )
+
+    @staticmethod
+    @provide_session
+    def _get_existing_run_ds(task, start_ds, end_ds, session=None):
+        return set(
+            run_ds
+            for run_ds, in (
+                session
+                .query(TaskRuns.run_ds)
+                .filter(TaskRuns.task_id == task.id)
+                .filter(TaskRuns.run_ds.between(start_ds, end_ds))
+            )
+        )
+
+    def _drop_existing_run_ds(self, tasks_by_id, tasks_to_run, pending_run_ds):
+        """
+        Put the run_ds of runs that failed to insert back in pending_run_ds,
+        leaving out the run_ds that now have a run in the DB
+
+        :return: True if any run_ds was left out
+        :rtype: bool
+        """
+        dropped = False
+        for task_id in set(task_run_params['id'] for task_run_params in tasks_to_run):
+            run_ds_list = sorted(
+                [
+                    task_run_params['run_ds']
+                    for task_run_params in tasks_to_run
+                    if task_run_params['id'] == task_id
+                ] + pending_run_ds[task_id]
+            )
+            existing_run_ds = self._get_existing_run_ds(
+                tasks_by_id[task_id],
+                run_ds_list[0],
+                run_ds_list[-1]
+            )
+            pending_run_ds[task_id] = [
+                run_ds
+                for run_ds in run_ds_list
+                if run_ds not in existing_run_ds
+            ]
+            dropped = dropped or len(pending_run_ds[task_id]) < len(run_ds_list)
+        return dropped
+
+    def backfill(self, tasks, start_ds, end_ds, executor, poll_seconds=10):
+        """
+        Queue runs of tasks for every interval from start_ds to end_ds that has no
+        run yet. Blocks until all runs are queued, waiting for active runs to
+        finish whenever a task has no free run slots.
+
+        :param tasks: Tasks to backfill
+        :type tasks: list
+        :param start_ds: run_ds of the first interval
+        :type start_ds: datetime.datetime
+        :param end_ds: Last run_ds backfilled. Capped at the current time
+        :type end_ds: datetime.datetime
+        :param executor: Executor the runs are queued on
+        :type executor: propel.executors.base_executor.BaseExecutor
+        :param poll_seconds: Seconds between checks for free run slots
+        :type poll_seconds: int
+        :return: Number of runs queued
+        :rtype: int
+        """
+        end_ds = min(end_ds, datetime.utcnow())
+        tasks_by_id = {task.id: task for task in tasks}
+        pending_run_ds = dict()
+        for task in tasks:
+            existing_run_ds = self._get_existing_run_ds(task, start_ds, end_ds)
+            pending_run_ds[task.id] = [
+                run_ds
+                for run_ds in self.get_run_ds_range(task, start_ds, end_ds)
+                if run_ds not in existing_run_ds
+            ]
+            logger.info(
+                'Backfilling {} runs of Task {}'
+                .format(len(pending_run_ds[task.id]), task.task_name)
+            )
+        queued_runs = 0
+        while True:
+            pending_run_ds = {
+                task_id: run_ds_list
+                for task_id, run_ds_list in pending_run_ds.items()
+                if run_ds_list
+            }
+            if not pending_run_ds:
+                return queued_runs
+            active_run_counts = self.get_active_run_counts(list(pending_run_ds))
+            tasks_to_run = list()
+            for task_id, run_ds_list in pending_run_ds.items():
+                available_run_slots = self.get_available_run_slots(
+                    active_run_counts.get(task_id, 0)
+                )
+                tasks_to_run.extend(
+                    _get_task_run_params(tasks_by_id[task_id], run_ds)
+                    for run_ds in run_ds_list[:available_run_slots]
+                )
+                pending_run_ds[task_id] = run_ds_list[available_run_slots:]
+            if tasks_to_run:
+                try:
+                    task_run_ids = Scheduler._insert_new_task_runs_to_db(tasks_to_run)
+                except IntegrityError as e:
+                    # Some runs were created meanwhile by the scheduler or another
+                    # backfill. Those are dropped and the others are planned again
+                    logger.warning('Task runs already exist: {}'.format(e))
+                    if not self._drop_existing_run_ds(tasks_by_id, tasks_to_run, pending_run_ds):
+                        raise
+                    continue
+                for task_run_params, task_run_id in zip(tasks_to_run, task_run_ids):
+                    task_run_params['task_run_id'] = task_run_id
+                executor.execute_async_batch(tasks_to_run)
+                queued_runs += len(tasks_to_run)
+                logger.info('Queued {} backfill runs'.format(len(tasks_to_run)))
+            if any(pending_run_ds.values()):
+                time.sleep(poll_seconds)
+
+
+def _get_dag_interval(dag):
+    # Interval of DAGs read from serialized_dags is in seconds
+    if isinstance(dag.interval, timedelta):
+        return dag.interval
+    return timedelta(seconds=dag.interval)
+
+
+def _get_retry_values(task_types):
+    """
+    :return: Values of the retry settings of new task runs by task type
+    :rtype: dict
+    """
+    return {
+        task_type: RetryPolicy.for_task_type(task_type).get_task_run_values()
+        for task_type in set(task_types)
+    }
+
+
+def _get_dag_task_run_params(dag, task, task_run_id, run_ds):
+    interval = _get_dag_interval(dag)
+    return {
+        'task_run_id': task_run_id,
+        'dag_id': dag.dag_id,
+        'task_id': task.task_id,
+        'task_type': task.task_type,
+        'task_args': task.params.get('task_args'),
+        'params': task.params,
+        'run_ds': run_ds,
+        'interval_start_ds': run_ds - interval,
+        'interval_end_ds': run_ds,
+    }
+
+
+class DagRunScheduler(object):
+    """
+    Creates a DagRun for every interval of a scheduled DAG along with a run of
+    each of its tasks and the dependencies between those runs. A task run is
+    queued once all its upstream task runs succeeded.
+
+    Readiness is tracked in memory with the number of upstream task runs each
+    scheduled task run still waits on. The counters are built when a DagRun is
+    created, or loaded from the DB when the scheduler becomes the leader, and
+    are decremented as task runs succeed, so the DAG's graph is not walked on
+    every tick.
+    """
+
+    def __init__(self, max_active_dag_runs=None):
+        if max_active_dag_runs is None:
+            max_active_dag_runs = int(configuration.get('core', 'max_active_dag_runs'))
+        self.max_active_dag_runs = max_active_dag_runs
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the in-memory state. It is loaded from the DB on the next tick
+        """
+        self._is_loaded = False
+        # dag_id to the run_ds of its latest DagRun
+        self._last_dag_runs = dict()
+        # Unfinished task run id to (dag_run_id, dag_id, dag_task_id, run_ds)
+        self._task_runs = dict()
+        # Scheduled task run id to the number of its upstream task runs that did not succeed yet
+        self._remaining_upstream = dict()
+        # Scheduled task runs with no remaining upstream task runs
+        self._ready_task_runs = list()
+        # Task run id to the ids of its downstream task runs
+        self._downstream_task_runs = defaultdict(list)
+        # Running DagRun id to its dag_id and to the ids of its unfinished task runs
+        self._dag_run_dag_ids = dict()
+        self._dag_run_task_runs = dict()
+        self._failed_dag_runs = set()
+
+    def _add_task_run(
+            self,
+            task_run_id,
+            dag_run_id,
+            dag_id,
+            dag_task_id,
+            run_ds,
+            remaining_upstream
+    ):
+        self._task_runs[task_run_id] = (dag_run_id, dag_id, dag_task_id, run_ds)
+        self._dag_run_task_runs[dag_run_id].add(task_run_id)
+        if remaining_upstream is not None:
+            self._remaining_upstream[task_run_id] = remaining_upstream
+            if remaining_upstream == 0:
+                self._ready_task_runs.append(task_run_id)
+
+    @provide_session
+    def _load_state(self, session=None):
+        """
+        Load the running DagRuns and the counters of their scheduled task runs from the DB
+        """
+        self.reset()
+        self._last_dag_runs = dict(
+            session
+            .query(DagRuns.dag_id, func.max(DagRuns.run_ds))
+            .group_by(DagRuns.dag_id)
+        )
+        running_dag_runs = (
+            session
+            .query(DagRuns.id, DagRuns.dag_id)
+            .filter(DagRuns.state == State.RUNNING)
+        )
+        for dag_run_id, dag_id in running_dag_runs:
+            self._dag_run_dag_ids[dag_run_id] = dag_id
+            self._dag_run_task_runs[dag_run_id] = set()
+        task_run_states = dict()
+        for dag_run_ids_chunk in chunked(sorted(self._dag_run_dag_ids), 1000):
+            task_runs = (
+                session
+                .query(
+                    TaskRuns.id,
+                    TaskRuns.dag_run_id,
+                    TaskRuns.dag_task_id,
+                    TaskRuns.run_ds,
+                    TaskRuns.state
+                )
+                .filter(TaskRuns.dag_run_id.in_(dag_run_ids_chunk))
+            )
+            for task_run_id, dag_run_id, dag_task_id, run_ds, state in task_runs:
+                task_run_states[task_run_id] = (dag_run_id, dag_task_id, run_ds, state)
+        remaining_upstream = Counter()
+        for task_run_ids_chunk in chunked(sorted(task_run_states), 1000):
+            dependencies = (
+                session
+                .query(TaskRunDependencies.task_run_id, TaskRunDependencies.upstream_task_id)
+                .filter(TaskRunDependencies.task_run_id.in_(task_run_ids_chunk))
+            )
+            for task_run_id, upstream_task_run_id in dependencies:
+                self._downstream_task_runs[upstream_task_run_id].append(task_run_id)
+                if task_run_states[upstream_task_run_id][3] != State.SUCCESS:
+                    remaining_upstream[task_run_id] += 1
+        for task_run_id, task_run_state in sorted(task_run_states.items()):
+            dag_run_id, dag_task_id, run_ds, state = task_run_state
+            if state == State.FAILED or state == State.UPSTREAM_FAILED:
+                self._failed_dag_runs.add(dag_run_id)
+            if state in (State.SCHEDULED, State.QUEUED, State.RUNNING, State.UP_FOR_RETRY):
+                self._add_task_run(
+                    task_run_id,
+                    dag_run_id,
+                    self._dag_run_dag_ids[dag_run_id],
+                    dag_task_id,
+                    run_ds,
+                    remaining_upstream[task_run_id] if state == State.SCHEDULED else None
+                )
+        self._is_loaded = True
+        logger.debug(
+            'Loaded {} running DAG runs with {} unfinished task runs'
+            .format(len(self._dag_run_dag_ids), len(self._task_runs))
+        )
+
+    def get_due_run_ds(self, dag, current_datetime, active_dag_run_count):
+        """
+        Get the run_ds of the intervals of a DAG that are due and have no DagRun
+        yet, as many as fit in its free DagRun slots. The first interval of a
+        DAG ends one interval after its start_date.
+        """
+        if not dag.is_scheduled or dag.start_date is None or not dag.interval:
+            return []
+        interval = _get_dag_interval(dag)
+        last_run_ds = self._last_dag_runs.get(dag.dag_id)
+        run_ds = last_run_ds + interval if last_run_ds else dag.start_date + interval
+        due_run_ds = list()
+        while (
+            run_ds <= current_datetime
+            and active_dag_run_count + len(due_run_ds) < self.max_active_dag_runs
+        ):
+            due_run_ds.append(run_ds)
+            run_ds += interval
+        return due_run_ds
+
+    @provide_session
+    def _create_dag_runs(
+            self,
+            dags,
+            current_datetime,
+            lease_holder=None,
+            lease_seconds=None,
+            session=None
+    ):
+        """
+        Insert the due DagRuns of dags with their task runs and the dependencies
+        between them. Each table is written with a single executemany and ids
+        are read back in the same transaction.
+
+        :return: Number of DagRuns created. None if the scheduler lease was lost
+        :rtype: int
+        """
+        active_dag_run_counts = Counter(self._dag_run_dag_ids.values())
+        new_dag_runs = [
+            (dag, run_ds)
+            for dag in dags
+            for run_ds in self.get_due_run_ds(
+                dag,
+                current_datetime,
+                active_dag_run_counts[dag.dag_id]
+            )
+        ]
+        if not new_dag_runs:
+            return 0
+        if lease_holder and not SchedulerLeases.renew(lease_holder, lease_seconds, session=session):
+            session.rollback()
+            return None
+        session.execute(
+            DagRuns.__table__.insert(),
+            [
+                {'dag_id': dag.dag_id, 'run_ds': run_ds, 'state': State.RUNNING}
+                for dag, run_ds in new_dag_runs
+            ]
+        )
+        dag_run_ids = dict()
+        for dag_runs_chunk in chunked(new_dag_runs, 1000):
+            inserted_dag_runs = (
+                session
+                .query(DagRuns.id, DagRuns.dag_id, DagRuns.run_ds)
+                .filter(DagRuns.dag_id.in_(set(dag.dag_id for dag, _ in dag_runs_chunk)))
+                .filter(DagRuns.run_ds.in_(set(run_ds for _, run_ds in dag_runs_chunk)))
+            )
+            for dag_run_id, dag_id, run_ds in inserted_dag_runs:
+                dag_run_ids[(dag_id, run_ds)] = dag_run_id
+        retry_values = _get_retry_values(
+            dag.get_task(task_id).task_type
+            for dag, _ in new_dag_runs
+            for task_id in dag.get_task_ids()
+        )
+        session.execute(
+            TaskRuns.__table__.insert(),
+            [
+                dict(
+                    {
+                        'dag_id': dag.dag_id,
+                        'dag_run_id': dag_run_ids[(dag.dag_id, run_ds)],
+                        'dag_task_id': task_id,
+                        'state': State.SCHEDULED,
+                        'run_ds': run_ds,
+                    },
+                    **retry_values[dag.get_task(task_id).task_type]
+                )
+                for dag, run_ds in new_dag_runs
+                for task_id in dag.get_task_ids()
+            ]
+        )
+        task_run_ids = dict()
+        for dag_run_ids_chunk in chunked(sorted(dag_run_ids.values()), 1000):
+            inserted_task_runs = (
+                session
+                .query(TaskRuns.id, TaskRuns.dag_run_id, TaskRuns.dag_task_id)
+                .filter(TaskRuns.dag_run_id.in_(dag_run_ids_chunk))
+            )
+            for task_run_id, dag_run_id, dag_task_id in inserted_task_runs:
+                task_run_ids[(dag_run_id, dag_task_id)] = task_run_id
+        dependencies = list()
+        for dag, run_ds in new_dag_runs:
+            dag_run_id = dag_run_ids[(dag.dag_id, run_ds)]
+            for task_id in dag.get_task_ids():
+                for upstream_task in dag.get_direct_upstream_tasks(task_id):
+                    dependencies.append({
+                        'task_run_id': task_run_ids[(dag_run_id, task_id)],
+                        'upstream_task_id': task_run_ids[(dag_run_id, upstream_task.task_id)],
+                    })
+        if dependencies:
+            session.execute(TaskRunDependencies.__table__.insert(), dependencies)
+        session.commit()
+
+        for dag, run_ds in new_dag_runs:
+            dag_run_id = dag_run_ids[(dag.dag_id, run_ds)]
+            self._dag_run_dag_ids[dag_run_id] = dag.dag_id
+            self._dag_run_task_runs[dag_run_id] = set()
+            for task_id in dag.get_task_ids():
+                task_run_id = task_run_ids[(dag_run_id, task_id)]
+                upstream_tasks = dag.get_direct_upstream_tasks(task_id)
+                for upstream_task in upstream_tasks:
+                    upstream_task_run_id = task_run_ids[(dag_run_id, upstream_task.task_id)]
+                    self._downstream_task_runs[upstream_task_run_id].append(task_run_id)
+                self._add_task_run(
+                    task_run_id,
+                    dag_run_id,
+                    dag.dag_id,
+                    task_id,
+                    run_ds,
+                    len(upstream_tasks)
+                )
+            self._last_dag_runs[dag.dag_id] = max(
+                run_ds,
+                self._last_dag_runs.get(dag.dag_id, run_ds)
+            )
+            logger.debug('Created run of DAG {} for {}'.format(dag.dag_id, run_ds))
+        logger.info(
+            'Created {} DAG runs with {} task runs'
+            .format(len(new_dag_runs), len(task_run_ids))
+        )
+        return len(new_dag_runs)
+
+    def _skip_downstream_task_runs(self, task_run_id):
+        """
+        Remove the scheduled task runs downstream of a failed task run
+
+        :return: Ids of the removed task runs
+        :rtype: list
+        """
+        skipped_task_run_ids = list()
+        pending_task_run_ids = list(self._downstream_task_runs.pop(task_run_id, []))
+        while pending_task_run_ids:
+            downstream_task_run_id = pending_task_run_ids.pop()
+            if self._remaining_upstream.pop(downstream_task_run_id, None) is None:
+                continue
+            dag_run_id = self._task_runs.pop(downstream_task_run_id)[0]
+            self._dag_run_task_runs[dag_run_id].discard(downstream_task_run_id)
+            skipped_task_run_ids.append(downstream_task_run_id)
+            pending_task_run_ids.extend(self._downstream_task_runs.pop(downstream_task_run_id, []))
+        return skipped_task_run_ids
+
+    def task_run_finished(self, task_run_id, state):
+        """
+        Update the counters of the downstream task runs of a finished task run.
+        Downstream task runs of a failed task run will not run
+
+        :return: Ids of the task runs marked as upstream_failed
+        :rtype: list
+        """
+        task_run = self._task_runs.pop(task_run_id, None)
+        if task_run is None:
+            return []
+        dag_run_id = task_run[0]
+        self._dag_run_task_runs[dag_run_id].discard(task_run_id)
+        if state != State.SUCCESS:
+            self._failed_dag_runs.add(dag_run_id)
+            return self._skip_downstream_task_runs(task_run_id)
+        for downstream_task_run_id in self._downstream_task_runs.pop(task_run_id, []):
+            if downstream_task_run_id not in self._remaining_upstream:
+                continue
+            self._remaining_upstream[downstream_task_run_id] -= 1
+            if self._remaining_upstream[downstream_task_run_id] == 0:
+                self._ready_task_runs.append(downstream_task_run_id)
+        return []
+
+    @provide_session
+    def _update_finished_task_runs(self, session=None):
+        """
+        Apply the task runs that finished since the last tick to the counters
+        """
+        active_task_run_ids = sorted(
+            task_run_id
+            for task_run_id in self._task_runs
+            if task_run_id not in self._remaining_upstream
+        )
+        finished_task_runs = list()
+        for task_run_ids_chunk in chunked(active_task_run_ids, 1000):
+            finished_task_runs.extend(
+                session
+                .query(TaskRuns.id, TaskRuns.state)
+                .filter(TaskRuns.id.in_(task_run_ids_chunk))
+                .filter(TaskRuns.state.in_([State.SUCCESS, State.FAILED]))
+            )
+        upstream_failed_task_run_ids = list()
+        for task_run_id, state in finished_task_runs:
+            upstream_failed_task_run_ids.extend(self.task_run_finished(task_run_id, state))
+        self._set_task_runs_state(
+            upstream_failed_task_run_ids,
+            State.UPSTREAM_FAILED,
+            session=session
+        )
+        session.commit()
+
+    @staticmethod
+    @provide_session
+    def _set_task_runs_state(task_run_ids, state, from_state=None, session=None):
+        """
+        Set the state of task runs within the caller's transaction. With
+        from_state only the task runs still in from_state are updated, which
+        are locked until the transaction ends
+
+        :return: Ids of the updated task runs
+        :rtype: list
+        """
+        updated_task_run_ids = list()
+        for task_run_ids_chunk in chunked(sorted(task_run_ids), 1000):
+            if from_state is not None:
+                task_run_ids_chunk = [
+                    task_run_id
+                    for task_run_id, in (
+                        session
+                        .query(TaskRuns.id)
+                        .filter(TaskRuns.id.in_(task_run_ids_chunk))
+                        .filter(TaskRuns.state == from_state)
+                        .with_for_update()
+                    )
+                ]
+                if not task_run_ids_chunk:
+                    continue
+            query = session.query(TaskRuns).filter(TaskRuns.id.in_(task_run_ids_chunk))
+            if from_state is not None:
+                query = query.filter(TaskRuns.state == from_state)
+            query.update({TaskRuns.state: state}, synchronize_session=False)
+            updated_task_run_ids.extend(task_run_ids_chunk)
+        return updated_task_run_ids
+
+    @provide_session
+    def _queue_ready_task_runs(
+            self,
+            dags_by_id,
+            executor,
+            lease_holder=None,
+            lease_seconds=None,
+            session=None
+    ):
+        """
+        Queue the task runs whose upstream task runs all succeeded. Only task
+        runs still scheduled are queued and the lease is renewed in the same
+        transaction, so a scheduler that lost the lease queues nothing
+
+        :return: Number of task runs queued. None if the scheduler lease was lost
+        :rtype: int
+        """
+        ready_task_run_ids = [
+            task_run_id
+            for task_run_id in self._ready_task_runs
+            if self._remaining_upstream.get(task_run_id) == 0
+        ]
+        self._ready_task_runs = list()
+        tasks_to_run = list()
+        missing_task_run_ids = list()
+        for task_run_id in ready_task_run_ids:
+            del self._remaining_upstream[task_run_id]
+            dag_run_id, dag_id, dag_task_id, run_ds = self._task_runs[task_run_id]
+            dag = dags_by_id.get(dag_id)
+            task = dag.get_task(dag_task_id) if dag else None
+            if task is None:
+                logger.warning(
+                    'Task {} of DAG {} no longer exists. Failing its run for {}'
+                    .format(dag_task_id, dag_id, run_ds)
+                )
+                missing_task_run_ids.append(task_run_id)
+                continue
+            tasks_to_run.append(_get_dag_task_run_params(dag, task, task_run_id, run_ds))
+        if not tasks_to_run and not missing_task_run_ids:
+            return 0
+        if lease_holder and not SchedulerLeases.renew(lease_holder, lease_seconds, session=session):
+            session.rollback()
+            return None
+        queued_task_run_ids = set(self._set_task_runs_state(
+            [params['task_run_id'] for params in tasks_to_run],
+            State.QUEUED,
+            from_state=State.SCHEDULED,
+            session=session
+        ))
+        self._set_task_runs_state(
+            missing_task_run_ids,
+            State.FAILED,
+            from_state=State.SCHEDULED,
+            session=session
+        )
+        session.commit()
+        # Runs queued by another scheduler are left to it. They are tracked until they finish
+        tasks_to_run = [
+            params
+            for params in tasks_to_run
+            if params['task_run_id'] in queued_task_run_ids
+        ]
+        upstream_failed_task_run_ids = list()
+        for task_run_id in missing_task_run_ids:
+            upstream_failed_task_run_ids.extend(self.task_run_finished(task_run_id, State.FAILED))
+        self._set_task_runs_state(
+            upstream_failed_task_run_ids,
+            State.UPSTREAM_FAILED,
+            session=session
+        )
+        session.commit()
+        if tasks_to_run:
+            executor.execute_async_batch(tasks_to_run)
+            logger.info('Queued {} DAG task runs'.format(len(tasks_to_run)))
+        return len(tasks_to_run)
+
+    @provide_session
+    def _update_finished_dag_runs(self, session=None):
+        finished_dag_run_states = {
+            dag_run_id: State.FAILED if dag_run_id in self._failed_dag_runs else State.SUCCESS
+            for dag_run_id, task_run_ids in self._dag_run_task_runs.items()
+            if not task_run_ids
+        }
+        for state in (State.SUCCESS, State.FAILED):
+            dag_run_ids = sorted(
+                dag_run_id
+                for dag_run_id, dag_run_state in finished_dag_run_states.items()
+                if dag_run_state == state
+            )
+            for dag_run_ids_chunk in chunked(dag_run_ids, 1000):
+                (
+                    session
+                    .query(DagRuns)
+                    .filter(DagRuns.id.in_(dag_run_ids_chunk))
+                    .update({DagRuns.state: state}, synchronize_session=False)
+                )
+        session.commit()
+        for dag_run_id, state in finished_dag_run_states.items():
+            logger.info(
+                'Run {} of DAG {} finished with {}'
+                .format(dag_run_id, self._dag_run_dag_ids[dag_run_id], state)
+            )
+            del self._dag_run_dag_ids[dag_run_id]
+            del self._dag_run_task_runs[dag_run_id]
+            self._failed_dag_runs.discard(dag_run_id)
+
+    def schedule(self, dags, executor, current_datetime, lease_holder=None, lease_seconds=None):
+        """
+        Create the due DagRuns of dags and queue the task runs that are ready.
+        Returns False if the scheduler lease was lost, in which case nothing is queued
+
+        :param dags: DAGs to schedule
+        :type dags: list
+        """
+        if not self._is_loaded:
+            self._load_state()
+        if self._create_dag_runs(
+            dags,
+            current_datetime,
+            lease_holder=lease_holder,
+            lease_seconds=lease_seconds
+        ) is None:
+            return False
+        self._update_finished_task_runs()
+        if self._queue_ready_task_runs(
+            {dag.dag_id: dag for dag in dags},
+            executor,
+            lease_holder=lease_holder,
+            lease_seconds=lease_seconds
+        ) is None:
+            return False
+        self._update_finished_dag_runs()
+        return True
+
+
+class ZombieReaper(object):
+    """
+    Finds running task runs whose worker died, using their heartbeats, and
+    queues them again until they were tried max_tries times. Runs that used up
+    their tries are failed. Runs up for retry whose next try is overdue, as the
+    executor holding them went away, are queued again as well.
+    """
+
+    def __init__(self, stale_seconds=None, max_tries=None):
+        heartbeat_seconds = int(configuration.get('core', 'heartbeat_seconds'))
+        if stale_seconds is None:
+            stale_seconds = heartbeat_seconds * int(configuration.get('core', 'zombie_heartbeats'))
+        self.stale_seconds = stale_seconds
+        # None uses the max_tries of the retry policy stored on each task run
+        self.max_tries = max_tries
+        # Heartbeats are not updated more often so neither is the query run
+        self.reap_seconds = heartbeat_seconds
+        self._last_reaped_at = None
+
+    def _get_max_tries(self, task_run, task_run_params):
+        if self.max_tries is not None:
+            return self.max_tries
+        return RetryPolicy.for_task_run(task_run, task_run_params['task_type']).max_tries
+
+    @staticmethod
+    def _update_task_run(task_run_id, state, try_number, values, session):
+        """
+        Update a task run if it is still in state and try_number
+
+        :return: True if the task run was updated
+        :rtype: bool
+        """
+        updated_task_runs = (
+            session
+            .query(TaskRuns)
+            .filter(TaskRuns.id == task_run_id)
+            .filter(TaskRuns.state == state)
+            .filter(TaskRuns.try_number == try_number)
+            .update(values, synchronize_session=False)
+        )
+        return updated_task_runs == 1
+
+    @staticmethod
+    def _get_task_run_params(task_run, try_number, tasks_by_id, serialized_dag_bag):
+        """
+        :return: Params to queue task_run with. None if its task no longer exists
+        :rtype: dict
+        """
+        if task_run.dag_id:
+            dag = serialized_dag_bag.get_dag(task_run.dag_id)
+            task = dag.get_task(task_run.dag_task_id) if dag else None
+            if task is None:
+                return None
+            task_run_params = _get_dag_task_run_params(dag, task, task_run.id, task_run.run_ds)
+        else:
+            task = tasks_by_id.get(task_run.task_id)
+            if task is None:
+                return None
+            task_run_params = _get_task_run_params(task, task_run.run_ds)
+            task_run_params['task_run_id'] = task_run.id
+        task_run_params['try_number'] = try_number
+        return task_run_params
+
+    @provide_session
+    def reap(
+            self,
+            executor,
+            tasks,
+            serialized_dag_bag,
+            lease_holder=None,
+            lease_seconds=None,
+            session=None
+    ):
+        """
+        Queue again or fail the running task runs that stopped sending heartbeats
+        and the runs up for retry that are overdue
+
+        :param tasks: Tasks scheduled on their own
+        :type tasks: list
+        :param serialized_dag_bag: DAGs of the runs of DAG tasks
+        :type serialized_dag_bag: propel.models.SerializedDagBag
+        :param lease_holder: If given task runs are only updated if lease_holder
+            still holds the scheduler lease, which is renewed in the same transaction
+        :type lease_holder: str
+        :param lease_seconds: Seconds the renewed lease is held
+        :type lease_seconds: int
+        :return: Number of task runs queued again. None if the lease was lost
+        :rtype: int
+        """
+        if (
+            self._last_reaped_at is not None
+            and time.time() - self._last_reaped_at < self.reap_seconds
+        ):
+            return 0
+        self._last_reaped_at = time.time()
+        stale_task_run_ids = Heartbeats.get_stale_task_run_ids(self.stale_seconds, session=session)
+        overdue_before = datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+        overdue_task_run_ids = [
+            task_run_id
+            for task_run_id, in (
+                session
+                .query(TaskRuns.id)
+                .filter(TaskRuns.state == State.UP_FOR_RETRY)
+                .filter(TaskRuns.next_try_at < overdue_before)
+            )
+        ]
+        if not stale_task_run_ids and not overdue_task_run_ids:
+            return 0
+        tasks_by_id = {task.id: task for task in tasks}
+        # (params of the next try, state and try_number found in) of the runs to queue
+        tasks_to_run = list()
+        failed_task_runs = list()
+        for task_run_ids_chunk in chunked(stale_task_run_ids + overdue_task_run_ids, 1000):
+            for task_run in session.query(TaskRuns).filter(TaskRuns.id.in_(task_run_ids_chunk)):
+                # Try of a run up for retry was counted when it failed
+                try_number = task_run.try_number
+                if task_run.state == State.RUNNING:
+                    try_number += 1
+                task_run_params = self._get_task_run_params(
+                    task_run,
+                    try_number,
+                    tasks_by_id,
+                    serialized_dag_bag
+                )
+                if (
+                    task_run_params is None
+                    or try_number > self._get_max_tries(task_run, task_run_params)
+                ):
+                    failed_task_runs.append((task_run.id, task_run.state, task_run.try_number))
+                else:
+                    tasks_to_run.append((task_run_params, task_run.state, task_run.try_number))
+        if lease_holder and not SchedulerLeases.renew(lease_holder, lease_seconds, session=session):
+            session.rollback()
+            return None
+        # Each run is only updated if it is still in the state and try it was found
+        # in, in case its worker came back or it was queued again in the meantime.
+        # Only the runs this reaper updated are queued
+        requeued_tasks_to_run = [
+            params
+            for params, found_state, found_try_number in tasks_to_run
+            if self._update_task_run(
+                params['task_run_id'],
+                found_state,
+                found_try_number,
+                {TaskRuns.state: State.QUEUED, TaskRuns.try_number: params['try_number']},
+                session=session
+            )
+        ]
+        failed_task_run_count = sum(
+            self._update_task_run(
+                task_run_id,
+                found_state,
+                found_try_number,
+                {TaskRuns.state: State.FAILED},
+                session=session
+            )
+            for task_run_id, found_state, found_try_number in failed_task_runs
+        )
+        session.commit()
+        if requeued_tasks_to_run:
+            executor.execute_async_batch(requeued_tasks_to_run)
+        logger.warning(
+            'Found {} task runs without heartbeats and {} overdue retries. '
+            'Queued {} again and failed {}'
+            .format(
+                len(stale_task_run_ids),
+                len(overdue_task_run_ids),
+                len(requeued_tasks_to_run),
+                failed_task_run_count
+            )
+        )
+        return len(requeued_tasks_to_run)
+
+
 class Scheduler(HeartbeatMixin):
 
     @staticmethod
@@ -18,101 +926,351 @@ class Scheduler(HeartbeatMixin):
     def _get_tasks(session=None):
         return session.query(Tasks).all()
 
+    def __init__(self):
+        # Latest run_ds of each task. Kept up to date as runs are inserted and
+        # reconciled with the DB every scheduler_reconcile_seconds
+        self._last_task_runs = None
+        self._last_reconciled_at = None
+        # Min-heap of (earliest run_ds, task id) so a tick only looks at due tasks.
+        # Rebuilt when the tasks or the reconciled last runs are replaced
+        self._next_runs = list()
+        self._next_runs_sources = (None, None)
+        self._tasks_by_id = dict()
+        self._backfill_planner = BackfillPlanner()
+        # DAGs as stored by the DagBag. The scheduler never imports DAG files itself
+        self._serialized_dag_bag = SerializedDagBag()
+        self._dag_run_scheduler = DagRunScheduler()
+        self._zombie_reaper = ZombieReaper()
+
+    @staticmethod
     @provide_session
-    def _get_last_task_runs(self, session=None):
-        last_task_runs = (
-            session.query(
-                TaskRuns.task_id.label('task_id'),
-                func.max(TaskRuns.run_ds).label('max_run_ds')
-            ).group_by(TaskRuns.task_id)
+    def _query_last_task_runs(session=None):
+        """
+        Get the latest run_ds of every task. The max is computed per task with a
+        correlated subquery so each lookup is a seek on the (task_id, run_ds) index
+        rather than a GROUP BY over the whole task_runs table.
+        """
+        max_run_ds = (
+            select([func.max(TaskRuns.run_ds)])
+            .where(TaskRuns.task_id == Tasks.id)
+            .as_scalar()
         )
         return {
-            last_task_run.task_id: last_task_run.max_run_ds
-            for last_task_run in last_task_runs
+            task_id: last_run_ds
+            for task_id, last_run_ds in session.query(Tasks.id, max_run_ds)
+            if last_run_ds is not None
         }
 
+    def _get_last_task_runs(self):
+        reconcile_seconds = int(configuration.get('core', 'scheduler_reconcile_seconds'))
+        if (
+            self._last_task_runs is None
+            or time.time() - self._last_reconciled_at >= reconcile_seconds
+        ):
+            logger.debug('Reconciling last task runs with the DB')
+            self._last_task_runs = self._query_last_task_runs()
+            self._last_reconciled_at = time.time()
+        return self._last_task_runs
+
+    def _set_last_task_run(self, task_id, run_ds):
+        if self._last_task_runs is None:
+            return
+        self._last_task_runs[task_id] = max(run_ds, self._last_task_runs.get(task_id, run_ds))
+
+    @staticmethod
+    def _get_next_run_ds(task, task_last_run_ds, current_datetime):
+        is_first_time_run = False if task_last_run_ds else True
+        if is_first_time_run:
+            # If task is running for first time, run it for the
+            # nearest minute before current_datetime
+            next_run_ds = (
+                    current_datetime -
+                    timedelta(
+                        seconds=current_datetime.second,
+                        microseconds=current_datetime.microsecond
+                    )
+            )
+            logger.debug(
+                "Task {} never ran. Will schedule it for {}"
+                .format(task.task_name, next_run_ds)
+            )
+        else:
+            next_run_ds = task_last_run_ds + timedelta(seconds=task.run_frequency_seconds)
+            # If schedule_latest then skip intermediate runs. This is useful when
+            # the scheduler is down for long periods of time. In that case this
+            # setting will make the scheduler schedule only the latest run instead
+            # of catching up
+            if task.schedule_latest:
+                catchup_seconds = int(
+                    (current_datetime - task_last_run_ds).total_seconds() /
+                    task.run_frequency_seconds
+                ) * task.run_frequency_seconds
+                latest_possible_run = task_last_run_ds + timedelta(seconds=catchup_seconds)
+                next_run_ds = max(next_run_ds, latest_possible_run)
+        return next_run_ds
+
+    def _build_next_runs(self, tasks, last_task_runs, current_datetime):
+        self._tasks_by_id = {task.id: task for task in tasks}
+        self._next_runs = list()
+        for task in tasks:
+            task_last_run_ds = last_task_runs.get(task.id)
+            if task_last_run_ds:
+                earliest_run_ds = task_last_run_ds + timedelta(seconds=task.run_frequency_seconds)
+            else:
+                earliest_run_ds = current_datetime
+            self._next_runs.append((earliest_run_ds, task.id))
+        heapq.heapify(self._next_runs)
+        self._next_runs_sources = (tasks, last_task_runs)
+
     def _get_eligible_tasks_to_run(self, current_datetime):
         eligible_tasks_to_run = []
         tasks = self._get_tasks()
         last_task_runs = self._get_last_task_runs()
-        for task in tasks:
+        next_runs_tasks, next_runs_last_task_runs = self._next_runs_sources
+        if next_runs_tasks is not tasks or next_runs_last_task_runs is not last_task_runs:
+            logger.debug('Rebuilding next runs of {} tasks'.format(len(tasks)))
+            self._build_next_runs(tasks, last_task_runs, current_datetime)
+        due_tasks = list()
+        while self._next_runs and self._next_runs[0][0] <= current_datetime:
+            _, task_id = heapq.heappop(self._next_runs)
+            due_tasks.append(self._tasks_by_id[task_id])
+        # Tasks without schedule_latest queue all their missed intervals at once
+        # as long as they have free run slots
+        catchup_task_ids = set(
+            task.id
+            for task in due_tasks
+            if not task.schedule_latest and last_task_runs.get(task.id)
+        )
+        active_run_counts = (
+            self._backfill_planner.get_active_run_counts(list(catchup_task_ids))
+            if catchup_task_ids else dict()
+        )
+        for task in due_tasks:
             task_last_run_ds = last_task_runs.get(task.id)
-            task_run_params = task.as_dict()
-            is_first_time_run = False if task_last_run_ds else True
-            if is_first_time_run:
-                # If task is running for first time, run it for the
-                # nearest minute before current_datetime
-                next_run_ds = (
-                        current_datetime -
-                        timedelta(
-                            seconds=current_datetime.second,
-                            microseconds=current_datetime.microsecond
-                        )
-                )
-                logger.debug(
-                    "Task {} never ran. Will schedule it for {}"
-                    .format(task.task_name, next_run_ds)
+            if task.id in catchup_task_ids:
+                run_ds_list = self._backfill_planner.get_missed_run_ds(
+                    task,
+                    task_last_run_ds,
+                    current_datetime,
+                    active_run_counts.get(task.id, 0)
                 )
             else:
-                next_run_ds = task_last_run_ds + timedelta(seconds=task.run_frequency_seconds)
-                # If schedule_latest then skip intermediate runs. This is useful when
-                # the scheduler is down for long periods of time. In that case this
-                # setting will make the scheduler schedule only the latest run instead
-                # of catching up
-                if task.schedule_latest:
-                    catchup_seconds = int(
-                        (current_datetime - task_last_run_ds).total_seconds() /
-                        task.run_frequency_seconds
-                    ) * task.run_frequency_seconds
-                    latest_possible_run = task_last_run_ds + timedelta(seconds=catchup_seconds)
-                    next_run_ds = max(next_run_ds, latest_possible_run)
-            if next_run_ds <= current_datetime:
+                run_ds_list = [self._get_next_run_ds(task, task_last_run_ds, current_datetime)]
+            for run_ds in run_ds_list:
                 logger.debug(
-                    "Scheduling Task {} for {}".format(task.task_name, next_run_ds)
+                    "Scheduling Task {} for {}".format(task.task_name, run_ds)
                 )
-                task_run_params['run_ds'] = next_run_ds
-                task_run_params['interval_start_ds'] = (
-                        next_run_ds
-                        - timedelta(seconds=task.run_frequency_seconds)
-                )
-                task_run_params['interval_end_ds'] = next_run_ds
-                eligible_tasks_to_run.append(task_run_params)
+                eligible_tasks_to_run.append(_get_task_run_params(task, run_ds))
+            if run_ds_list:
+                next_run_ds = run_ds_list[-1] + timedelta(seconds=task.run_frequency_seconds)
             else:
                 logger.debug(
-                    "Task {} still not eligible to run for {}".format(task.task_name, next_run_ds)
+                    "Task {} has {} active runs. Waiting for runs to finish"
+                    .format(task.task_name, active_run_counts.get(task.id))
+                )
+                next_run_ds = (
+                    current_datetime
+                    + timedelta(seconds=self._backfill_planner.retry_seconds)
                 )
+            heapq.heappush(self._next_runs, (next_run_ds, task.id))
         return eligible_tasks_to_run
 
+    def _get_sleep_seconds(self, current_datetime, max_sleep_seconds):
+        """
+        Seconds until the earliest task is due, capped at max_sleep_seconds so
+        new tasks and reconciled runs are picked up
+        """
+        if not self._next_runs:
+            return max_sleep_seconds
+        seconds_until_due = (self._next_runs[0][0] - current_datetime).total_seconds()
+        return min(max(seconds_until_due, 0), max_sleep_seconds)
+
+    @staticmethod
     @provide_session
-    def _insert_new_task_run_to_db(self, session=None, **kwargs):
-        task_run = TaskRuns(**kwargs)
-        session.add(task_run)
+    def _insert_new_task_runs_to_db(
+            tasks_to_run,
+            lease_holder=None,
+            lease_seconds=None,
+            session=None
+    ):
+        """
+        Insert queued runs of the given tasks with a single executemany and
+        return their ids. Ids are read back by (task_id, run_ds) in the same
+        transaction as the insert.
+
+        :param tasks_to_run: Task run params with id and run_ds of each task
+        :type tasks_to_run: list
+        :param lease_holder: If given the runs are only inserted if lease_holder
+            still holds the scheduler lease, which is renewed in the same transaction
+        :type lease_holder: str
+        :param lease_seconds: Seconds the renewed lease is held
+        :type lease_seconds: int
+        :return: Task run id of each task run params. None if the lease was lost
+        :rtype: list
+        """
+        if not tasks_to_run:
+            return []
+        if lease_holder and not SchedulerLeases.renew(lease_holder, lease_seconds, session=session):
+            session.rollback()
+            return None
+        retry_values = _get_retry_values(
+            task_run_params['task_type'] for task_run_params in tasks_to_run
+        )
+        session.execute(
+            TaskRuns.__table__.insert(),
+            [
+                dict(
+                    {
+                        'task_id': task_run_params['id'],
+                        'state': State.QUEUED,
+                        'run_ds': task_run_params['run_ds'],
+                    },
+                    **retry_values[task_run_params['task_type']]
+                )
+                for task_run_params in tasks_to_run
+            ]
+        )
+        task_run_ids = dict()
+        for tasks_chunk in chunked(tasks_to_run, 1000):
+            inserted_task_runs = (
+                session
+                .query(TaskRuns.id, TaskRuns.task_id, TaskRuns.run_ds)
+                .filter(TaskRuns.task_id.in_(set(task['id'] for task in tasks_chunk)))
+                .filter(TaskRuns.run_ds.in_(set(task['run_ds'] for task in tasks_chunk)))
+            )
+            for task_run_id, task_id, run_ds in inserted_task_runs:
+                task_run_ids[(task_id, run_ds)] = task_run_id
         session.commit()
-        return task_run.id
+        return [
+            task_run_ids[(task_run_params['id'], task_run_params['run_ds'])]
+            for task_run_params in tasks_to_run
+        ]
 
-    def _schedule_tasks(self):
-        scheduler_sleep_seconds = int(configuration.get('core', 'scheduler_sleep_seconds'))
-        executor = Executor()
-        while True:
-            current_datetime = datetime.utcnow()
-            # Parse DAGs
+    def _schedule_due_tasks(
+            self,
+            executor,
+            current_datetime,
+            lease_holder=None,
+            lease_seconds=None
+    ):
+        """
+        Queue the runs of tasks that are due. Returns False if the scheduler
+        lease was lost, in which case nothing is queued
+        """
+        tasks_to_run = self._get_eligible_tasks_to_run(current_datetime)
+        if not tasks_to_run:
+            return True
+        try:
+            task_run_ids = self._insert_new_task_runs_to_db(
+                tasks_to_run,
+                lease_holder=lease_holder,
+                lease_seconds=lease_seconds
+            )
+        except IntegrityError as e:
+            # Runs were created by another scheduler or a backfill. State is
+            # reconciled with the DB before scheduling again
+            logger.warning('Task runs already exist: {}'.format(e))
+            self._reset_state()
+            return True
+        if task_run_ids is None:
+            return False
+        for task_run_params, task_run_id in zip(tasks_to_run, task_run_ids):
+            task_run_params['task_run_id'] = task_run_id
+            self._set_last_task_run(task_run_params['id'], task_run_params['run_ds'])
+        executor.execute_async_batch(tasks_to_run)
+        return True
 
+    def _reset_state(self):
+        # Another scheduler may have created runs while this one was on standby
+        self._last_task_runs = None
+        self._next_runs = list()
+        self._next_runs_sources = (None, None)
+        self._dag_run_scheduler.reset()
 
+    def _schedule_dags(self, executor, current_datetime, lease_holder=None, lease_seconds=None):
+        """
+        Create the due runs of scheduled DAGs and queue their ready task runs.
+        Returns False if the scheduler lease was lost
+        """
+        dags = [
+            self._serialized_dag_bag.get_dag(dag_id)
+            for dag_id in self._serialized_dag_bag.dag_ids
+        ]
+        try:
+            return self._dag_run_scheduler.schedule(
+                dags,
+                executor,
+                current_datetime,
+                lease_holder=lease_holder,
+                lease_seconds=lease_seconds
+            )
+        except IntegrityError as e:
+            # DAG runs were created by another scheduler. State is reloaded from the DB
+            logger.warning('DAG runs already exist: {}'.format(e))
+            self._dag_run_scheduler.reset()
+            return True
 
-            tasks_to_run = self._get_eligible_tasks_to_run(current_datetime)
-            for task_run_params in tasks_to_run:
-                task_run_id = self._insert_new_task_run_to_db(
-                    task_id=task_run_params['id'],
-                    state=State.QUEUED,
-                    run_ds=task_run_params['run_ds']
+    def _schedule_tasks(self):
+        scheduler_sleep_seconds = int(configuration.get('core', 'scheduler_sleep_seconds'))
+        lease_seconds = int(configuration.get('core', 'scheduler_lease_seconds'))
+        # Renewing the lease a few times within its duration
+        max_sleep_seconds = min(scheduler_sleep_seconds, lease_seconds / 3)
+        lease_holder = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        executor = Executor()
+        task_run_events = executor.get_task_run_events()
+        dag_bag = DagBag()
+        is_leader = False
+        try:
+            while True:
+                current_datetime = datetime.utcnow()
+                if SchedulerLeases.acquire(lease_holder, lease_seconds):
+                    if not is_leader:
+                        logger.info('Scheduler {} is the leader'.format(lease_holder))
+                        self._reset_state()
+                        is_leader = True
+                    # Parse changed DAG files in child processes and store their serialized DAGs
+                    dag_bag.parse_dags()
+                    dag_bag.sync_to_db()
+                    self._serialized_dag_bag.refresh()
+                    is_leader = self._schedule_due_tasks(
+                        executor,
+                        current_datetime,
+                        lease_holder=lease_holder,
+                        lease_seconds=lease_seconds
+                    ) and self._schedule_dags(
+                        executor,
+                        current_datetime,
+                        lease_holder=lease_holder,
+                        lease_seconds=lease_seconds
+                    )
+                    if is_leader:
+                        is_leader = self._zombie_reaper.reap(
+                            executor,
+                            self._get_tasks(),
+                            self._serialized_dag_bag,
+                            lease_holder=lease_holder,
+                            lease_seconds=lease_seconds
+                        ) is not None
+                elif is_leader:
+                    is_leader = False
+                if not is_leader:
+                    logger.debug('Scheduler {} is on standby'.format(lease_holder))
+                    time.sleep(max_sleep_seconds)
+                    continue
+                sleep_seconds = self._get_sleep_seconds(datetime.utcnow(), max_sleep_seconds)
+                logger.debug(
+                    'Sleeping for {} seconds or until a task run finishes before scheduling again'
+                    .format(sleep_seconds)
                 )
-                task_run_params['task_run_id'] = task_run_id
-                executor.execute_async(task_run_params)
-            logger.debug(
-                'Sleeping for {} seconds before trying to schedule again'
-                .format(scheduler_sleep_seconds)
-            )
-            time.sleep(scheduler_sleep_seconds)
+                # Downstream task runs of a finished task run are queued right away
+                finished_task_runs = task_run_events.wait(sleep_seconds)
+                if finished_task_runs:
+                    logger.debug(
+                        'Woken up by {} finished task runs'.format(len(finished_task_runs))
+                    )
+        finally:
+            SchedulerLeases.release(lease_holder)
+            executor.end()
 
     def run(self):
         self.heartbeat(thread_function=self._schedule_tasks)
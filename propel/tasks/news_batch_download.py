@@ -0,0 +1,149 @@
+import json
+import threading
+from collections import Counter, OrderedDict, deque
+from six.moves import queue
+from six.moves.urllib.parse import urlparse
+
+from propel import configuration
+from propel.exceptions import PropelException
+from propel.models import News, FeedValidators
+from propel.settings import logger
+from propel.tasks.news_download import NewsDownload
+
+
+class NewsBatchDownload(NewsDownload):
+    """
+    Class that downloads many RSS News Feeds concurrently in a single task run
+    and stores their news through one batched writer
+    """
+
+    def _download_feeds(self, rss_urls, validators_by_url):
+        """
+        Download feeds in a bounded set of threads and yield (rss_url, rss_response, exception)
+        in the order downloads finish, so a slow feed does not hold back the others.
+        rss_response is None when the feed is not modified since the last download.
+        Feeds are handed out per host, so a thread only picks up a feed of a host that
+        has a free connection and never waits behind the slow feeds of another host.
+        """
+        max_concurrent_feeds = int(configuration.get('news', 'max_concurrent_feeds'))
+        max_connections_per_host = int(configuration.get('news', 'max_connections_per_host'))
+        pending_urls_by_host = OrderedDict()
+        for rss_url in rss_urls:
+            pending_urls_by_host.setdefault(urlparse(rss_url).netloc, deque()).append(rss_url)
+        connections_by_host = Counter()
+        condition = threading.Condition()
+        results = queue.Queue()
+
+        def next_feed():
+            # Returns (host, rss_url) of a feed that can start now, waiting for a
+            # connection to free up if needed. Returns None once no feeds are pending
+            with condition:
+                while pending_urls_by_host:
+                    for host, pending_urls in pending_urls_by_host.items():
+                        if connections_by_host[host] < max_connections_per_host:
+                            rss_url = pending_urls.popleft()
+                            if pending_urls:
+                                # Round robin so the next thread starts with another host
+                                pending_urls_by_host[host] = pending_urls_by_host.pop(host)
+                            else:
+                                del pending_urls_by_host[host]
+                            connections_by_host[host] += 1
+                            return host, rss_url
+                    condition.wait()
+                return None
+
+        def download_feeds():
+            while True:
+                feed = next_feed()
+                if feed is None:
+                    return
+                host, rss_url = feed
+                etag, modified = validators_by_url.get(rss_url, (None, None))
+                try:
+                    rss_response = self._download_feed(rss_url, etag=etag, modified=modified)
+                    result = rss_url, rss_response, None
+                except Exception as e:
+                    result = rss_url, None, e
+                finally:
+                    with condition:
+                        connections_by_host[host] -= 1
+                        condition.notify_all()
+                results.put(result)
+
+        threads = [
+            threading.Thread(target=download_feeds)
+            for _ in range(min(max_concurrent_feeds, len(rss_urls)))
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for _ in range(len(rss_urls)):
+                yield results.get()
+        finally:
+            for thread in threads:
+                thread.join()
+
+    def execute(self, task):
+        """
+        Download news from a list of RSS feeds. Feeds that fail are reported once
+        all other feeds are stored
+
+        :param task: An dict that contains details about the task to run
+        :type task: dict
+        """
+        rss_urls = list(set(json.loads(task['task_args'])['rss_urls']))
+        if not rss_urls:
+            return
+        write_batch_size = int(configuration.get('news', 'write_batch_size'))
+        validators_by_url = FeedValidators.get_validators_by_url(rss_urls)
+        # News of downloaded feeds waiting to be written along with validators of those feeds
+        pending_news_dicts = list()
+        pending_validators_by_url = dict()
+        feed_results = dict()
+
+        def write_pending_news():
+            try:
+                News.upsert_into_db(pending_news_dicts)
+                # Validators are stored once the feed is loaded so a failed
+                # load downloads the feed again on the next run
+                FeedValidators.set_validators_by_url(pending_validators_by_url)
+            except Exception as e:
+                logger.exception(e)
+                for rss_url in pending_validators_by_url:
+                    feed_results[rss_url] = 'failed to store: {}'.format(e)
+            del pending_news_dicts[:]
+            pending_validators_by_url.clear()
+
+        for rss_url, rss_response, exception in self._download_feeds(rss_urls, validators_by_url):
+            if exception is not None:
+                feed_results[rss_url] = 'failed: {}'.format(exception)
+                continue
+            if rss_response is None:
+                feed_results[rss_url] = 'not modified'
+                continue
+            try:
+                news_dicts = News.flatten(rss_response)
+            except PropelException as e:
+                feed_results[rss_url] = 'failed: {}'.format(e)
+                continue
+            feed_results[rss_url] = 'loaded {} news'.format(len(news_dicts))
+            pending_news_dicts.extend(news_dicts)
+            pending_validators_by_url[rss_url] = self._get_response_validators(rss_response)
+            if len(pending_news_dicts) >= write_batch_size:
+                write_pending_news()
+        if pending_validators_by_url:
+            write_pending_news()
+
+        for rss_url in sorted(feed_results):
+            logger.info('{}: {}'.format(rss_url, feed_results[rss_url]))
+        failed_feeds = [
+            rss_url
+            for rss_url, feed_result in feed_results.items()
+            if feed_result.startswith('failed')
+        ]
+        if failed_feeds:
+            raise PropelException(
+                '{} of {} feeds failed: {}'
+                .format(len(failed_feeds), len(rss_urls), ', '.join(sorted(failed_feeds)))
+            )
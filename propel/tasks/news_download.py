@@ -2,7 +2,7 @@ import json
 import feedparser
 
 from propel.exceptions import PropelException
-from propel.models import News, BaseTask
+from propel.models import News, FeedValidators, BaseTask
 from propel.settings import logger
 
 
@@ -11,6 +11,38 @@ class NewsDownload(BaseTask):
     Class that contains methods to capture and store RSS News Feeds
     """
 
+    @staticmethod
+    def _download_feed(rss_url, etag=None, modified=None):
+        """
+        Download and parse an RSS feed. The ETag and Last-Modified validators of the
+        previous download are sent along so an unchanged feed is not downloaded again.
+
+        :param rss_url: RSS feed url
+        :type rss_url: str
+        :param etag: ETag of the previous download
+        :type etag: str
+        :param modified: Last-Modified of the previous download
+        :type modified: str
+        :return: Parsed feed or None if the feed has not changed since the last download
+        """
+        rss_response = feedparser.parse(
+            url_file_stream_or_string=rss_url,
+            etag=etag,
+            modified=modified
+        )
+        status = rss_response.get('status')
+        if status == 304:
+            logger.info('{} not modified since last download'.format(rss_url))
+            return None
+        if status != 200:
+            raise PropelException('Non 200 response: {}'.format(status))
+        logger.info('Got {} news articles'.format(len(rss_response.entries)))
+        return rss_response
+
+    @staticmethod
+    def _get_response_validators(rss_response):
+        return rss_response.get('etag'), rss_response.get('modified')
+
     def execute(self, task):
         """
         Download news for a given set of filters e.g. sources, q, from, to, language etc
@@ -19,9 +51,12 @@ class NewsDownload(BaseTask):
         :type task: dict
         """
         rss_url = json.loads(task['task_args'])['rss_url']
-        rss_response = feedparser.parse(url_file_stream_or_string=rss_url)
-        if not (hasattr(rss_response, 'status') and rss_response.status == 200):
-            raise PropelException('Non 200 response: {}'.format(rss_response.status))
-        else:
-            logger.info('Got {} news articles'.format(len(rss_response.entries)))
+        etag, modified = FeedValidators.get_validators(rss_url)
+        rss_response = self._download_feed(rss_url, etag=etag, modified=modified)
+        if rss_response is None:
+            return
         News.load_into_db(rss_response)
+        # Validators are stored once the feed is loaded so a failed
+        # load downloads the feed again on the next run
+        etag, modified = self._get_response_validators(rss_response)
+        FeedValidators.set_validators(rss_url, etag=etag, modified=modified)
@@ -0,0 +1,98 @@
+import json
+from multiprocessing.pool import ThreadPool
+
+from requests.adapters import HTTPAdapter
+
+from propel import configuration
+from propel.exceptions import PropelException
+from propel.models import Tweets
+from propel.settings import logger
+from propel.tasks.twitter_extract import TwitterExtract, RateLimiter, RateLimitedSession
+
+
+class TwitterBatchExtract(TwitterExtract):
+    """
+    Class that captures tweets of many Twitter users in a single task run. All
+    users share one pooled Twitter session and one rate limit budget
+    """
+
+    def _get_twitter_session(self, pool_size=1):
+        twitter_session = super(TwitterBatchExtract, self)._get_twitter_session()
+        # Keep a connection per concurrent user alive between requests
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        twitter_session.mount('https://', adapter)
+        return twitter_session
+
+    def extract_timelines(self, twitter_session, screen_names, max_concurrent_users=1):
+        """
+        Extract timelines of several users concurrently. Every request draws from
+        a shared rate limiter, so once the window's budget is spent the users wait
+        for the reset instead of failing with 429 Too Many Requests.
+
+        :param twitter_session: Session used to call the Twitter API
+        :type twitter_session: requests.Session
+        :param screen_names: Twitter user screen names
+        :type screen_names: list
+        :param max_concurrent_users: Number of timelines extracted at the same time
+        :type max_concurrent_users: int
+        :return: Number of tweets stored for each user or the exception raised extracting it
+        :rtype: dict
+        """
+        rate_limited_session = RateLimitedSession(twitter_session, RateLimiter())
+        # Users extracted for the first time start from their latest stored tweet.
+        # Looking those up for every user at once instead of one query per user
+        Tweets.latest_tweet_ids_for_users(screen_names, use_cache=True)
+
+        def extract_timeline(screen_name):
+            try:
+                return screen_name, self.extract_timeline(rate_limited_session, screen_name)
+            except Exception as e:
+                logger.exception(e)
+                return screen_name, e
+
+        pool = ThreadPool(processes=min(max_concurrent_users, len(screen_names)))
+        try:
+            return dict(pool.imap_unordered(extract_timeline, screen_names))
+        finally:
+            pool.close()
+            pool.join()
+
+    def execute(self, task):
+        """
+        Capture tweets for a list of Twitter user screen names. Users that fail are
+        reported once all other users are extracted
+
+        :param task: An dict that contains details about the task to run
+        :type task: dict
+        """
+        screen_names = sorted(set(json.loads(task['task_args'])))
+        if not screen_names:
+            return
+        max_concurrent_users = int(configuration.get('twitter', 'max_concurrent_users'))
+        twitter_session = self._get_twitter_session(pool_size=max_concurrent_users)
+        user_results = self.extract_timelines(
+            twitter_session,
+            screen_names,
+            max_concurrent_users=max_concurrent_users
+        )
+        failed_users = sorted(
+            screen_name
+            for screen_name, result in user_results.items()
+            if isinstance(result, Exception)
+        )
+        logger.info(
+            'Stored {} tweets for {} users'
+            .format(
+                sum(
+                    result
+                    for result in user_results.values()
+                    if not isinstance(result, Exception)
+                ),
+                len(screen_names) - len(failed_users)
+            )
+        )
+        if failed_users:
+            raise PropelException(
+                '{} of {} users failed: {}'
+                .format(len(failed_users), len(screen_names), ', '.join(failed_users))
+            )
@@ -1,10 +1,133 @@
 import json
+import threading
+import time
 
 from requests_oauthlib import OAuth2Session
 
-from propel.models import Connections, Tweets, BaseTask
+from propel.exceptions import PropelException
+from propel.models import Connections, Tweets, TimelineCursors, BaseTask
 from propel.settings import logger
 from propel.utils.db import provide_session
+from propel.utils.general import Memoize, prefetch
+
+
+class RateLimiter(object):
+    """
+    Token bucket of the requests left in the current rate limit window of an API
+    endpoint. The bucket is refilled from the x-rate-limit-remaining and
+    x-rate-limit-reset headers of the responses, so every thread sharing the
+    limiter draws from the same budget.
+    """
+
+    def __init__(self):
+        # Unknown until the first response
+        self.remaining = None
+        self.reset_at = 0
+        # True while the single request allowed with an unknown budget is in flight
+        self._probing = False
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Take a request from the budget. While the budget is unknown a single
+        request is let through and the others wait for its response. Blocks
+        until the window resets when the budget is exhausted
+        """
+        while True:
+            with self._condition:
+                now = time.time()
+                if self.remaining is not None and now >= self.reset_at:
+                    # Window has reset. Budget is known again with the next response
+                    self.remaining = None
+                if self.remaining is None:
+                    if not self._probing:
+                        self._probing = True
+                        return
+                    self._condition.wait()
+                    continue
+                if self.remaining > 0:
+                    self.remaining -= 1
+                    return
+                wait_seconds = self.reset_at - now
+            logger.info('Rate limit exhausted. Waiting {:.0f} seconds'.format(wait_seconds))
+            time.sleep(wait_seconds)
+
+    def release(self):
+        """
+        Let the next request through after a request taken with an unknown
+        budget failed without a response
+        """
+        with self._condition:
+            self._probing = False
+            self._condition.notify_all()
+
+    def update(self, headers, exhausted=False):
+        """
+        Update the budget from the rate limit headers of a response
+
+        :param headers: Response headers
+        :type headers: dict
+        :param exhausted: True if the request was rejected for exceeding the rate limit
+        :type exhausted: bool
+        """
+        try:
+            remaining = int(headers['x-rate-limit-remaining'])
+            reset_at = int(headers['x-rate-limit-reset'])
+        except (KeyError, ValueError):
+            self.release()
+            return
+        with self._condition:
+            if exhausted:
+                remaining = 0
+            if reset_at > self.reset_at or self.remaining is None:
+                self.remaining = remaining
+            else:
+                # Responses of requests that were in flight can report a stale budget
+                self.remaining = min(self.remaining, remaining)
+            self.reset_at = max(self.reset_at, reset_at)
+            self._probing = False
+            self._condition.notify_all()
+
+
+class RateLimitedSession(object):
+    """
+    Wraps a requests session so every GET draws from a RateLimiter. Requests
+    rejected with 429 Too Many Requests are sent again once the window resets.
+    When the response tells no reset time still ahead the request is sent again
+    after an exponential backoff. Gives up after max_attempts rejected requests
+    """
+    max_attempts = 5
+    backoff_seconds = 15
+
+    def __init__(self, session, rate_limiter):
+        self.session = session
+        self.rate_limiter = rate_limiter
+
+    def get(self, url, **kwargs):
+        for attempt in range(1, self.max_attempts + 1):
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.get(url, **kwargs)
+            except Exception:
+                self.rate_limiter.release()
+                raise
+            too_many_requests = response.status_code == 429
+            self.rate_limiter.update(response.headers, exhausted=too_many_requests)
+            if not too_many_requests:
+                return response
+            if attempt == self.max_attempts:
+                break
+            if self.rate_limiter.reset_at <= time.time():
+                # acquire would not wait. Backing off instead of retrying right away
+                backoff_seconds = self.backoff_seconds * 2 ** (attempt - 1)
+                logger.info(
+                    'Too many requests without a reset time. Waiting {} seconds'
+                    .format(backoff_seconds)
+                )
+                time.sleep(backoff_seconds)
+        raise PropelException(
+            'Too many requests to {} after {} attempts'.format(url, self.max_attempts)
+        )
 
 
 class TwitterExtract(BaseTask):
@@ -15,6 +138,7 @@ class TwitterExtract(BaseTask):
     timeline_url = 'https://api.twitter.com/1.1/statuses/user_timeline.json'
 
     @staticmethod
+    @Memoize(ttl=300)
     @provide_session
     def _get_token(session=None):
         twitter_conn = (
@@ -26,18 +150,24 @@ class TwitterExtract(BaseTask):
         token = json.loads(twitter_conn.token)
         return token
 
-    def execute(self, task):
+    def _get_twitter_session(self):
+        logger.info('Getting Twitter Credentials')
+        return OAuth2Session(token=self._get_token())
+
+    def _get_timeline_pages(self, twitter_session, screen_name, since_id=None, max_id=None):
         """
-        Capture tweets for a given Twitter user screen name
+        Yield pages of a user's timeline walking back from max_id (or the newest
+        tweet) to since_id
 
-        :param task: An dict that contains details about the task to run
-        :type task: dict
+        :param twitter_session: Session used to call the Twitter API
+        :type twitter_session: requests.Session
+        :param screen_name: Twitter user screen name
+        :type screen_name: str
+        :param since_id: Only tweets newer than since_id are returned
+        :type since_id: int
+        :param max_id: Only tweets older than or equal to max_id are returned
+        :type max_id: int
         """
-        logger.info('Getting Twitter Credentials')
-        token = self._get_token()
-        twitter_session = OAuth2Session(token=token)
-        continue_fetching = True
-        screen_name = task['task_args']
         # count: The API puts a limit of 200 tweets per requests
         request_params = {
             'screen_name': screen_name,
@@ -46,23 +176,93 @@ class TwitterExtract(BaseTask):
             'count': 200,
             'tweet_mode': 'extended'
         }
-        logger.info("Fetching tweets for {}".format(screen_name))
-        from_id = Tweets.latest_tweet_id_for_user(screen_name=screen_name)
-        if from_id:
-            request_params['since_id'] = from_id
-        tweets = list()
-        while continue_fetching:
+        if since_id:
+            request_params['since_id'] = since_id
+        while True:
+            if max_id is not None:
+                request_params['max_id'] = max_id
             twitter_response = twitter_session.get(self.timeline_url, params=request_params)
             twitter_response.raise_for_status()
             paginated_tweets = json.loads(twitter_response.text)
-            tweets.extend(paginated_tweets)
-            if len(paginated_tweets) > 0:
-                continue_fetching = True
-                request_params['since_id'] = max(
-                    request_params.get('since_id'),
-                    max([tweet['id'] for tweet in paginated_tweets])
-                )
-            else:
+            if not paginated_tweets:
                 logger.info('Exhausted tweet timeline for {}'.format(screen_name))
-                continue_fetching = False
-        Tweets.load_into_db(tweets)
+                return
+            max_id = min(tweet['id'] for tweet in paginated_tweets) - 1
+            yield paginated_tweets
+
+    @staticmethod
+    @provide_session
+    def _get_cursor(screen_name, session=None):
+        return session.query(TimelineCursors).get(screen_name)
+
+    @staticmethod
+    @provide_session
+    def _save_cursor(cursor, paginated_tweets=None, session=None):
+        """
+        Store the cursor along with the page of tweets it points past in one transaction
+        """
+        tweet_dicts = [Tweets.flatten(tweet_json) for tweet_json in paginated_tweets or []]
+        if tweet_dicts:
+            Tweets.upsert_into_db(tweet_dicts, session=session)
+        session.merge(cursor)
+        session.commit()
+        Tweets.cache_latest_tweet_ids(tweet_dicts)
+
+    def extract_timeline(self, twitter_session, screen_name):
+        """
+        Store tweets of a user's timeline posted since the last extract. The next page is
+        fetched while the current one is written and every page is committed with the
+        timeline cursor, so an interrupted extract resumes from the last committed page.
+
+        :param twitter_session: Session used to call the Twitter API
+        :type twitter_session: requests.Session
+        :param screen_name: Twitter user screen name
+        :type screen_name: str
+        :return: Number of tweets stored
+        :rtype: int
+        """
+        cursor = self._get_cursor(screen_name)
+        if cursor is None:
+            cursor = TimelineCursors(
+                screen_name=screen_name,
+                since_id=Tweets.latest_tweet_id_for_user(screen_name=screen_name, use_cache=True)
+            )
+        if cursor.max_id is not None:
+            logger.info(
+                'Resuming tweets for {} from {} back to {}'
+                .format(screen_name, cursor.max_id, cursor.since_id)
+            )
+        else:
+            logger.info("Fetching tweets for {} since {}".format(screen_name, cursor.since_id))
+            cursor.newest_id = None
+        timeline_pages = self._get_timeline_pages(
+            twitter_session,
+            screen_name,
+            since_id=cursor.since_id,
+            max_id=cursor.max_id
+        )
+        tweet_count = 0
+        for paginated_tweets in prefetch(timeline_pages):
+            tweet_ids = [tweet['id'] for tweet in paginated_tweets]
+            cursor.max_id = min(tweet_ids) - 1
+            cursor.newest_id = max(tweet_ids + [cursor.newest_id or 0])
+            self._save_cursor(cursor, paginated_tweets)
+            tweet_count += len(paginated_tweets)
+        # Walk is complete. Next extract only needs tweets newer than the newest stored
+        if cursor.newest_id:
+            cursor.since_id = max(cursor.newest_id, cursor.since_id or 0)
+        cursor.max_id = None
+        cursor.newest_id = None
+        self._save_cursor(cursor)
+        logger.info('Stored {} tweets for {}'.format(tweet_count, screen_name))
+        return tweet_count
+
+    def execute(self, task):
+        """
+        Capture tweets for a given Twitter user screen name
+
+        :param task: An dict that contains details about the task to run
+        :type task: dict
+        """
+        twitter_session = self._get_twitter_session()
+        self.extract_timeline(twitter_session, task['task_args'])
@@ -2,6 +2,8 @@ import inspect
 
 from contextlib import contextmanager
 from functools import wraps
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import Insert
 
 from propel.settings import Session
 
@@ -52,3 +54,35 @@ def provide_session(func):
 def commit_db_object(db_object, session=None):
     session.add(db_object)
     session.commit()
+
+
+class Upsert(Insert):
+    """
+    INSERT that updates update_columns of the existing row when the row's
+    primary key already exists. Compiled to INSERT ... ON DUPLICATE KEY UPDATE
+    on MySQL and INSERT OR REPLACE on SQLite. Executed with a list of dicts it
+    is sent as a single multi-row statement by the MySQL driver.
+
+    E.g. session.execute(Upsert(News.__table__, ['title']), [{'news_id': 'a', 'title': 'b'}])
+    """
+
+    def __init__(self, table, update_columns, **kwargs):
+        super(Upsert, self).__init__(table, **kwargs)
+        self.update_columns = update_columns
+
+
+@compiles(Upsert, 'mysql')
+def _compile_upsert_mysql(upsert, compiler, **kwargs):
+    statement = compiler.visit_insert(upsert, **kwargs)
+    updates = ', '.join(
+        '{0} = VALUES({0})'.format(compiler.preparer.quote(column))
+        for column in upsert.update_columns
+    )
+    return '{} ON DUPLICATE KEY UPDATE {}'.format(statement, updates)
+
+
+@compiles(Upsert, 'sqlite')
+def _compile_upsert_sqlite(upsert, compiler, **kwargs):
+    # SQLite replaces the whole row. Used when running tests against SQLite
+    statement = compiler.visit_insert(upsert, **kwargs)
+    return statement.replace('INSERT', 'INSERT OR REPLACE', 1)
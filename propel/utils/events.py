@@ -0,0 +1,112 @@
+import json
+import time
+
+from propel import configuration
+from propel.settings import logger
+
+
+class TaskRunEvents(object):
+    """
+    Channel on which executors announce that a task run finished so the
+    scheduler can queue its downstream task runs without waiting out its
+    sleep. This base channel carries no events: wait simply sleeps and the
+    scheduler finds finished task runs by polling the DB on its next tick.
+    """
+
+    def publish(self, task_run_id, state):
+        """
+        Announce that a task run finished
+
+        :param task_run_id: Id of the finished task run
+        :type task_run_id: int
+        :param state: State the task run finished with
+        :type state: str
+        """
+        pass
+
+    def wait(self, timeout_seconds):
+        """
+        Block until task runs finish or timeout_seconds pass
+
+        :return: (task_run_id, state) of the task runs that finished
+        :rtype: list
+        """
+        time.sleep(timeout_seconds)
+        return []
+
+
+class RedisTaskRunEvents(TaskRunEvents):
+    """
+    Task run events sent over Redis pub/sub. Events published while nobody
+    listens are lost, which only delays the scheduler until its next tick.
+    """
+    channel = 'propel:task_run_events'
+
+    def __init__(self, url=None):
+        import redis
+        if url is None:
+            url = configuration.get('redis', 'url')
+        self._redis = redis.StrictRedis.from_url(url)
+        self._pubsub = None
+
+    def publish(self, task_run_id, state):
+        # A task run must not fail because the scheduler could not be woken up
+        try:
+            self._redis.publish(
+                self.channel,
+                json.dumps({'task_run_id': task_run_id, 'state': state})
+            )
+        except Exception as e:
+            logger.warning('Could not publish event of TaskRun {}: {}'.format(task_run_id, e))
+
+    def _get_messages(self, timeout_seconds):
+        if self._pubsub is None:
+            # Subscribed on first wait. Events are buffered from then on even while
+            # the scheduler is busy with a tick
+            self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(self.channel)
+        messages = list()
+        message = self._pubsub.get_message(timeout=timeout_seconds)
+        while message is not None:
+            messages.append(message)
+            message = self._pubsub.get_message()
+        return messages
+
+    def wait(self, timeout_seconds):
+        deadline = time.time() + timeout_seconds
+        try:
+            while True:
+                remaining_seconds = deadline - time.time()
+                if remaining_seconds <= 0:
+                    return []
+                events = [
+                    json.loads(message['data'])
+                    for message in self._get_messages(remaining_seconds)
+                    if message.get('type') == 'message'
+                ]
+                if events:
+                    return [(event['task_run_id'], event['state']) for event in events]
+        except Exception as e:
+            logger.warning('Could not wait for task run events: {}'.format(e))
+            self._pubsub = None
+            return super(RedisTaskRunEvents, self).wait(max(deadline - time.time(), 0))
+
+
+_task_run_events = None
+
+
+def get_task_run_events():
+    """
+    Get the task run event channel set by [core] task_run_events. The channel
+    is created once per process
+    """
+    global _task_run_events
+    if _task_run_events is None:
+        task_run_events_name = configuration.get('core', 'task_run_events')
+        if task_run_events_name == 'Redis':
+            _task_run_events = RedisTaskRunEvents()
+        elif task_run_events_name == 'None':
+            _task_run_events = TaskRunEvents()
+        else:
+            raise NotImplementedError('Task run events {} not defined'.format(task_run_events_name))
+    return _task_run_events
@@ -1,19 +1,38 @@
+import ast
 import billiard
+import operator
 import os
 import re
 import signal
+import six
 import sys
 import time
 import threading
 import traceback
+from contextlib import contextmanager
 from datetime import datetime
 from functools import wraps
+from six.moves import queue
 from propel import configuration
+from propel.exceptions import PropelException
 from propel.settings import logger
-from propel.utils.db import commit_db_object
+from propel.utils.db import provide_session
 from propel.utils.log import reset_logger
 
 
+ACCESS_REGEX = re.compile(r"^([^{[]+)$")
+FILTER_REGEX = re.compile(r"^\{([^!=><]+)(\=\=|\!\=|\>|\>\=|\<|\<\=)([^!=><]+)\}$")
+INDEX_REGEX = re.compile(r"^\[(\d+|\*)\]$")
+FILTER_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+
 def _parse_operation(operation):
     """
     Given an operation string, method returns the name of the operation
@@ -32,30 +51,227 @@ def _parse_operation(operation):
     :param operation: Operation string
     :type operation: str
     """
-    logger.info("Parsing operation: {}".format(operation))
-    access_pattern = "^([^{[]+)$"
-    filter_pattern = "^\{([^!=><]+)(\=\=|\!\=|\>|\>\=|\<|\<\=)([^!=><]+)\}$"
-    index_pattern = "^\[(\d+|\*)\]$"
-    access_regex = re.compile(access_pattern)
-    filter_regex = re.compile(filter_pattern)
-    index_regex = re.compile(index_pattern)
+    logger.debug("Parsing operation: {}".format(operation))
     # Matching operation string against the three operation types
-    match_object = re.match(access_regex, operation)
+    match_object = ACCESS_REGEX.match(operation)
     if match_object:
-        logger.debug("Access operation")
         return 'access', match_object.groups()
-    match_object = re.match(filter_regex, operation)
+    match_object = FILTER_REGEX.match(operation)
     if match_object:
-        logger.debug("Filter operation")
         return 'filter', match_object.groups()
-    match_object = re.match(index_regex, operation)
+    match_object = INDEX_REGEX.match(operation)
     if match_object:
-        logger.debug("Index operation")
         return 'index', match_object.groups()
     logger.warn("Unknown operation type")
     return None, None
 
 
+def _compile_operation(operation):
+    """
+    Compile an operation string into a function that takes the current stack
+    of json objects and returns the stack produced by the operation
+
+    :param operation: Operation string
+    :type operation: str
+    """
+    operation_type, operator_groups = _parse_operation(operation)
+    if operation_type == 'access':
+        namespace = operator_groups[0]
+
+        def access(stack):
+            stack_buffer = list()
+            for stack_item in stack:
+                stack_item_value = stack_item.get(namespace)
+                if stack_item_value is not None:
+                    stack_buffer.append(stack_item_value)
+            return stack_buffer
+        return access
+    elif operation_type == 'filter':
+        namespace, condition, value = operator_groups
+        filter_operator = FILTER_OPERATORS[condition]
+        try:
+            # value is a python literal e.g. "video/mp4" or 111
+            value = ast.literal_eval(value.strip())
+        except (ValueError, SyntaxError):
+            raise PropelException('Unsupported filter value in operation {}'.format(operation))
+
+        def filter_(stack):
+            return [
+                stack_item
+                for stack_item in stack
+                if filter_operator(stack_item.get(namespace), value)
+            ]
+        return filter_
+    elif operation_type == 'index':
+        index = operator_groups[0]
+        if index == '*':
+            def denest(stack):
+                stack_buffer = list()
+                for stack_item in stack:
+                    if isinstance(stack_item, list):
+                        stack_buffer.extend(stack_item)
+                return stack_buffer
+            return denest
+        index = int(index)
+
+        def index_(stack):
+            return [stack[index]]
+        return index_
+    raise PropelException('Unknown operation type in operation {}'.format(operation))
+
+
+def _unstack(stack):
+    """
+    If the stack has a single item then return that item else return the
+    list of items. An empty stack returns None
+    """
+    if len(stack) == 0:
+        return None
+    if len(stack) == 1:
+        return stack[0]
+    return stack
+
+
+class JsonPath(object):
+    """
+    An operations string (see extract_from_json) parsed once into a list of
+    operation functions so it can be applied to any number of json objects
+    without re-parsing it.
+
+    E.g. media_urls = JsonPath('extended_entities.media.[*].media_url')
+    media_urls.extract(tweet_json)
+    """
+
+    def __init__(self, operations):
+        self.operations = operations
+        self.steps = [
+            _compile_operation(operation)
+            for operation in operations.split('.')
+        ]
+
+    def __repr__(self):
+        return "<JsonPath(operations={0})>".format(self.operations)
+
+    def extract(self, json_object):
+        """
+        Perform the compiled operations on json_object and return the result
+
+        :param json_object: JSON Object
+        :type json_object: Python object
+        """
+        if not json_object:
+            logger.warn("JSON data not provided")
+            return None
+        stack = [json_object]
+        try:
+            for step in self.steps:
+                stack = step(stack)
+        except Exception:
+            logger.warn("Exception while processing json")
+            traceback.print_exc()
+            return None
+        return _unstack(stack)
+
+
+_json_path_cache = dict()
+
+
+def compile_json_path(operations):
+    """
+    Return a JsonPath for the operations string. Compiled paths are cached
+    so the same operations string is only parsed once per process.
+
+    :param operations: Operation string
+    :type operations: str
+    """
+    json_path = _json_path_cache.get(operations)
+    if json_path is None:
+        json_path = JsonPath(operations)
+        _json_path_cache[operations] = json_path
+    return json_path
+
+
+class _JsonPathPlanNode(object):
+    """
+    Node of a JsonPathPlan tree. Holds one compiled operation, the names whose
+    operations string ends at this node and the nodes of the following operations
+    """
+
+    def __init__(self, operation=None):
+        self.operation = operation
+        self.step = _compile_operation(operation) if operation else None
+        self.names = list()
+        self.children = list()
+        self._children_by_operation = dict()
+
+    def child(self, operation):
+        node = self._children_by_operation.get(operation)
+        if node is None:
+            node = _JsonPathPlanNode(operation)
+            self._children_by_operation[operation] = node
+            self.children.append(node)
+        return node
+
+
+class JsonPathPlan(object):
+    """
+    A mapping of names to operations strings (see extract_from_json) compiled
+    into a single tree of operations. Operations strings sharing a prefix share
+    the nodes of that prefix, so extract performs every operation once per json
+    object no matter how many names depend on it.
+
+    E.g. plan = JsonPathPlan({'first_name': 'name.first', 'last_name': 'name.last'})
+    plan.extract(input_json)
+    {'first_name': 'Dilly', 'last_name': 'Berty'}
+
+    Here 'name' is accessed once for both first_name and last_name.
+    """
+
+    def __init__(self, operations_map):
+        self.operations_map = operations_map
+        self.root = _JsonPathPlanNode()
+        for name, operations in operations_map.items():
+            node = self.root
+            for operation in operations.split('.'):
+                node = node.child(operation)
+            node.names.append(name)
+
+    def extract(self, json_object):
+        """
+        Return a dict of name and result of its operations on json_object. Results
+        are identical to calling extract_from_json for every name
+
+        :param json_object: JSON Object
+        :type json_object: Python object
+        """
+        output = dict.fromkeys(self.operations_map)
+        if not json_object:
+            logger.warn("JSON data not provided")
+            return output
+        for child in self.root.children:
+            self._extract_node(child, [json_object], output)
+        return output
+
+    def _extract_node(self, node, stack, output):
+        try:
+            stack = node.step(stack)
+        except Exception:
+            # Names under this node keep the None they were initialized with
+            logger.warn("Exception while processing json")
+            traceback.print_exc()
+            return
+        # Every operation returns an empty stack on an empty stack
+        # (or fails for index) so the names under this node stay None
+        if not stack:
+            return
+        if node.names:
+            result = _unstack(stack)
+            for name in node.names:
+                output[name] = result
+        for child in node.children:
+            self._extract_node(child, stack, output)
+
+
 def extract_from_json(json_object, operations):
     """
     Perform operations on json and return the result.
@@ -75,6 +291,9 @@ def extract_from_json(json_object, operations):
     index location. When star is specified it de-nests a list i.e. passes
     through each list item and returns the objects in the list.
 
+    The operations string is compiled once into a JsonPath and cached, so
+    repeated calls with the same operations only pay for the traversal.
+
     E.g. input_json = { 'name':  {'first':'Dilly', 'last':'Berty'},
                         'phone': [
                                  {'area':111, 'number':222333},
@@ -111,61 +330,12 @@ def extract_from_json(json_object, operations):
     if not operations:
         logger.warn("Operations str not specified")
         return None
-    stack = list()
-    stack.append(json_object)
     try:
-        for operation in operations.split('.'):
-            stack_buffer = list()
-            operation_type, operator = _parse_operation(operation)
-            logger.debug("Processing JSON: {}".format(stack))
-            if operation_type == 'access':
-                logger.debug("Performing access operation")
-                namespace = operator[0]
-                for stack_item in stack:
-                    stack_item_value = stack_item.get(namespace)
-                    if stack_item_value is not None:
-                        stack_buffer.append(stack_item_value)
-            elif operation_type == 'filter':
-                logger.debug("Performing filter operation")
-                namespace, condition, value = operator
-                for stack_item in stack:
-                    filter_value = stack_item.get(namespace)
-                    eval_string = "{}{}{}".format("filter_value",
-                                                  condition,
-                                                  value)
-                    logger.debug(
-                        "Evaluating {}{}{}".format(filter_value, condition, value)
-                    )
-                    if eval(eval_string):
-                        stack_buffer.append(stack_item)
-            elif operation_type == 'index':
-                logger.debug("Performing index operation")
-                index = operator[0]
-                if index == "*":
-                    logger.debug("Received * index. Stacking all entries within list")
-                    for stack_item in stack:
-                        if isinstance(stack_item, list):
-                            for item in stack_item:
-                                stack_buffer.append(item)
-                elif index.isdigit():
-                    stack_buffer.append(stack[int(index)])
-            else:
-                logger.warn("Unknown operation type. Cannot process further")
-                return None
-            stack = stack_buffer
-            logger.debug("Processed JSON: {}".format(stack))
-        # If result has a single item then return that item
-        # else return the list of items
-        if len(stack) == 0:
-            return None
-        if len(stack) == 1:
-            return stack[0]
-        else:
-            return stack
-    except Exception:
-        logger.warn("Exception while processing json")
-        traceback.print_exc()
+        json_path = compile_json_path(operations)
+    except PropelException as e:
+        logger.warn("{}. Cannot process further".format(e))
         return None
+    return json_path.extract(json_object)
 
 
 def extract_multiple_from_json(json_object, operations_map):
@@ -192,6 +362,77 @@ def extract_multiple_from_json(json_object, operations_map):
     return output
 
 
+def chunked(iterable, chunk_size):
+    """
+    Yield lists of up to chunk_size items from iterable without reading
+    more than one chunk of it at a time
+
+    :param iterable: Iterable to split into chunks
+    :type iterable: iterable
+    :param chunk_size: Max number of items in a chunk
+    :type chunk_size: int
+    """
+    chunk = list()
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
+
+
+def prefetch(iterable, size=1):
+    """
+    Iterate over iterable in a background thread that stays up to size items ahead
+    of the consumer. Useful to overlap IO bound production of items (e.g. fetching
+    the next page of an API) with their consumption. Exceptions raised while
+    producing are raised in the consumer.
+
+    :param iterable: Iterable to consume in the background
+    :type iterable: iterable
+    :param size: Max number of items produced ahead of the consumer
+    :type size: int
+    """
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    end_of_items = object()
+
+    def put(item):
+        # Giving up when the consumer stops early so the thread does not block forever
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException:
+            put((None, sys.exc_info()))
+        else:
+            put((end_of_items, None))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, exc_info = items.get()
+            if exc_info:
+                six.reraise(*exc_info)
+            if item is end_of_items:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
 class Memoize(object):
     """
     Decorator to memoize the results of the function until ttl.
@@ -248,6 +489,184 @@ class FunctionExceptionCatcher(object):
             self.exc_info = sys.exc_info()
 
 
+@contextmanager
+def redirect_output(log_file):
+    """
+    Context manager that redirects stdout, stderr and the logger of the
+    process to log_file. The previous stdout, stderr and logger handlers are
+    put back on exit
+    """
+    stdout, stderr = sys.stdout, sys.stderr
+    handlers = list(logger.handlers)
+    with open(log_file, 'a') as log_file_handle:
+        try:
+            logger.info("Redirecting output to {}".format(log_file))
+            sys.stdout = log_file_handle
+            sys.stderr = log_file_handle
+            # Resetting logger so it is configured to output to log_file
+            # See https://stackoverflow.com/questions/22105465/
+            # how-can-i-temporarily-redirect-the-output-of-logging-in-python
+            # /50652143#50652143
+            reset_logger()
+            yield
+        except Exception as e:
+            logger.exception(e)
+            raise
+        finally:
+            sys.stdout = stdout
+            sys.stderr = stderr
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+            for handler in handlers:
+                logger.addHandler(handler)
+
+
+class HeartbeatTimer(object):
+    """
+    Background thread that sends the heartbeats of everything a process runs
+    in-process. Heartbeat rows are created when a run starts and every
+    heartbeat_seconds the last heartbeat time of all of them is set with a
+    single bulk UPDATE. There is one timer per process and its thread stops
+    while there is nothing to send heartbeats for.
+
+    A worker that forks processes to run tasks calls collect_from_child_processes
+    before forking. Timers of the child processes then forward their heartbeats
+    to the worker's timer, so the worker host writes one UPDATE per interval
+    however many runs its processes execute. Heartbeats of a child process that
+    died are dropped.
+    """
+    _instance = None
+    _instance_pid = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, heartbeat_seconds=None, parent_queue=None):
+        if heartbeat_seconds is None:
+            heartbeat_seconds = int(configuration.get('core', 'heartbeat_seconds'))
+        self.heartbeat_seconds = heartbeat_seconds
+        # Heartbeat id to the PID of the process running it
+        self._heartbeat_pids = dict()
+        self._lock = threading.Lock()
+        self._thread = None
+        # Queue child processes forward their heartbeats on
+        self._queue = None
+        # Queue of the parent's timer this timer forwards heartbeats to
+        self._parent_queue = parent_queue
+
+    @classmethod
+    def get_instance(cls):
+        with cls._instance_lock:
+            # A forked process does not have the thread of its parent's timer
+            if cls._instance is None or cls._instance_pid != os.getpid():
+                parent_queue = cls._instance._queue if cls._instance else None
+                cls._instance = cls(parent_queue=parent_queue)
+                cls._instance_pid = os.getpid()
+            return cls._instance
+
+    def collect_from_child_processes(self):
+        """
+        Send the heartbeats of processes forked from here on
+        """
+        with self._lock:
+            if self._queue is None:
+                self._queue = billiard.Queue()
+                self._start_thread()
+
+    def _start_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._send_heartbeats)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _apply(self, action, heartbeat_id, pid):
+        with self._lock:
+            if action == 'add':
+                self._heartbeat_pids[heartbeat_id] = pid
+                self._start_thread()
+            else:
+                self._heartbeat_pids.pop(heartbeat_id, None)
+
+    def _forward_or_apply(self, action, heartbeat_id):
+        if self._parent_queue is not None:
+            self._parent_queue.put((action, heartbeat_id, os.getpid()))
+        else:
+            self._apply(action, heartbeat_id, os.getpid())
+
+    def add(self, heartbeat_mixin, heartbeat_model_kwargs=None):
+        """
+        Start sending heartbeats for heartbeat_mixin. The heartbeat row is
+        created right away
+
+        :param heartbeat_mixin: Object whose _update_heartbeat creates the heartbeat row
+        :type heartbeat_mixin: HeartbeatMixin
+        :param heartbeat_model_kwargs: kwargs that are passed when creating heartbeat entry
+        :type heartbeat_model_kwargs: dict
+        :return: Heartbeat id to pass to remove
+        :rtype: int
+        """
+        heartbeat = heartbeat_mixin._update_heartbeat(
+            heartbeat=None,
+            heartbeat_model_kwargs=heartbeat_model_kwargs
+        )
+        self._forward_or_apply('add', heartbeat.id)
+        return heartbeat.id
+
+    def remove(self, heartbeat_id):
+        self._forward_or_apply('remove', heartbeat_id)
+
+    def _wait(self):
+        """
+        Wait heartbeat_seconds while applying heartbeats forwarded by child processes
+        """
+        if self._queue is None:
+            time.sleep(self.heartbeat_seconds)
+            return
+        deadline = time.time() + self.heartbeat_seconds
+        while True:
+            remaining_seconds = deadline - time.time()
+            if remaining_seconds <= 0:
+                return
+            try:
+                self._apply(*self._queue.get(timeout=remaining_seconds))
+            except queue.Empty:
+                return
+
+    @staticmethod
+    def _is_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        return True
+
+    def _send_heartbeats(self):
+        from propel.models import Heartbeats
+        while True:
+            self._wait()
+            with self._lock:
+                for pid in set(self._heartbeat_pids.values()):
+                    if pid != os.getpid() and not self._is_alive(pid):
+                        logger.warning('Process {} died. Dropping its heartbeats'.format(pid))
+                        self._heartbeat_pids = {
+                            heartbeat_id: heartbeat_pid
+                            for heartbeat_id, heartbeat_pid in self._heartbeat_pids.items()
+                            if heartbeat_pid != pid
+                        }
+                if not self._heartbeat_pids and self._queue is None:
+                    # Started again by the next add
+                    self._thread = None
+                    return
+                heartbeat_ids = list(self._heartbeat_pids)
+            if not heartbeat_ids:
+                continue
+            # A failed update must not stop the thread. Heartbeats are sent again next interval
+            try:
+                Heartbeats.touch(heartbeat_ids)
+            except Exception as e:
+                logger.exception(e)
+                continue
+            logger.debug('Sent {} heartbeats from PID: {}'.format(len(heartbeat_ids), os.getpid()))
+
+
 class HeartbeatMixin(object):
     """
     Mixin class that helps classes run a thread while the parent process produces a heartbeat
@@ -259,7 +678,8 @@ class HeartbeatMixin(object):
             thread_args=None,
             thread_kwargs=None,
             log_file=None,
-            heartbeat_model_kwargs=None
+            heartbeat_model_kwargs=None,
+            isolate=True
     ):
         """
         Method that runs process_function through "multiprocessing" and sends regular heartbeat
@@ -275,7 +695,19 @@ class HeartbeatMixin(object):
         :type log_file: str
         :param heartbeat_model_kwargs: kwargs that are passed when creating heartbeat entry
         :type heartbeat_model_kwargs: dict
+        :param isolate: If False thread_function is run in the calling thread and the
+            process's HeartbeatTimer sends its heartbeats. This saves a fork per call
+            but a crash of thread_function takes the calling process down with it
+        :type isolate: bool
         """
+        if not isolate:
+            return self._heartbeat_in_process(
+                thread_function,
+                thread_args,
+                thread_kwargs,
+                log_file,
+                heartbeat_model_kwargs
+            )
 
         def kill_heartbeat_process(signum, frame):
             logger.warning(
@@ -331,6 +763,29 @@ class HeartbeatMixin(object):
                 + child_process_traceback
             )
 
+    def _heartbeat_in_process(
+            self,
+            thread_function,
+            thread_args=None,
+            thread_kwargs=None,
+            log_file=None,
+            heartbeat_model_kwargs=None
+    ):
+        """
+        Run thread_function in the calling thread while the process's
+        HeartbeatTimer sends its heartbeats. Exceptions are raised to the caller
+        """
+        heartbeat_timer = HeartbeatTimer.get_instance()
+        heartbeat_id = heartbeat_timer.add(self, heartbeat_model_kwargs)
+        try:
+            if log_file:
+                with redirect_output(log_file):
+                    thread_function(*(thread_args or list()), **(thread_kwargs or dict()))
+            else:
+                thread_function(*(thread_args or list()), **(thread_kwargs or dict()))
+        finally:
+            heartbeat_timer.remove(heartbeat_id)
+
     def _heartbeat_with_logger_redirect(
             self,
             thread_function,
@@ -358,29 +813,13 @@ class HeartbeatMixin(object):
         """
         try:
             if log_file:
-                with open(log_file, 'a') as log_file_handle:
-                    try:
-                        logger.info("Redirecting output to {}".format(log_file))
-                        sys.stdout = log_file_handle
-                        sys.stderr = log_file_handle
-                        # Resetting logger so it is configured to output to log_file
-                        # See https://stackoverflow.com/questions/22105465/
-                        # how-can-i-temporarily-redirect-the-output-of-logging-in-python
-                        # /50652143#50652143
-                        reset_logger()
-                        self._run_heartbeat(
-                            thread_function,
-                            thread_args,
-                            thread_kwargs,
-                            heartbeat_model_kwargs
-                        )
-                    except Exception as e:
-                        logger.exception(e)
-                        raise
-                    finally:
-                        sys.stdout = sys.__stdout__
-                        sys.stderr = sys.__stderr__
-                        reset_logger()
+                with redirect_output(log_file):
+                    self._run_heartbeat(
+                        thread_function,
+                        thread_args,
+                        thread_kwargs,
+                        heartbeat_model_kwargs
+                    )
             else:
                 self._run_heartbeat(thread_function, thread_args, thread_kwargs)
         # Catch every exception including SystemExit and KeyboardInterrupt
@@ -461,14 +900,16 @@ class HeartbeatMixin(object):
                     heartbeat_model_kwargs=heartbeat_model_kwargs
                 )
             logger.info('Woot Woot from PID: {}'.format(os.getpid()))
-            time.sleep(heartbeat_seconds)
+            # Returns as soon as the thread finishes instead of sleeping out the interval
+            thread.join(heartbeat_seconds)
 
         thread_exc_info = thread_function_with_exception_catcher.exc_info
         if thread_exc_info:
             # If exception occurred in thread then raise it in main thread
             raise thread_exc_info[1], None, thread_exc_info[2]
 
-    def _update_heartbeat(self, heartbeat, heartbeat_model_kwargs):
+    @provide_session
+    def _update_heartbeat(self, heartbeat, heartbeat_model_kwargs, session=None):
         from propel.models import Heartbeats
         if not heartbeat:
             heartbeat = Heartbeats(
@@ -478,7 +919,11 @@ class HeartbeatMixin(object):
             )
         else:
             heartbeat.last_heartbeat_time = datetime.utcnow()
-        commit_db_object(heartbeat)
+        session.add(heartbeat)
+        session.commit()
+        # Commit expires the attributes. Loading them while the session is open so
+        # the id can be read once heartbeat is detached
+        session.refresh(heartbeat)
         return heartbeat
 
 
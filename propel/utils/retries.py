@@ -0,0 +1,98 @@
+import random
+
+from propel import configuration
+
+
+class RetryPolicy(object):
+    """
+    How often and after how long a failed task run is tried again. The delay
+    before try n + 1 is retry_delay_seconds * 2 ** (n - 1), capped at
+    max_retry_delay_seconds and shortened by a random fraction of up to
+    retry_jitter so runs that failed together are not retried together. The
+    policy of a task type is stored on its task runs when they are created, so
+    changing it does not affect runs that already exist.
+    """
+
+    def __init__(self, max_tries, retry_delay_seconds, max_retry_delay_seconds, retry_jitter):
+        self.max_tries = max_tries
+        self.retry_delay_seconds = retry_delay_seconds
+        self.max_retry_delay_seconds = max_retry_delay_seconds
+        self.retry_jitter = retry_jitter
+
+    @classmethod
+    def for_task_type(cls, task_type):
+        """
+        Get the retry policy of a task type. Settings of the [retries.<task_type>]
+        section override those of [retries]. max_tries defaults to [core] max_tries
+
+        :param task_type: Task type such as TwitterExtract
+        :type task_type: str
+        :rtype: RetryPolicy
+        """
+        task_type_section = 'retries.{}'.format(task_type)
+
+        def get(option, default_section='retries'):
+            if configuration.config.has_option(task_type_section, option):
+                return configuration.get(task_type_section, option)
+            return configuration.get(default_section, option)
+
+        return cls(
+            max_tries=int(get('max_tries', default_section='core')),
+            retry_delay_seconds=float(get('retry_delay_seconds')),
+            max_retry_delay_seconds=float(get('max_retry_delay_seconds')),
+            retry_jitter=float(get('retry_jitter')),
+        )
+
+    @classmethod
+    def for_task_run(cls, task_run, task_type):
+        """
+        Get the retry policy stored on a task run when it was created. Task runs
+        created before retry settings were stored get the policy of task_type
+
+        :param task_run: Task run
+        :type task_run: propel.models.TaskRuns
+        :param task_type: Task type of the task run
+        :type task_type: str
+        :rtype: RetryPolicy
+        """
+        if task_run.max_tries is None:
+            return cls.for_task_type(task_type)
+        return cls(
+            max_tries=task_run.max_tries,
+            retry_delay_seconds=task_run.retry_delay_seconds,
+            max_retry_delay_seconds=task_run.max_retry_delay_seconds,
+            retry_jitter=task_run.retry_jitter,
+        )
+
+    def get_task_run_values(self):
+        """
+        :return: Values of the TaskRuns columns that store this policy
+        :rtype: dict
+        """
+        return {
+            'max_tries': self.max_tries,
+            'retry_delay_seconds': self.retry_delay_seconds,
+            'max_retry_delay_seconds': self.max_retry_delay_seconds,
+            'retry_jitter': self.retry_jitter,
+        }
+
+    def should_retry(self, try_number):
+        """
+        :param try_number: Number of the try that failed
+        :type try_number: int
+        :rtype: bool
+        """
+        return try_number < self.max_tries
+
+    def get_delay_seconds(self, try_number):
+        """
+        :param try_number: Number of the try that failed
+        :type try_number: int
+        :return: Seconds to wait before the next try
+        :rtype: float
+        """
+        delay_seconds = min(
+            self.retry_delay_seconds * 2 ** (try_number - 1),
+            self.max_retry_delay_seconds
+        )
+        return delay_seconds * (1 - self.retry_jitter * random.random())
@@ -1,5 +1,11 @@
 class State(object):
+    # Run of a DAG task waiting for its upstream task runs to succeed
+    SCHEDULED = "scheduled"
     QUEUED = "queued"
     RUNNING = "running"
     SUCCESS = "success"
     FAILED = "failed"
+    # Failed run waiting to be tried again
+    UP_FOR_RETRY = "up_for_retry"
+    # Run of a DAG task that is not run because an upstream task run failed
+    UPSTREAM_FAILED = "upstream_failed"
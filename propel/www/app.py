@@ -7,7 +7,7 @@ from flask_admin import BaseView, expose
 from propel import configuration
 
 from propel.models import Connections, TaskGroups, Tasks, TaskRuns, \
-    Heartbeats, Tweets, News, Article
+    Heartbeats, Tweets, News, Article, SerializedDags
 from propel.settings import Session
 from propel.utils.db import provide_session
 from propel.www import forms
@@ -61,6 +61,20 @@ class TaskRunsView(ModelView):
             for column in TaskRuns.__table__.columns._all_columns
         ]
 
+
+class SerializedDagsView(ModelView):
+    # DAGs are read from their serialized form so the webserver never imports DAG files
+    column_list = ['dag_id', 'dag_location', 'tasks', 'updated_at']
+    can_create = False
+    can_edit = False
+
+    def list_tasks(view, context, model, name):
+        # Only DAGs on the page being shown are deserialized
+        return ', '.join(model.dag.get_task_ids())
+
+    column_formatters = dict(tasks=list_tasks)
+
+
 class NewsView(ModelView):
     page_size = 50
     can_export = True
@@ -159,6 +173,7 @@ def create_app():
     admin.add_view(ModelView(Tasks, Session))
     admin.add_view(TaskRunsView(TaskRuns, Session))
     admin.add_view(ModelView(Heartbeats, Session))
+    admin.add_view(SerializedDagsView(SerializedDags, Session, name='DAGs'))
     admin.add_view(TweetsView(Tweets, Session))
     admin.add_view(NewsView(News, Session))
     admin.add_view(ArticlesDeckView(name='ArticlesDeck'))
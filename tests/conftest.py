@@ -0,0 +1,38 @@
+import pytest
+from sqlalchemy import JSON, create_engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.pool import StaticPool
+
+from propel import settings
+from propel.models import Base, Tweets
+
+
+@compiles(JSON, 'sqlite')
+def compile_json_sqlite(element, compiler, **kw):
+    # SQLite has no JSON type. Storing it as serialized text
+    return 'TEXT'
+
+
+@pytest.fixture
+def sqlite_engine():
+    """
+    Points propel's Session at an in-memory SQLite database with every table
+    created. A single connection is shared so all sessions see the same data.
+    """
+    engine = create_engine(
+        'sqlite://',
+        connect_args={'check_same_thread': False},
+        poolclass=StaticPool
+    )
+    # Generic JSON type expects the dialect to provide (de)serializers
+    engine.dialect._json_serializer = None
+    engine.dialect._json_deserializer = None
+    Base.metadata.create_all(engine)
+    settings.Session.remove()
+    settings.Session.configure(bind=engine)
+    # Cached lookups belong to the database of an earlier test
+    Tweets.clear_latest_tweet_ids_cache()
+    yield engine
+    settings.Session.remove()
+    settings.Session.configure(bind=settings.Engine)
+    engine.dispose()
@@ -0,0 +1,81 @@
+from datetime import datetime
+
+from propel.executors.base_executor import BaseExecutor
+from propel.models import TaskRuns
+from propel.settings import Session
+from propel.utils.state import State
+
+
+class FailingTask(object):
+    def __init__(self, task_id):
+        self.task_id = task_id
+
+    def execute(self, task_run_params):
+        raise IOError('Read timed out')
+
+
+class ExecutorMock(BaseExecutor):
+    def __init__(self):
+        self.delayed_task_runs = list()
+
+    def _get_task_class_factory(self, task_run_params):
+        return FailingTask
+
+    def heartbeat(self, thread_function, thread_args=None, **kwargs):
+        thread_function(*thread_args)
+
+    def execute_async_later(self, task_run_params, delay_seconds):
+        self.delayed_task_runs.append((task_run_params, delay_seconds))
+
+
+class TestBaseExecutor(object):
+    def test_execute_retries(self, sqlite_engine):
+        session = Session()
+        session.add(TaskRuns(id=1, task_id=1, state=State.QUEUED, run_ds=datetime(2018, 7, 1)))
+        session.commit()
+        executor = ExecutorMock()
+        task_run_params = {'task_run_id': 1, 'task_name': 'news', 'task_type': 'NewsDownload'}
+
+        # Failed tries are queued again with a growing delay until max_tries is reached
+        assert executor.execute(task_run_params) == State.UP_FOR_RETRY
+        assert executor.execute(executor.delayed_task_runs[-1][0]) == State.UP_FOR_RETRY
+        assert executor.execute(executor.delayed_task_runs[-1][0]) == State.FAILED
+        assert [params['try_number'] for params, _ in executor.delayed_task_runs] == [2, 3]
+        first_delay, second_delay = [
+            delay_seconds
+            for _, delay_seconds in executor.delayed_task_runs
+        ]
+        assert 15 <= first_delay <= 30 and 30 <= second_delay <= 60
+        session.expire_all()
+        task_run = session.query(TaskRuns).get(1)
+        assert (task_run.state, task_run.try_number) == (State.FAILED, 3)
+        assert task_run.next_try_at is not None
+
+    def test_execute_skips_started_tries(self, sqlite_engine):
+        session = Session()
+        session.add(TaskRuns(id=1, task_id=1, state=State.UP_FOR_RETRY, run_ds=datetime(2018, 7, 1),
+                             try_number=2))
+        session.commit()
+        executor = ExecutorMock()
+        task_run_params = {'task_run_id': 1, 'task_name': 'news', 'task_type': 'NewsDownload'}
+
+        # Message of an earlier try is stale
+        assert executor.execute(task_run_params) is None
+        assert executor.execute(dict(task_run_params, try_number=2)) == State.UP_FOR_RETRY
+        # Duplicate message of try 2, e.g. queued by the zombie reaper as well
+        assert executor.execute(dict(task_run_params, try_number=2)) is None
+        assert [params['try_number'] for params, _ in executor.delayed_task_runs] == [3]
+
+    def test_execute_stored_retry_policy(self, sqlite_engine):
+        session = Session()
+        session.add(TaskRuns(id=1, task_id=1, state=State.QUEUED, run_ds=datetime(2018, 7, 1),
+                             max_tries=2, retry_delay_seconds=5, max_retry_delay_seconds=5,
+                             retry_jitter=0))
+        session.commit()
+        executor = ExecutorMock()
+        task_run_params = {'task_run_id': 1, 'task_name': 'news', 'task_type': 'NewsDownload'}
+
+        # Retry policy stored on the task run is used instead of the one of its task type
+        assert executor.execute(task_run_params) == State.UP_FOR_RETRY
+        assert executor.execute(executor.delayed_task_runs[-1][0]) == State.FAILED
+        assert [delay_seconds for _, delay_seconds in executor.delayed_task_runs] == [5]
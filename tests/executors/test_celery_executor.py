@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from propel.executors.celery_executor import CeleryExecutor, execute_celery_task
+from propel.models import TaskRuns
+from propel.settings import Session
+from propel.utils.state import State
+
+
+class FailingTask(object):
+    def __init__(self, task_id):
+        self.task_id = task_id
+
+    def execute(self, task_run_params):
+        raise IOError('Read timed out')
+
+
+class TestCeleryExecutor(object):
+    def test_execute_celery_task_retries(self, sqlite_engine, monkeypatch):
+        session = Session()
+        session.add(TaskRuns(id=1, task_id=1, state=State.QUEUED, run_ds=datetime(2018, 7, 1)))
+        session.commit()
+        monkeypatch.setattr(
+            CeleryExecutor,
+            '_get_task_class_factory',
+            lambda self, task_run_params: FailingTask
+        )
+        monkeypatch.setattr(
+            CeleryExecutor,
+            'heartbeat',
+            lambda self, thread_function, thread_args=None, **kwargs: thread_function(*thread_args)
+        )
+        queued_messages = list()
+        monkeypatch.setattr(
+            execute_celery_task,
+            'apply_async',
+            lambda args, countdown=None: queued_messages.append((args, countdown))
+        )
+        task_run_params = {'task_run_id': 1, 'task_name': 'news', 'task_type': 'NewsDownload'}
+
+        # Failed run is sent back to the broker to run after the retry delay
+        execute_celery_task(task_run_params)
+        (next_task_run_params, ), countdown = queued_messages[0]
+        assert next_task_run_params['try_number'] == 2
+        assert 15 <= countdown <= 30
+        session.expire_all()
+        assert session.query(TaskRuns.state).scalar() == State.UP_FOR_RETRY
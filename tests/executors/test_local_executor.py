@@ -0,0 +1,36 @@
+from propel.executors.local_executor import LocalExecutor
+from propel.utils.state import State
+
+
+class TestLocalExecutor(object):
+    def test_execute_async_batch(self, monkeypatch):
+
+        def execute_mock(self, task_run_params):
+            if task_run_params['task_args'] == 'fail':
+                raise ValueError('Task run failed')
+            return State.SUCCESS
+
+        # Workers are forked so they run the mocked execute
+        monkeypatch.setattr(LocalExecutor, 'execute', execute_mock)
+        executor = LocalExecutor(parallelism=2)
+        executor.execute_async_batch([
+            {'task_run_id': task_run_id, 'task_args': 'fail' if task_run_id == 3 else 'ok'}
+            for task_run_id in range(1, 6)
+        ])
+        finished_task_runs = list()
+        try:
+            while len(finished_task_runs) < 5:
+                events = executor.get_task_run_events().wait(10)
+                assert events
+                finished_task_runs.extend(events)
+        finally:
+            executor.end()
+        assert sorted(finished_task_runs) == [
+            (1, State.SUCCESS),
+            (2, State.SUCCESS),
+            (3, State.FAILED),
+            (4, State.SUCCESS),
+            (5, State.SUCCESS),
+        ]
+        # Nothing is left running
+        assert executor.get_task_run_events().wait(0.01) == []
@@ -0,0 +1,21 @@
+import threading
+
+import pytest
+
+from tests.tasks.helpers import RssFeedHandler, ThreadingHTTPServer
+
+
+@pytest.fixture
+def rss_server_url():
+    """
+    Runs a local RSS feed server and returns its base url. Responses sent are
+    recorded in RssFeedHandler.responses
+    """
+    RssFeedHandler.responses = list()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RssFeedHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,99 @@
+"""
+HTTP and Twitter API stubs shared by the task tests
+"""
+import json
+import time
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+RSS_FEED = """<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0">
+  <channel>
+    <title>Propel</title>
+    <link>http://localhost/{path}</link>
+    <description>Propel test feed</description>
+    <item>
+      <title>First</title>
+      <link>http://localhost/{path}/1</link>
+      <description>First summary</description>
+    </item>
+  </channel>
+</rss>
+"""
+ETAG = '"propel-v1"'
+LAST_MODIFIED = 'Sat, 28 Jul 2018 22:06:12 GMT'
+
+
+class RssFeedHandler(BaseHTTPRequestHandler):
+    """
+    Serves RSS_FEED on any path and answers 304 when the request carries its ETag.
+    /slow/* paths answer after a second and /broken/* paths answer 500
+    """
+    responses = list()
+
+    def do_GET(self):
+        if self.path.startswith('/slow'):
+            time.sleep(1)
+        if self.path.startswith('/broken'):
+            status = 500
+        elif self.headers.get('If-None-Match') == ETAG:
+            status = 304
+        else:
+            status = 200
+        # Recorded before answering so the client never sees the response first
+        self.responses.append((self.path, status))
+        self.send_response(status)
+        if status == 200:
+            self.send_header('Content-Type', 'application/rss+xml')
+            self.send_header('ETag', ETAG)
+            self.send_header('Last-Modified', LAST_MODIFIED)
+        self.end_headers()
+        if status == 200:
+            self.wfile.write(RSS_FEED.format(path=self.path.strip('/')).encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TimelineResponse(object):
+    def __init__(self, tweets, status_code=200, headers=None):
+        self.text = json.dumps(tweets)
+        self.status_code = status_code
+        self.headers = headers or dict()
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeTwitterSession(object):
+    """
+    Serves a user_timeline of tweet ids 1 to timeline_size honouring count,
+    since_id and max_id. Raises after fail_after_requests requests
+    """
+
+    def __init__(self, timeline_size, fail_after_requests=None):
+        self.timeline_size = timeline_size
+        self.fail_after_requests = fail_after_requests
+        self.requests = list()
+
+    def get(self, url, params=None):
+        if len(self.requests) == self.fail_after_requests:
+            raise RuntimeError('Connection reset')
+        self.requests.append(dict(params))
+        max_id = params.get('max_id', self.timeline_size)
+        since_id = params.get('since_id', 0)
+        tweet_ids = range(max_id, since_id, -1)[:params['count']]
+        return TimelineResponse([
+            {
+                'id': tweet_id,
+                'created_at': 'Sat Jul 28 22:06:12 +0000 2018',
+                'full_text': 'Tweet {}'.format(tweet_id),
+                'user': {'id': 1, 'screen_name': params['screen_name']},
+            }
+            for tweet_id in tweet_ids
+        ])
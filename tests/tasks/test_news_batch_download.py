@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from propel.exceptions import PropelException
+from propel.models import FeedValidators, News
+from propel.settings import Session
+from propel.tasks.news_batch_download import NewsBatchDownload
+from tests.tasks.helpers import RssFeedHandler
+
+
+class TestNewsBatchDownload(object):
+
+    def test_execute(self, sqlite_engine, rss_server_url):
+        rss_urls = [rss_server_url + path for path in ('/slow', '/a', '/b')]
+        task = {'task_args': json.dumps({'rss_urls': rss_urls})}
+        NewsBatchDownload(task_id='news').execute(task)
+        # Slow feed does not hold back the other feeds
+        assert RssFeedHandler.responses[-1] == ('/slow', 200)
+        assert Session().query(News).count() == 3
+        assert len(FeedValidators.get_validators_by_url(rss_urls)) == 3
+
+        NewsBatchDownload(task_id='news').execute(task)
+        assert sorted(RssFeedHandler.responses[3:]) == [
+            ('/a', 304), ('/b', 304), ('/slow', 304)
+        ]
+
+    def test_execute_reports_failed_feeds(self, sqlite_engine, rss_server_url):
+        rss_urls = [rss_server_url + path for path in ('/a', '/broken')]
+        task = {'task_args': json.dumps({'rss_urls': rss_urls})}
+        with pytest.raises(PropelException, match='1 of 2 feeds failed: .*/broken'):
+            NewsBatchDownload(task_id='news').execute(task)
+        assert [url for url, in Session().query(News.url)] == ['http://localhost/a/1']
+
+    def test_download_feeds_does_not_block_on_busy_host(self, rss_server_url, monkeypatch):
+        from propel import configuration
+        config_get = configuration.get
+        settings = {'max_concurrent_feeds': '2', 'max_connections_per_host': '1'}
+        monkeypatch.setattr(
+            'propel.configuration.get',
+            lambda section, key: settings.get(key) or config_get(section, key)
+        )
+        rss_urls = [rss_server_url + path for path in ('/slow1', '/slow2', '/slow3')]
+        # Same server under another host name
+        rss_urls.append(rss_server_url.replace('127.0.0.1', 'localhost') + '/a')
+        results = list(NewsBatchDownload(task_id='news')._download_feeds(rss_urls, dict()))
+        # The free thread picks up the feed of the idle host instead of
+        # waiting for a connection to the busy one
+        assert RssFeedHandler.responses[0] == ('/a', 200)
+        assert sorted(rss_url for rss_url, _, exception in results if exception is None) == \
+            sorted(rss_urls)
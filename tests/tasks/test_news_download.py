@@ -0,0 +1,23 @@
+import json
+
+from propel.models import FeedValidators, News
+from propel.tasks.news_download import NewsDownload
+from tests.tasks.helpers import ETAG, LAST_MODIFIED, RssFeedHandler
+
+
+class TestNewsDownload(object):
+
+    def test_execute_skips_not_modified_feed(self, sqlite_engine, rss_server_url, monkeypatch):
+        loaded_feeds = list()
+        monkeypatch.setattr(News, 'load_into_db', loaded_feeds.append)
+        rss_url = rss_server_url + '/rss'
+        task = {'task_args': json.dumps({'rss_url': rss_url})}
+
+        NewsDownload(task_id='news').execute(task)
+        assert FeedValidators.get_validators(rss_url) == (ETAG, LAST_MODIFIED)
+        assert len(loaded_feeds) == 1
+        assert loaded_feeds[0].entries[0].title == 'First'
+
+        NewsDownload(task_id='news').execute(task)
+        assert RssFeedHandler.responses == [('/rss', 200), ('/rss', 304)]
+        assert len(loaded_feeds) == 1
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from propel.exceptions import PropelException
+from propel.models import Tweets
+from propel.settings import Session
+from propel.tasks.twitter_batch_extract import TwitterBatchExtract
+from tests.tasks.helpers import FakeTwitterSession
+
+
+class UsersTwitterSession(FakeTwitterSession):
+    """
+    Serves a timeline per user with tweet ids offset by the user's position.
+    Requests for a user named broken raise
+    """
+
+    def __init__(self, screen_names, timeline_size):
+        super(UsersTwitterSession, self).__init__(timeline_size)
+        self.screen_names = screen_names
+
+    def get(self, url, params=None):
+        if params['screen_name'] == 'broken':
+            raise RuntimeError('Not authorized')
+        offset = 1000 * self.screen_names.index(params['screen_name'])
+        params = dict(params)
+        for id_param in ('since_id', 'max_id'):
+            if id_param in params:
+                params[id_param] = max(params[id_param] - offset, 0)
+        response = super(UsersTwitterSession, self).get(url, params)
+        tweets = json.loads(response.text)
+        for tweet in tweets:
+            tweet['id'] += offset
+        response.text = json.dumps(tweets)
+        return response
+
+
+class TestTwitterBatchExtract(object):
+
+    def test_extract_timelines(self, sqlite_engine):
+        screen_names = ['propel', 'broken', 'celery']
+        twitter_session = UsersTwitterSession(screen_names, 250)
+        user_results = TwitterBatchExtract(task_id='twitter').extract_timelines(
+            twitter_session,
+            screen_names
+        )
+        assert user_results['propel'] == 250
+        assert user_results['celery'] == 250
+        assert isinstance(user_results['broken'], RuntimeError)
+        assert Session().query(Tweets).count() == 500
+
+    def test_execute_reports_failed_users(self, sqlite_engine, monkeypatch):
+        screen_names = ['propel', 'broken']
+        monkeypatch.setattr(
+            TwitterBatchExtract,
+            '_get_twitter_session',
+            lambda self, pool_size=1: UsersTwitterSession(screen_names, 10)
+        )
+        task = {'task_args': json.dumps(screen_names)}
+        with pytest.raises(PropelException) as e:
+            TwitterBatchExtract(task_id='twitter').execute(task)
+        assert '1 of 2 users failed: broken' in str(e.value)
+        assert Session().query(Tweets).count() == 10
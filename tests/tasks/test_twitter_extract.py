@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pytest
+
+from propel.exceptions import PropelException
+from propel.models import TimelineCursors, Tweets
+from propel.settings import Session
+from propel.tasks.twitter_extract import TwitterExtract, RateLimiter, RateLimitedSession
+from tests.tasks.helpers import FakeTwitterSession, TimelineResponse
+
+
+class TestTwitterExtract(object):
+
+    def stored_tweet_ids(self):
+        return sorted(tweet_id for tweet_id, in Session().query(Tweets.tweet_id))
+
+    def test_extract_timeline(self, sqlite_engine):
+        twitter_extract = TwitterExtract(task_id='twitter')
+        assert twitter_extract.extract_timeline(FakeTwitterSession(450), 'propel') == 450
+        assert self.stored_tweet_ids() == list(range(1, 451))
+        cursor = Session().query(TimelineCursors).get('propel')
+        assert (cursor.since_id, cursor.max_id, cursor.newest_id) == (450, None, None)
+
+        # Only newer tweets are requested by the next extract
+        twitter_session = FakeTwitterSession(460)
+        assert twitter_extract.extract_timeline(twitter_session, 'propel') == 10
+        assert twitter_session.requests[0]['since_id'] == 450
+
+    def test_extract_timeline_resumes(self, sqlite_engine):
+        twitter_extract = TwitterExtract(task_id='twitter')
+        # Fails fetching the third page. First two pages are committed
+        with pytest.raises(RuntimeError):
+            twitter_extract.extract_timeline(FakeTwitterSession(450, 2), 'propel')
+        assert self.stored_tweet_ids() == list(range(51, 451))
+        cursor = Session().query(TimelineCursors).get('propel')
+        assert (cursor.since_id, cursor.max_id, cursor.newest_id) == (None, 50, 450)
+
+        twitter_session = FakeTwitterSession(470)
+        assert twitter_extract.extract_timeline(twitter_session, 'propel') == 50
+        assert twitter_session.requests[0]['max_id'] == 50
+        assert self.stored_tweet_ids() == list(range(1, 451))
+        # Tweets posted during the outage are picked up by the next extract
+        assert twitter_extract.extract_timeline(twitter_session, 'propel') == 20
+        assert self.stored_tweet_ids() == list(range(1, 471))
+
+    def test_extract_timeline_caches_committed_tweets(self, sqlite_engine, monkeypatch):
+        twitter_extract = TwitterExtract(task_id='twitter')
+        twitter_extract.extract_timeline(FakeTwitterSession(50), 'propel')
+        assert Tweets.latest_tweet_id_for_user('Propel', use_cache=True) == 50
+
+        def fail_commit(session):
+            raise RuntimeError('Lost connection')
+
+        monkeypatch.setattr('sqlalchemy.orm.session.Session.commit', fail_commit)
+        with pytest.raises(RuntimeError):
+            twitter_extract.extract_timeline(FakeTwitterSession(60), 'propel')
+        monkeypatch.undo()
+        # Rolled back tweets are not cached
+        assert Tweets.latest_tweet_id_for_user('Propel', use_cache=True) == 50
+
+
+class TestRateLimiter(object):
+
+    def test_budget_from_headers(self):
+        rate_limiter = RateLimiter()
+        # Budget is unknown until the first response
+        rate_limiter.acquire()
+        reset_at = str(int(time.time() + 900))
+        rate_limiter.update({'x-rate-limit-remaining': '2', 'x-rate-limit-reset': reset_at})
+        # Stale budget reported by a request that was in flight is ignored
+        rate_limiter.update({'x-rate-limit-remaining': '5', 'x-rate-limit-reset': reset_at})
+        assert rate_limiter.remaining == 2
+        rate_limiter.acquire()
+        rate_limiter.acquire()
+        assert rate_limiter.remaining == 0
+
+    def test_single_request_while_budget_unknown(self):
+        rate_limiter = RateLimiter()
+        rate_limiter.acquire()
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: (rate_limiter.acquire(), acquired.set()))
+        thread.daemon = True
+        thread.start()
+        # Second request waits for the response of the first one
+        assert not acquired.wait(0.2)
+        reset_at = str(int(time.time() + 900))
+        rate_limiter.update({'x-rate-limit-remaining': '5', 'x-rate-limit-reset': reset_at})
+        assert acquired.wait(5)
+        assert rate_limiter.remaining == 4
+
+    def test_retries_too_many_requests(self, monkeypatch):
+        # Window has already reset. Request is sent again after a backoff
+        monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+        reset_headers = {'x-rate-limit-remaining': '0', 'x-rate-limit-reset': str(int(time.time()))}
+
+        class ThrottledSession(object):
+            responses = [
+                TimelineResponse([], 429, reset_headers),
+                TimelineResponse([{'id': 1}]),
+            ]
+
+            def get(self, url, params=None):
+                return self.responses.pop(0)
+
+        rate_limited_session = RateLimitedSession(ThrottledSession(), RateLimiter())
+        response = rate_limited_session.get('https://api.twitter.com', params={})
+        assert response.status_code == 200
+        assert not ThrottledSession.responses
+
+    def test_backs_off_without_reset_time(self, monkeypatch):
+        sleeps = list()
+        monkeypatch.setattr(time, 'sleep', sleeps.append)
+
+        class ThrottledSession(object):
+            requests = 0
+
+            def get(self, url, params=None):
+                self.requests += 1
+                return TimelineResponse([], 429)
+
+        throttled_session = ThrottledSession()
+        rate_limited_session = RateLimitedSession(throttled_session, RateLimiter())
+        with pytest.raises(PropelException):
+            rate_limited_session.get('https://api.twitter.com', params={})
+        assert throttled_session.requests == RateLimitedSession.max_attempts
+        assert sleeps == [15, 30, 60, 120]
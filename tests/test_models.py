@@ -0,0 +1,354 @@
+import json
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+from propel.exceptions import PropelException
+from propel.models import (BaseTask, DAG, DagBag, Heartbeats, SerializedDagBag, SerializedDags,
+                           News, TaskRuns, Tweets)
+from propel.settings import Session
+from propel.utils.state import State
+
+
+class TestTweets(object):
+
+    @pytest.fixture
+    def quoted_tweet_json(self):
+        return {
+            'id': 2,
+            'created_at': 'Sat Jul 28 22:06:12 +0000 2018',
+            'full_text': 'Look at this',
+            'favorite_count': 3,
+            'retweet_count': 0,
+            'entities': {'urls': [{'expanded_url': 'https://example.com'}]},
+            'user': {'id': 10, 'screen_name': 'propel'},
+            'in_reply_to_status_id': None,
+            'quoted_status': {
+                'id': 1,
+                'created_at': 'Fri Jul 27 10:00:00 +0000 2018',
+                'full_text': 'Original',
+                'extended_entities': {
+                    'media': [
+                        {'type': 'photo', 'media_url': 'http://pbs.twimg.com/1.jpg'},
+                        {'type': 'photo', 'media_url': 'http://pbs.twimg.com/2.jpg'},
+                    ]
+                },
+                'user': {'id': 11, 'screen_name': 'quoted'},
+            },
+        }
+
+    def test_flatten(self, quoted_tweet_json):
+        tweet_dict = Tweets.flatten(quoted_tweet_json)
+        assert tweet_dict['tweet_id'] == 2
+        assert tweet_dict['tweet_type'] == 'Quoted Tweet'
+        assert tweet_dict['tweet_created_at'] == datetime(2018, 7, 28, 22, 6, 12)
+        assert tweet_dict['text'] == 'Look at this'
+        assert tweet_dict['expanded_urls'] == 'https://example.com'
+        assert tweet_dict['media_urls'] is None
+        assert tweet_dict['user_screen_name'] == 'propel'
+        assert tweet_dict['quoted_tweet_id'] == 1
+        assert tweet_dict['quoted_created_at'] == datetime(2018, 7, 27, 10, 0, 0)
+        assert tweet_dict['quoted_text'] == 'Original'
+        assert tweet_dict['quoted_media_urls'] == [
+            'http://pbs.twimg.com/1.jpg',
+            'http://pbs.twimg.com/2.jpg'
+        ]
+        assert tweet_dict['quoted_media_types'] == ['photo', 'photo']
+        assert tweet_dict['quoted_user_id'] == 11
+        assert tweet_dict['retweet_tweet_id'] is None
+        assert tweet_dict['retweet_created_at'] is None
+        assert tweet_dict['raw_tweet'] is quoted_tweet_json
+        assert set(tweet_dict) == set(
+            column.name
+            for column in Tweets.__table__.columns
+            if column.name not in ('created_at', 'updated_at')
+        )
+
+    def test_load_into_db(self, sqlite_engine, quoted_tweet_json):
+        Tweets.load_into_db([quoted_tweet_json])
+        tweet = Session().query(Tweets).one()
+        assert tweet.tweet_id == 2
+        assert tweet.quoted_text == 'Original'
+        assert tweet.raw_tweet == quoted_tweet_json
+        assert tweet.created_at is not None
+
+    def test_latest_tweet_ids_for_users(self, sqlite_engine, quoted_tweet_json):
+        Tweets.load_into_db([
+            dict(quoted_tweet_json, id=tweet_id, user={'id': 10, 'screen_name': screen_name})
+            for tweet_id, screen_name in [(3, 'propel'), (5, 'propel'), (4, 'celery')]
+        ])
+        assert Tweets.latest_tweet_ids_for_users(['propel', 'celery', 'unknown']) == {
+            'propel': 5,
+            'celery': 4,
+            'unknown': None
+        }
+        # Committed loads move cached ids forward. Stored tweets are only read for new users
+        # Screen names are matched regardless of case
+        Tweets.cache_latest_tweet_ids(Tweets.load_into_db([
+            dict(quoted_tweet_json, id=8, user={'id': 10, 'screen_name': 'PROPEL'})
+        ]))
+        Session().query(Tweets).filter(Tweets.tweet_id == 4).delete()
+        assert Tweets.latest_tweet_ids_for_users(['Propel', 'celery'], use_cache=True) == {
+            'Propel': 8,
+            'celery': 4
+        }
+        assert Tweets.latest_tweet_id_for_user('celery') is None
+
+    def test_bulk_load_files(self, sqlite_engine, quoted_tweet_json, tmpdir):
+        tweets_file = tmpdir.join('tweets.json')
+        lines = list()
+        for tweet_id in range(1, 8):
+            tweet_json = dict(quoted_tweet_json, id=tweet_id)
+            lines.append(json.dumps(tweet_json))
+        # Chunk of tweet 3 and the malformed line fails
+        lines.insert(3, '{not json')
+        tweets_file.write('\n'.join(lines) + '\n')
+        loaded_tweets, failed_chunks = Tweets.bulk_load_files(
+            [tweets_file.strpath],
+            chunk_size=2,
+            processes=2
+        )
+        assert (loaded_tweets, failed_chunks) == (6, 1)
+        tweet_ids = [tweet_id for tweet_id, in Session().query(Tweets.tweet_id)]
+        assert sorted(tweet_ids) == [1, 2, 4, 5, 6, 7]
+
+        # Loading the same file again updates the stored tweets
+        Tweets.bulk_load_files([tweets_file.strpath], chunk_size=2, processes=2)
+        assert Session().query(Tweets).count() == 6
+
+
+class TestNews(object):
+
+    @pytest.fixture
+    def news_feed_dict(self):
+        return {
+            'feed': {'link': 'https://example.com'},
+            'entries': [
+                {
+                    'link': 'https://example.com/1',
+                    'title': 'First',
+                    'summary': 'First summary',
+                    'published_parsed': (2018, 7, 28, 22, 6, 12, 5, 209, 0),
+                },
+                {
+                    'link': 'https://example.com/2',
+                    'title': 'Second',
+                    'summary': 'Second summary',
+                },
+            ]
+        }
+
+    def test_load_into_db_skips_unchanged_news(self, sqlite_engine, news_feed_dict):
+        assert News.load_into_db(news_feed_dict) == 2
+        assert News.load_into_db(news_feed_dict) == 0
+        news_feed_dict['entries'][1]['title'] = 'Second updated'
+        assert News.load_into_db(news_feed_dict) == 1
+        titles = [title for title, in Session().query(News.title).order_by(News.url)]
+        assert titles == ['First', 'Second updated']
+
+    def test_load_into_db_without_feed_link(self, news_feed_dict):
+        del news_feed_dict['feed']['link']
+        with pytest.raises(PropelException):
+            News.load_into_db(news_feed_dict, session=None)
+
+
+DAG_FILE = """
+from datetime import datetime
+from propel.models import DAG, BaseTask
+
+dag = DAG('{dag_id}', 'Test DAG', True, datetime(2018, 1, 1), 3600)
+extract = BaseTask(task_id='extract', params={{'count': 200}}, dag=dag)
+load = BaseTask(task_id='load', dag=dag)
+dag.add_downstream(extract, load)
+"""
+
+
+class TestDagBag(object):
+
+    def test_parse_dags(self, tmpdir):
+        dag_file = tmpdir.mkdir('news').join('dag_a.py')
+        dag_file.write(DAG_FILE.format(dag_id='dag_a'))
+        tmpdir.join('helpers.py').write('HELPER = 1\n')
+        dag_bag = DagBag(dags_location=tmpdir.strpath)
+        assert sorted(dag_bag.parse_dags()) == [tmpdir.join('helpers.py').strpath, dag_file.strpath]
+        assert [dag.dag_id for dag in dag_bag.dags] == ['dag_a']
+        assert dag_bag.dags[0].dag_location == dag_file.strpath
+        assert set(dag_bag.file_parse_seconds) == {
+            tmpdir.join('helpers.py').strpath,
+            dag_file.strpath
+        }
+
+        # Unchanged and touched files are not parsed again
+        assert dag_bag.parse_dags() == []
+        dag_file.setmtime(dag_file.mtime() + 10)
+        assert dag_bag.parse_dags() == []
+
+        # Changed files are reloaded
+        dag_file.write(DAG_FILE.format(dag_id='dag_b'))
+        dag_file.setmtime(dag_file.mtime() + 20)
+        assert dag_bag.parse_dags() == [dag_file.strpath]
+        assert [dag.dag_id for dag in dag_bag.dags] == ['dag_b']
+
+        # DAGs of deleted files are dropped
+        dag_file.remove()
+        assert dag_bag.parse_dags() == []
+        assert dag_bag.dags == []
+        assert dag_file.strpath not in dag_bag.manifest
+
+    def test_parse_dags_keeps_dags_of_broken_files(self, tmpdir):
+        dag_file = tmpdir.join('dag_a.py')
+        dag_file.write(DAG_FILE.format(dag_id='dag_a'))
+        dag_bag = DagBag(dags_location=tmpdir.strpath, parse_processes=0)
+        dag_bag.parse_dags()
+
+        dag_file.write(DAG_FILE.format(dag_id='dag_b') + 'DAG = 1 / 0\n')
+        dag_file.setmtime(dag_file.mtime() + 10)
+        assert dag_bag.parse_dags() == [dag_file.strpath]
+        assert [dag.dag_id for dag in dag_bag.dags] == ['dag_a']
+        assert dag_file.strpath in dag_bag.file_errors
+        # Broken files are parsed again until they parse without error
+        assert dag_bag.parse_dags() == [dag_file.strpath]
+
+        dag_file.write(DAG_FILE.format(dag_id='dag_b'))
+        dag_file.setmtime(dag_file.mtime() + 10)
+        assert dag_bag.parse_dags() == [dag_file.strpath]
+        assert [dag.dag_id for dag in dag_bag.dags] == ['dag_b']
+        assert dag_bag.file_errors == {}
+        assert dag_bag.parse_dags() == []
+
+    def test_parse_dags_keeps_modules_of_same_name(self, tmpdir):
+        tmpdir.join('json.py').write(DAG_FILE.format(dag_id='dag_a'))
+        dag_bag = DagBag(dags_location=tmpdir.strpath, parse_processes=0)
+        dag_bag.parse_dags()
+        assert [dag.dag_id for dag in dag_bag.dags] == ['dag_a']
+        assert sys.modules['json'] is json
+        assert 'propel_dags.json' in sys.modules
+
+        # Only modules imported by the DagBag are removed with their file
+        tmpdir.join('json.py').remove()
+        dag_bag.parse_dags()
+        assert sys.modules['json'] is json
+        assert 'propel_dags.json' not in sys.modules
+
+    def test_parse_dags_in_processes(self, tmpdir):
+        tmpdir.join('dag_a.py').write(DAG_FILE.format(dag_id='dag_a'))
+        tmpdir.join('hanging_dag.py').write('import time\nDAG = time.sleep(60)\n')
+        tmpdir.join('crashing_dag.py').write('import os\nDAG = os._exit(1)\n')
+        tmpdir.join('broken_dag.py').write('DAG = 1 / 0\n')
+        dag_bag = DagBag(dags_location=tmpdir.strpath, parse_processes=4, parse_timeout_seconds=1)
+        dag_bag.parse_dags()
+
+        # Hanging and crashing files do not stop other files from being parsed
+        dag, = dag_bag.dags
+        assert dag.serialize() == {
+            'dag_id': 'dag_a',
+            'description': 'Test DAG',
+            'is_scheduled': True,
+            'start_date': '2018-01-01T00:00:00',
+            'interval': 3600,
+            'dag_location': tmpdir.join('dag_a.py').strpath,
+            'tasks': [
+                {'task_id': 'extract', 'task_type': 'BaseTask', 'params': {'count': 200}},
+                {'task_id': 'load', 'task_type': 'BaseTask', 'params': {}},
+            ],
+            'edges': [['extract', 'load']],
+        }
+        assert [task.task_id for task in dag.get_downstream_tasks('extract')] == ['load']
+        assert dag_bag.file_errors == {
+            tmpdir.join('hanging_dag.py').strpath: 'Timed out after 1 seconds',
+            tmpdir.join('crashing_dag.py').strpath: 'Parsing process exited with code 1',
+            tmpdir.join('broken_dag.py').strpath: (
+                'ZeroDivisionError: integer division or modulo by zero'
+            ),
+        }
+
+    def test_sync_to_db(self, sqlite_engine, tmpdir):
+        tmpdir.join('dag_a.py').write(DAG_FILE.format(dag_id='dag_a'))
+        tmpdir.join('dag_b.py').write(DAG_FILE.format(dag_id='dag_b'))
+        dag_bag = DagBag(dags_location=tmpdir.strpath, parse_processes=2)
+        dag_bag.parse_dags()
+        assert dag_bag.sync_to_db() == 2
+        serialized_dag_bag = SerializedDagBag()
+        assert serialized_dag_bag.refresh() == ['dag_a', 'dag_b']
+        dag = serialized_dag_bag.get_dag('dag_a')
+        assert dag.serialize() == dag_bag.file_dags[tmpdir.join('dag_a.py').strpath][0].serialize()
+
+        # Unchanged DAGs are neither written nor read again
+        assert dag_bag.sync_to_db() == 0
+        assert serialized_dag_bag.refresh() == []
+        assert serialized_dag_bag.get_dag('dag_a') is dag
+
+        tmpdir.join('dag_a.py').write(DAG_FILE.format(dag_id='dag_a').replace('3600', '60'))
+        tmpdir.join('dag_a.py').setmtime(tmpdir.join('dag_a.py').mtime() + 10)
+        tmpdir.join('dag_b.py').remove()
+        dag_bag.parse_dags()
+        assert dag_bag.sync_to_db() == 1
+        assert serialized_dag_bag.refresh() == ['dag_a']
+        assert serialized_dag_bag.dag_ids == ['dag_a']
+        assert serialized_dag_bag.get_dag('dag_a').interval == 60
+        assert SerializedDags.get_dag_hashes().keys() == ['dag_a']
+
+    def test_sync_to_db_keeps_dags_of_broken_files(self, sqlite_engine, tmpdir):
+        tmpdir.join('dag_a.py').write(DAG_FILE.format(dag_id='dag_a'))
+        tmpdir.join('dag_b.py').write(DAG_FILE.format(dag_id='dag_b'))
+        dag_bag = DagBag(dags_location=tmpdir.strpath, parse_processes=0)
+        dag_bag.parse_dags()
+        dag_bag.sync_to_db()
+
+        # A restarted DagBag has no DAGs of a file that fails on its first parse
+        tmpdir.join('dag_b.py').write(DAG_FILE.format(dag_id='dag_b') + 'DAG = 1 / 0\n')
+        dag_bag = DagBag(dags_location=tmpdir.strpath, parse_processes=0)
+        dag_bag.parse_dags()
+        assert [dag.dag_id for dag in dag_bag.dags] == ['dag_a']
+        dag_bag.sync_to_db()
+        assert sorted(SerializedDags.get_dag_hashes()) == ['dag_a', 'dag_b']
+
+        tmpdir.join('dag_b.py').remove()
+        dag_bag.parse_dags()
+        dag_bag.sync_to_db()
+        assert sorted(SerializedDags.get_dag_hashes()) == ['dag_a']
+
+
+class TestDAG(object):
+
+    def test_graph_lookups(self):
+        dag = DAG('dag', 'Test DAG', True, datetime(2018, 1, 1), 3600)
+        extract, transform, load = [
+            BaseTask(task_id=task_id, dag=dag)
+            for task_id in ('extract', 'transform', 'load')
+        ]
+        dag.add_downstream(transform, load)
+        assert dag.get_task('transform') is transform
+        assert dag.is_task_id_in_dag('missing') == (False, None)
+        assert sorted(dag.get_task_ids()) == ['extract', 'load', 'transform']
+        assert dag.get_upstream_tasks('load') == {transform}
+
+        # Caches are invalidated when the DAG changes
+        dag.add_upstream(transform, extract)
+        assert dag.get_topological_order() == [extract, transform, load]
+        assert dag.get_upstream_tasks('load') == {extract, transform}
+        assert dag.get_downstream_tasks('extract') == {transform, load}
+        assert dag.get_direct_upstream_tasks('load') == [transform]
+        with pytest.raises(PropelException):
+            BaseTask(task_id='load', dag=dag)
+
+
+class TestHeartbeats(object):
+    def test_get_stale_task_run_ids(self, sqlite_engine):
+        session = Session()
+        long_ago = datetime.utcnow() - timedelta(minutes=10)
+        for task_run_id, state in [(1, State.RUNNING), (2, State.RUNNING), (3, State.SUCCESS)]:
+            session.add(TaskRuns(id=task_run_id, task_id=task_run_id, state=state, run_ds=long_ago,
+                                 updated_at=long_ago))
+            session.add(Heartbeats(id=task_run_id, task_run_id=task_run_id,
+                                   task_type='BaseExecutor', last_heartbeat_time=long_ago))
+        # Worker of task run 4 died before its first heartbeat. Task run 5 just started
+        session.add(TaskRuns(id=4, task_id=4, state=State.RUNNING, run_ds=long_ago,
+                             updated_at=long_ago))
+        session.add(TaskRuns(id=5, task_id=5, state=State.RUNNING, run_ds=long_ago))
+        session.commit()
+        assert Heartbeats.get_stale_task_run_ids(60) == [1, 2, 4]
+        # Runs whose heartbeat was updated are not stale. Finished runs never are
+        Heartbeats.touch([2])
+        assert Heartbeats.get_stale_task_run_ids(60) == [1, 4]
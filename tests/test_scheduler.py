@@ -1,5 +1,13 @@
 from datetime import datetime, timedelta
-from propel.scheduler import Scheduler
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from propel.models import (DAG, DagRuns, Heartbeats, SchedulerLeases, SerializedDagBag,
+                           SerializedTask, Tasks, TaskRuns, TaskRunDependencies)
+from propel.scheduler import BackfillPlanner, DagRunScheduler, Scheduler, ZombieReaper
+from propel.settings import Session
+from propel.utils.state import State
 
 
 class TasksMock(object):
@@ -8,9 +16,18 @@ class TasksMock(object):
         self.task_name = task_name
         self.schedule_latest = schedule_latest
         self.run_frequency_seconds = run_frequency_seconds
+        self.task_type = 'NewsDownload'
 
     def as_dict(self):
-        return self.__dict__
+        return dict(self.__dict__)
+
+
+class ExecutorMock(object):
+    def __init__(self):
+        self.batches = list()
+
+    def execute_async_batch(self, task_runs_params):
+        self.batches.append(task_runs_params)
 
 
 class TestScheduler(object):
@@ -37,8 +54,15 @@ class TestScheduler(object):
         scheduler = Scheduler()
         monkeypatch.setattr(scheduler, '_get_tasks', _get_tasks_mock)
         monkeypatch.setattr(scheduler, '_get_last_task_runs', _get_last_task_runs_mock)
+        # Task 2 catches up one run at a time
+        scheduler._backfill_planner = BackfillPlanner(max_active_runs_per_task=1)
+        monkeypatch.setattr(
+            scheduler._backfill_planner,
+            'get_active_run_counts',
+            lambda task_ids: {}
+        )
 
-        mocked_current_datetime=datetime(2018, 7, 28, 0, 0, 0)
+        mocked_current_datetime = datetime(2018, 7, 28, 0, 0, 0)
         returned_eligible_tasks_to_run = scheduler._get_eligible_tasks_to_run(
             current_datetime=mocked_current_datetime
         )
@@ -46,6 +70,7 @@ class TestScheduler(object):
             {
                 'id': 1,
                 'task_name': 'task1',
+                'task_type': 'NewsDownload',
                 'schedule_latest': True,
                 'run_frequency_seconds': 60,
                 'run_ds': mocked_current_datetime,
@@ -55,6 +80,7 @@ class TestScheduler(object):
             {
                 'id': 2,
                 'task_name': 'task2',
+                'task_type': 'NewsDownload',
                 'schedule_latest': False,
                 'run_frequency_seconds': 60,
                 'run_ds': datetime(2018, 6, 28, 0, 0, 0)+timedelta(seconds=60),
@@ -64,6 +90,7 @@ class TestScheduler(object):
             {
                 'id': 3,
                 'task_name': 'task3',
+                'task_type': 'NewsDownload',
                 'schedule_latest': True,
                 'run_frequency_seconds': 60,
                 'run_ds': mocked_current_datetime,
@@ -75,3 +102,385 @@ class TestScheduler(object):
                 sorted(returned_eligible_tasks_to_run, key=lambda x: x['id'])
                 == sorted(expected_eligible_tasks_to_run, key=lambda x: x['id'])
         )
+
+    def test__get_last_task_runs(self, sqlite_engine):
+        session = Session()
+        for task_id in (1, 2, 3):
+            session.add(Tasks(
+                id=task_id,
+                task_name='task{}'.format(task_id),
+                task_type='NewsDownload',
+                task_args='https://example.com/rss',
+                run_frequency_seconds=60
+            ))
+        for task_id, run_ds in [
+            (1, datetime(2018, 7, 27)),
+            (1, datetime(2018, 7, 28)),
+            (2, datetime(2018, 7, 26)),
+        ]:
+            session.add(TaskRuns(task_id=task_id, state=State.SUCCESS, run_ds=run_ds))
+        session.commit()
+
+        scheduler = Scheduler()
+        expected_last_task_runs = {1: datetime(2018, 7, 28), 2: datetime(2018, 7, 26)}
+        assert scheduler._get_last_task_runs() == expected_last_task_runs
+
+        # Runs inserted by the scheduler are tracked without reading the DB again
+        session.add(TaskRuns(task_id=3, state=State.SUCCESS, run_ds=datetime(2018, 7, 20)))
+        session.commit()
+        scheduler._set_last_task_run(2, datetime(2018, 7, 27))
+        expected_last_task_runs[2] = datetime(2018, 7, 27)
+        assert scheduler._get_last_task_runs() == expected_last_task_runs
+
+        # Reconciling picks up runs inserted elsewhere
+        scheduler._last_reconciled_at -= 300
+        assert scheduler._get_last_task_runs() == {
+            1: datetime(2018, 7, 28),
+            2: datetime(2018, 7, 26),
+            3: datetime(2018, 7, 20),
+        }
+
+    def test__get_eligible_tasks_to_run_pops_due_tasks(self, monkeypatch):
+        tasks = [TasksMock(1, 'task1', False, 60), TasksMock(2, 'task2', False, 3600)]
+        last_task_runs = {
+            1: datetime(2018, 7, 27, 23, 55, 0),
+            2: datetime(2018, 7, 27, 23, 30, 0),
+        }
+        active_run_counts = {1: 1}
+        scheduler = Scheduler()
+        scheduler._backfill_planner = BackfillPlanner(max_active_runs_per_task=4)
+        monkeypatch.setattr(scheduler, '_get_tasks', lambda: tasks)
+        monkeypatch.setattr(scheduler, '_get_last_task_runs', lambda: last_task_runs)
+        monkeypatch.setattr(
+            scheduler._backfill_planner,
+            'get_active_run_counts',
+            lambda task_ids: active_run_counts
+        )
+
+        current_datetime = datetime(2018, 7, 28, 0, 0, 0)
+        # Task 1 is five runs behind and has one active run. Three runs fit
+        eligible_tasks_to_run = scheduler._get_eligible_tasks_to_run(current_datetime)
+        assert [task['run_ds'] for task in eligible_tasks_to_run] == [
+            datetime(2018, 7, 27, 23, 56, 0),
+            datetime(2018, 7, 27, 23, 57, 0),
+            datetime(2018, 7, 27, 23, 58, 0),
+        ]
+        assert eligible_tasks_to_run[0]['interval_start_ds'] == datetime(2018, 7, 27, 23, 55, 0)
+        last_task_runs[1] = datetime(2018, 7, 27, 23, 58, 0)
+        # No free run slots. Task 1 is checked again later
+        active_run_counts[1] = 4
+        assert scheduler._get_eligible_tasks_to_run(current_datetime) == []
+        assert scheduler._get_sleep_seconds(current_datetime, 300) == BackfillPlanner.retry_seconds
+        active_run_counts[1] = 0
+        current_datetime += timedelta(seconds=BackfillPlanner.retry_seconds)
+        tasks_to_run = scheduler._get_eligible_tasks_to_run(current_datetime)
+        assert [task['run_ds'] for task in tasks_to_run] == [
+            datetime(2018, 7, 27, 23, 59, 0),
+            datetime(2018, 7, 28, 0, 0, 0),
+        ]
+        last_task_runs[1] = datetime(2018, 7, 28, 0, 0, 0)
+        assert scheduler._get_eligible_tasks_to_run(current_datetime) == []
+        # Sleeps until task 1 is next due
+        assert scheduler._get_sleep_seconds(current_datetime, 300) == 30
+        assert scheduler._get_sleep_seconds(current_datetime, 10) == 10
+
+    def test__schedule_due_tasks(self, sqlite_engine, monkeypatch):
+        tasks = [TasksMock(task_id, 'task{}'.format(task_id), False, 60) for task_id in (1, 2, 3)]
+        scheduler = Scheduler()
+        monkeypatch.setattr(scheduler, '_get_tasks', lambda: tasks)
+        session = Session()
+        # An earlier run of task 2 is not mistaken for the inserted one
+        session.add(TaskRuns(task_id=2, state=State.FAILED, run_ds=datetime(2018, 7, 27)))
+        session.commit()
+
+        executor = ExecutorMock()
+        scheduler._schedule_due_tasks(executor, datetime(2018, 7, 28, 0, 0, 30))
+        assert len(executor.batches) == 1
+        task_runs = {
+            task_run.id: task_run
+            for task_run in Session().query(TaskRuns).filter(TaskRuns.state == State.QUEUED)
+        }
+        assert len(task_runs) == 3
+        for task_run_params in executor.batches[0]:
+            task_run = task_runs[task_run_params['task_run_id']]
+            assert task_run.task_id == task_run_params['id']
+            assert task_run.run_ds == datetime(2018, 7, 28)
+        assert scheduler._get_last_task_runs() == {
+            task_id: datetime(2018, 7, 28) for task_id in (1, 2, 3)
+        }
+
+    def test_scheduler_lease(self, sqlite_engine):
+        assert SchedulerLeases.acquire('scheduler-a', 60)
+        assert not SchedulerLeases.acquire('scheduler-b', 60)
+        assert SchedulerLeases.acquire('scheduler-a', 60)
+
+        task_run_params = {'id': 1, 'task_type': 'NewsDownload', 'run_ds': datetime(2018, 7, 28)}
+        assert Scheduler._insert_new_task_runs_to_db(
+            [task_run_params],
+            lease_holder='scheduler-a',
+            lease_seconds=60
+        ) == [1]
+        # Two schedulers can not create the same run
+        with pytest.raises(IntegrityError):
+            Scheduler._insert_new_task_runs_to_db([task_run_params])
+        Session.remove()
+
+        # Scheduler b takes over once scheduler a stops renewing the lease
+        SchedulerLeases.release('scheduler-a')
+        assert SchedulerLeases.acquire('scheduler-b', 60)
+        assert not SchedulerLeases.acquire('scheduler-a', 60)
+        # Runs of a scheduler that lost the lease are not inserted
+        assert Scheduler._insert_new_task_runs_to_db(
+            [{'id': 1, 'task_type': 'NewsDownload', 'run_ds': datetime(2018, 7, 29)}],
+            lease_holder='scheduler-a',
+            lease_seconds=60
+        ) is None
+        assert Session().query(TaskRuns).count() == 1
+
+
+class TestBackfillPlanner(object):
+    def test_backfill(self, sqlite_engine, monkeypatch):
+        task = TasksMock(1, 'task1', False, 3600)
+        session = Session()
+        # Runs of the first two intervals exist. One is still running
+        session.add(TaskRuns(task_id=1, state=State.SUCCESS, run_ds=datetime(2018, 7, 1, 0)))
+        session.add(TaskRuns(task_id=1, state=State.RUNNING, run_ds=datetime(2018, 7, 1, 1)))
+        session.commit()
+
+        def finish_active_runs(seconds):
+            Session().query(TaskRuns).update({TaskRuns.state: State.SUCCESS})
+            Session().commit()
+
+        monkeypatch.setattr('propel.scheduler.time.sleep', finish_active_runs)
+
+        executor = ExecutorMock()
+        backfill_planner = BackfillPlanner(max_active_runs_per_task=3)
+        queued_runs = backfill_planner.backfill(
+            [task],
+            datetime(2018, 7, 1, 0),
+            datetime(2018, 7, 1, 5, 30),
+            executor
+        )
+        assert queued_runs == 4
+        # Two runs fit next to the running one. The rest are queued once those finish
+        assert [
+            [task_run_params['run_ds'].hour for task_run_params in batch]
+            for batch in executor.batches
+        ] == [[2, 3], [4, 5]]
+        assert Session().query(TaskRuns).count() == 6
+
+    def test_backfill_skips_runs_created_meanwhile(self, sqlite_engine, monkeypatch):
+        task = TasksMock(1, 'task1', False, 3600)
+        get_active_run_counts = BackfillPlanner.get_active_run_counts
+
+        def create_run_then_count(task_ids):
+            # Scheduler creates the run of the second interval after the backfill read runs
+            session = Session()
+            if not session.query(TaskRuns).count():
+                session.add(
+                    TaskRuns(task_id=1, state=State.SUCCESS, run_ds=datetime(2018, 7, 1, 1))
+                )
+                session.commit()
+            return get_active_run_counts(task_ids)
+
+        monkeypatch.setattr(
+            BackfillPlanner,
+            'get_active_run_counts',
+            staticmethod(create_run_then_count)
+        )
+        executor = ExecutorMock()
+        queued_runs = BackfillPlanner(max_active_runs_per_task=3).backfill(
+            [task],
+            datetime(2018, 7, 1, 0),
+            datetime(2018, 7, 1, 3),
+            executor
+        )
+        assert queued_runs == 3
+        assert [
+            [task_run_params['run_ds'].hour for task_run_params in batch]
+            for batch in executor.batches
+        ] == [[0, 2, 3]]
+        assert Session().query(TaskRuns).count() == 4
+
+
+class TestDagRunScheduler(object):
+    @staticmethod
+    def _get_dag():
+        # extract -> transform -> load and a report that only needs extract
+        dag = DAG('etl', 'ETL', True, datetime(2018, 7, 1, 0), 3600)
+        extract = SerializedTask('extract', 'NewsDownload', dag=dag)
+        transform = SerializedTask('transform', 'NewsDownload', dag=dag)
+        load = SerializedTask('load', 'NewsDownload', dag=dag)
+        report = SerializedTask('report', 'NewsDownload', params={'task_args': 'daily'}, dag=dag)
+        dag.add_upstream(transform, extract)
+        dag.add_upstream(load, transform)
+        dag.add_upstream(report, extract)
+        return dag
+
+    @staticmethod
+    def _set_state(task_run_params, state):
+        session = Session()
+        (
+            session
+            .query(TaskRuns)
+            .filter(TaskRuns.id == task_run_params['task_run_id'])
+            .update({TaskRuns.state: state})
+        )
+        session.commit()
+
+    @staticmethod
+    def _get_dag_run_state(run_ds):
+        return Session().query(DagRuns.state).filter(DagRuns.run_ds == run_ds).scalar()
+
+    @staticmethod
+    def _queued(executor):
+        return [(params['task_id'], params['run_ds'].hour) for params in executor.batches[-1]]
+
+    def test_schedule(self, sqlite_engine):
+        dag = self._get_dag()
+        executor = ExecutorMock()
+        dag_run_scheduler = DagRunScheduler(max_active_dag_runs=2)
+        assert dag_run_scheduler.schedule([dag], executor, datetime(2018, 7, 1, 3, 30))
+        # Three intervals are due but only two runs of the DAG can be active
+        session = Session()
+        dag_runs = session.query(DagRuns.run_ds).order_by(DagRuns.run_ds)
+        assert [run_ds.hour for run_ds, in dag_runs] == [1, 2]
+        assert session.query(TaskRuns).count() == 8
+        assert session.query(TaskRunDependencies).count() == 6
+        # Retry policy of the task type is stored on the task runs
+        assert set(session.query(TaskRuns.max_tries, TaskRuns.retry_delay_seconds)) == {(3, 30)}
+        assert sorted(self._queued(executor)) == [('extract', 1), ('extract', 2)]
+        assert executor.batches[-1][0]['interval_start_ds'] == datetime(2018, 7, 1, 0)
+
+        extract_1, extract_2 = sorted(executor.batches[-1], key=lambda params: params['run_ds'])
+        self._set_state(extract_1, State.SUCCESS)
+        self._set_state(extract_2, State.FAILED)
+        dag_run_scheduler.schedule([dag], executor, datetime(2018, 7, 1, 3, 30))
+        assert sorted(self._queued(executor)) == [('report', 1), ('transform', 1)]
+        report_1, = [params for params in executor.batches[-1] if params['task_id'] == 'report']
+        assert report_1['task_args'] == 'daily'
+        # Downstream runs of a failed run are not run and its DAG run fails
+        assert self._get_dag_run_state(datetime(2018, 7, 1, 2)) == State.FAILED
+        assert session.query(TaskRuns).filter(TaskRuns.state == State.UPSTREAM_FAILED).count() == 3
+
+        # A scheduler that takes over loads the counters from the DB
+        for params in executor.batches[-1]:
+            self._set_state(params, State.SUCCESS)
+        dag_run_scheduler = DagRunScheduler(max_active_dag_runs=2)
+        dag_run_scheduler.schedule([dag], executor, datetime(2018, 7, 1, 3, 30))
+        assert sorted(self._queued(executor)) == [('extract', 3), ('load', 1)]
+        load_1, = [params for params in executor.batches[-1] if params['task_id'] == 'load']
+        self._set_state(load_1, State.SUCCESS)
+        dag_run_scheduler.schedule([dag], executor, datetime(2018, 7, 1, 3, 30))
+        session.expire_all()
+        assert self._get_dag_run_state(datetime(2018, 7, 1, 1)) == State.SUCCESS
+
+    def test_schedule_stale_scheduler(self, sqlite_engine):
+        dag = self._get_dag()
+        executor = ExecutorMock()
+        stale_scheduler = DagRunScheduler(max_active_dag_runs=2)
+        stale_scheduler.schedule([dag], executor, datetime(2018, 7, 1, 3, 30))
+        extract_1, extract_2 = sorted(executor.batches[-1], key=lambda params: params['run_ds'])
+        self._set_state(extract_1, State.SUCCESS)
+        self._set_state(extract_2, State.RUNNING)
+        dag_run_scheduler = DagRunScheduler(max_active_dag_runs=2)
+        dag_run_scheduler.schedule([dag], executor, datetime(2018, 7, 1, 3, 30))
+        for params in executor.batches[-1]:
+            self._set_state(params, State.RUNNING)
+        batch_count = len(executor.batches)
+
+        # Runs queued by the other scheduler are not queued again
+        assert stale_scheduler.schedule([dag], executor, datetime(2018, 7, 1, 3, 30))
+        assert len(executor.batches) == batch_count
+        # Nor is anything queued once the lease is lost
+        self._set_state(extract_2, State.SUCCESS)
+        assert SchedulerLeases.acquire('other', 60)
+        assert not DagRunScheduler(max_active_dag_runs=2).schedule(
+            [dag], executor, datetime(2018, 7, 1, 3, 30), lease_holder='stale', lease_seconds=60
+        )
+        assert len(executor.batches) == batch_count
+        assert Session().query(TaskRuns).filter(TaskRuns.state == State.QUEUED).count() == 0
+
+
+class TestZombieReaper(object):
+    def test_reap(self, sqlite_engine):
+        session = Session()
+        now = datetime.utcnow()
+        long_ago = now - timedelta(minutes=10)
+        # Task run 1 has tries left, task run 2 used them up and task run 3 is alive
+        task_runs = [(1, 1, long_ago), (2, 3, long_ago), (3, 1, now)]
+        for task_run_id, try_number, last_heartbeat_time in task_runs:
+            session.add(TaskRuns(id=task_run_id, task_id=task_run_id, state=State.RUNNING,
+                                 run_ds=long_ago, try_number=try_number, updated_at=long_ago))
+            session.add(Heartbeats(task_run_id=task_run_id, task_type='BaseExecutor',
+                                   last_heartbeat_time=last_heartbeat_time))
+        # Task run 4 is up for retry but the executor holding it went away
+        session.add(TaskRuns(id=4, task_id=4, state=State.UP_FOR_RETRY, run_ds=long_ago,
+                             try_number=2, next_try_at=long_ago))
+        session.commit()
+        tasks = [
+            TasksMock(task_id, 'task{}'.format(task_id), False, 60)
+            for task_id in (1, 2, 3, 4)
+        ]
+
+        executor = ExecutorMock()
+        zombie_reaper = ZombieReaper(stale_seconds=60, max_tries=3)
+        assert zombie_reaper.reap(executor, tasks, SerializedDagBag()) == 2
+        assert [
+            (task_run_params['task_run_id'], task_run_params['try_number'])
+            for task_run_params in executor.batches[0]
+        ] == [(1, 2), (4, 2)]
+        assert executor.batches[0][0]['run_ds'] == long_ago
+        session.expire_all()
+        assert [
+            (task_run.state, task_run.try_number)
+            for task_run in session.query(TaskRuns).order_by(TaskRuns.id)
+        ] == [(State.QUEUED, 2), (State.FAILED, 3), (State.RUNNING, 1), (State.QUEUED, 2)]
+
+    def test_reap_queued_meanwhile(self, sqlite_engine, monkeypatch):
+        session = Session()
+        long_ago = datetime.utcnow() - timedelta(minutes=10)
+        session.add(TaskRuns(id=1, task_id=1, state=State.UP_FOR_RETRY, run_ds=long_ago,
+                             try_number=2, next_try_at=long_ago))
+        session.commit()
+        get_task_run_params = ZombieReaper._get_task_run_params
+
+        def queue_meanwhile(*args):
+            # Another reaper queues the run after this one found it
+            other_session = Session.session_factory()
+            (
+                other_session
+                .query(TaskRuns)
+                .filter(TaskRuns.id == 1)
+                .update({TaskRuns.state: State.QUEUED})
+            )
+            other_session.commit()
+            return get_task_run_params(*args)
+
+        monkeypatch.setattr(ZombieReaper, '_get_task_run_params', staticmethod(queue_meanwhile))
+        executor = ExecutorMock()
+        zombie_reaper = ZombieReaper(stale_seconds=60, max_tries=3)
+        tasks = [TasksMock(1, 'task1', False, 60)]
+        assert zombie_reaper.reap(executor, tasks, SerializedDagBag()) == 0
+        assert not executor.batches
+
+    def test_reap_without_lease(self, sqlite_engine):
+        session = Session()
+        long_ago = datetime.utcnow() - timedelta(minutes=10)
+        session.add(TaskRuns(id=1, task_id=1, state=State.UP_FOR_RETRY, run_ds=long_ago,
+                             try_number=2, next_try_at=long_ago))
+        session.commit()
+        # Another scheduler took over the lease
+        assert SchedulerLeases.acquire('other', 60)
+        executor = ExecutorMock()
+        zombie_reaper = ZombieReaper(stale_seconds=60, max_tries=3)
+        assert zombie_reaper.reap(
+            executor,
+            [TasksMock(1, 'task1', False, 60)],
+            SerializedDagBag(),
+            lease_holder='scheduler',
+            lease_seconds=60
+        ) is None
+        assert not executor.batches
+        session.expire_all()
+        assert session.query(TaskRuns.state).scalar() == State.UP_FOR_RETRY
@@ -0,0 +1,59 @@
+import json
+
+from propel.utils.events import RedisTaskRunEvents
+from propel.utils.state import State
+
+
+class PubSubMock(object):
+    def __init__(self, messages):
+        self.messages = messages
+        self.timeouts = list()
+
+    def subscribe(self, channel):
+        self.channel = channel
+
+    def get_message(self, timeout=0):
+        self.timeouts.append(timeout)
+        if self.messages:
+            return self.messages.pop(0)
+        return None
+
+
+class RedisMock(object):
+    def __init__(self):
+        self.published = list()
+        self.pubsub_mock = PubSubMock(list())
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+        self.pubsub_mock.messages.append({'type': 'message', 'channel': channel, 'data': message})
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return self.pubsub_mock
+
+
+class TestRedisTaskRunEvents(object):
+    def test_wait(self, monkeypatch):
+        redis_mock = RedisMock()
+        monkeypatch.setattr('redis.StrictRedis.from_url', staticmethod(lambda url: redis_mock))
+        task_run_events = RedisTaskRunEvents(url='redis://localhost:6379/0')
+
+        task_run_events.publish(1, State.SUCCESS)
+        task_run_events.publish(2, State.FAILED)
+        assert json.loads(redis_mock.published[0][1]) == {'task_run_id': 1, 'state': State.SUCCESS}
+        # Every buffered event is returned by a single wait
+        assert task_run_events.wait(5) == [(1, State.SUCCESS), (2, State.FAILED)]
+        # Nothing finished. Waits out the timeout
+        assert task_run_events.wait(0.01) == []
+        assert 0 < redis_mock.pubsub_mock.timeouts[-1] <= 0.01
+
+    def test_publish_failure(self, monkeypatch):
+        redis_mock = RedisMock()
+
+        def publish_failure(channel, message):
+            raise IOError('Connection refused')
+
+        redis_mock.publish = publish_failure
+        monkeypatch.setattr('redis.StrictRedis.from_url', staticmethod(lambda url: redis_mock))
+        # A task run does not fail because its event could not be published
+        RedisTaskRunEvents(url='redis://localhost:6379/0').publish(1, State.SUCCESS)
@@ -1,8 +1,116 @@
+import billiard
 import os
 import pytest
 import signal
+import sys
+import time
 
-from propel.utils.general import HeartbeatMixin
+from propel.exceptions import PropelException
+from propel.models import Heartbeats
+from propel.settings import logger
+from propel.utils.general import (HeartbeatMixin, HeartbeatTimer, JsonPath, JsonPathPlan,
+                                  compile_json_path, extract_from_json, prefetch,
+                                  redirect_output)
+
+
+class TestJsonPath(object):
+
+    @pytest.fixture
+    def input_json(self):
+        return {
+            'name': {'first': 'Dilly', 'last': 'Berty'},
+            'phone': [
+                {'area': 111, 'number': 222333},
+                {'area': 444, 'number': 555666},
+                {'area': 'aaa', 'number': 'bbbccc'}
+            ]
+        }
+
+    @pytest.mark.parametrize('operations, expected', [
+        ('name', {'first': 'Dilly', 'last': 'Berty'}),
+        ('name.first', 'Dilly'),
+        ('name.middle', None),
+        ('phone.{area=="aaa"}', None),
+        ('phone.[*].{area=="aaa"}', {'area': 'aaa', 'number': 'bbbccc'}),
+        ('phone.[*].{area!=111}', [{'area': 444, 'number': 555666},
+                                   {'area': 'aaa', 'number': 'bbbccc'}]),
+        ('phone.[*].{area!=111}.[0]', {'area': 444, 'number': 555666}),
+        ('phone.[*].{area!=111}.[5]', None),
+        ('phone.[*].number', [222333, 555666, 'bbbccc']),
+        ('phone.(area)', None),
+    ])
+    def test_extract_from_json(self, input_json, operations, expected):
+        assert extract_from_json(input_json, operations) == expected
+
+    def test_compiled_path_is_reusable(self, input_json):
+        json_path = JsonPath('phone.[*].{area>=444}.number')
+        assert json_path.extract(input_json) == [555666, 'bbbccc']
+        assert json_path.extract({'phone': [{'area': 500, 'number': 1}]}) == 1
+        assert json_path.extract({}) is None
+
+    def test_compile_json_path_is_cached(self):
+        assert compile_json_path('name.first') is compile_json_path('name.first')
+
+    def test_filter_value_is_not_evaluated(self, input_json):
+        with pytest.raises(PropelException):
+            JsonPath('phone.[*].{area==__import__("os")}')
+        assert extract_from_json(input_json, 'phone.[*].{area==__import__("os")}') is None
+
+    def test_plan_matches_extract_from_json(self, input_json):
+        operations_map = {
+            'name': 'name',
+            'first_name': 'name.first',
+            'last_name': 'name.last',
+            'numbers': 'phone.[*].number',
+            'first_number': 'phone.[*].[0].number',
+            'aaa_number': 'phone.[*].{area=="aaa"}.number',
+            'missing': 'phone.[*].{area==1}.[0].number',
+            'not_a_list': 'name.[*].first',
+        }
+        plan = JsonPathPlan(operations_map)
+        assert plan.extract(input_json) == {
+            name: extract_from_json(input_json, operations)
+            for name, operations in operations_map.items()
+        }
+        assert plan.extract(None) == dict.fromkeys(operations_map)
+
+    def test_plan_shares_prefixes(self):
+        plan = JsonPathPlan({'first_name': 'name.first', 'last_name': 'name.last'})
+        assert len(plan.root.children) == 1
+        assert len(plan.root.children[0].children) == 2
+
+
+class TestPrefetch(object):
+
+    def test_prefetch(self):
+        assert list(prefetch(iter(range(10)), size=2)) == list(range(10))
+
+    def test_prefetch_raises_producer_exception(self):
+        def pages():
+            yield 1
+            raise RuntimeError('Boink Boink')
+
+        prefetched = prefetch(pages())
+        assert next(prefetched) == 1
+        with pytest.raises(RuntimeError, match='Boink Boink'):
+            next(prefetched)
+
+
+class TestRedirectOutput(object):
+
+    def test_restores_previous_output(self, tmpdir, capsys):
+        stdout, stderr = sys.stdout, sys.stderr
+        handlers = list(logger.handlers)
+        log_file = tmpdir.join('task.log')
+        with redirect_output(log_file.strpath):
+            print('Redirected')
+            logger.info('Logged')
+        assert (sys.stdout, sys.stderr) == (stdout, stderr)
+        assert logger.handlers == handlers
+        print('Not redirected')
+        assert 'Redirected' in log_file.read()
+        assert 'Logged' in log_file.read()
+        assert capsys.readouterr()[0] == 'Not redirected\n'
 
 
 class TestHeartbeatMixin(object):
@@ -11,7 +119,7 @@ class TestHeartbeatMixin(object):
     def heartbeat_mixin_instance(self, monkeypatch):
         # Since we have no DB access mocking the method that updates heartbeat model
         def mock__update_heartbeat(*args, **kwargs):
-            return None
+            return HeartbeatMock(1)
 
         monkeypatch.setattr(HeartbeatMixin, '_update_heartbeat', mock__update_heartbeat)
         return HeartbeatMixin()
@@ -74,3 +182,123 @@ class TestHeartbeatMixin(object):
     ):
         with pytest.raises(SystemExit):
             heartbeat_mixin_instance.heartbeat(thread_function=function_sysint)
+
+    def test_heartbeat_in_process(self, heartbeat_mixin_instance, function_with_exception, tmpdir):
+        tmp_file = tmpdir.join("tmp_file.txt").strpath
+        heartbeat_mixin_instance.heartbeat(
+            thread_function=lambda *args: sys.stdout.write('Tring Tring with {}'.format(args)),
+            thread_args=[1, 2, 3],
+            log_file=tmp_file,
+            isolate=False
+        )
+        with open(tmp_file) as f:
+            assert 'Tring Tring with (1, 2, 3)' in f.read()
+        with pytest.raises(RuntimeError, match="Boink Boink"):
+            heartbeat_mixin_instance.heartbeat(
+                thread_function=function_with_exception,
+                isolate=False
+            )
+
+
+class HeartbeatMock(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class TestHeartbeatTimer(object):
+    @pytest.fixture
+    def touched_heartbeat_ids(self, monkeypatch):
+        touched_heartbeat_ids = list()
+
+        def mock__update_heartbeat(self, heartbeat, heartbeat_model_kwargs):
+            return HeartbeatMock(heartbeat_model_kwargs['task_run_id'])
+
+        monkeypatch.setattr(HeartbeatMixin, '_update_heartbeat', mock__update_heartbeat)
+        monkeypatch.setattr(Heartbeats, 'touch', staticmethod(touched_heartbeat_ids.append))
+        return touched_heartbeat_ids
+
+    def test_send_heartbeats(self, touched_heartbeat_ids):
+        heartbeat_timer = HeartbeatTimer(heartbeat_seconds=0.05)
+        assert heartbeat_timer.add(HeartbeatMixin(), {'task_run_id': 1}) == 1
+        assert heartbeat_timer.add(HeartbeatMixin(), {'task_run_id': 2}) == 2
+        heartbeat_timer.remove(1)
+        time.sleep(0.2)
+        # Heartbeats of runs that were not removed are updated together
+        assert touched_heartbeat_ids and set(map(tuple, touched_heartbeat_ids)) == {(2,)}
+        heartbeat_timer.remove(2)
+        time.sleep(0.1)
+        # Thread stops once there are no heartbeats to send
+        assert heartbeat_timer._thread is None
+
+    def test_collect_from_child_processes(self, touched_heartbeat_ids, monkeypatch):
+        heartbeat_timer = HeartbeatTimer(heartbeat_seconds=0.05)
+        monkeypatch.setattr(HeartbeatTimer, '_instance', heartbeat_timer)
+        monkeypatch.setattr(HeartbeatTimer, '_instance_pid', os.getpid())
+        heartbeat_timer.collect_from_child_processes()
+
+        def run_task():
+            HeartbeatTimer.get_instance().add(HeartbeatMixin(), {'task_run_id': 3})
+            time.sleep(0.3)
+
+        child_process = billiard.Process(target=run_task)
+        child_process.start()
+        child_process.join()
+        # Child's heartbeats were sent by the parent while the child was alive
+        assert [3] in touched_heartbeat_ids
+        time.sleep(0.1)
+        # Child died without removing its heartbeat
+        assert heartbeat_timer._heartbeat_pids == dict()
+
+
+class TestHeartbeatMixinDb(object):
+    """
+    Heartbeats written to the DB by the real _update_heartbeat
+    """
+
+    @staticmethod
+    def _get_heartbeat_times():
+        from propel.settings import Session
+        session = Session()
+        heartbeat_times = [
+            last_heartbeat_time
+            for last_heartbeat_time, in (
+                session
+                .query(Heartbeats.last_heartbeat_time)
+                .filter(Heartbeats.task_run_id == 1)
+            )
+        ]
+        session.close()
+        return heartbeat_times
+
+    def test_heartbeat_in_process(self, sqlite_engine, monkeypatch):
+        heartbeat_timer = HeartbeatTimer(heartbeat_seconds=0.05)
+        monkeypatch.setattr(HeartbeatTimer, '_instance', heartbeat_timer)
+        monkeypatch.setattr(HeartbeatTimer, '_instance_pid', os.getpid())
+        heartbeat_times = list()
+
+        def run_task():
+            heartbeat_times.extend(self._get_heartbeat_times())
+            time.sleep(0.2)
+
+        HeartbeatMixin().heartbeat(
+            thread_function=run_task,
+            heartbeat_model_kwargs={'task_run_id': 1},
+            isolate=False
+        )
+        # Heartbeat row is created before the task runs and updated while it runs
+        assert len(heartbeat_times) == 1
+        last_heartbeat_time, = self._get_heartbeat_times()
+        assert last_heartbeat_time > heartbeat_times[0]
+
+    def test_run_heartbeat(self, sqlite_engine, monkeypatch):
+        monkeypatch.setattr(signal, 'signal', lambda *args: None)
+        monkeypatch.setattr(
+            'propel.configuration.get',
+            lambda section, key: '0' if key == 'heartbeat_seconds' else None
+        )
+        HeartbeatMixin()._run_heartbeat(
+            thread_function=time.sleep,
+            thread_args=[0.1],
+            heartbeat_model_kwargs={'task_run_id': 1}
+        )
+        assert len(self._get_heartbeat_times()) == 1
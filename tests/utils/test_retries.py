@@ -0,0 +1,25 @@
+from propel.utils.retries import RetryPolicy
+
+
+class TestRetryPolicy(object):
+    def test_for_task_type(self):
+        # max_tries of TwitterExtract is overridden in its own section
+        assert RetryPolicy.for_task_type('TwitterExtract').max_tries == 5
+        assert RetryPolicy.for_task_type('NewsDownload').max_tries == 3
+        assert RetryPolicy.for_task_type('NewsDownload').retry_delay_seconds == 30
+
+    def test_get_delay_seconds(self):
+        retry_policy = RetryPolicy(
+            max_tries=5,
+            retry_delay_seconds=30,
+            max_retry_delay_seconds=100,
+            retry_jitter=0
+        )
+        delays = [retry_policy.get_delay_seconds(try_number) for try_number in (1, 2, 3, 4)]
+        assert delays == [30, 60, 100, 100]
+        assert retry_policy.should_retry(4)
+        assert not retry_policy.should_retry(5)
+        retry_policy.retry_jitter = 0.5
+        delays = [retry_policy.get_delay_seconds(2) for _ in range(100)]
+        assert all(30 <= delay <= 60 for delay in delays)
+        assert len(set(delays)) > 1